@@ -16,6 +16,7 @@ from accounts.models import (Availability, Education, Employment, Instructor, In
                              InstructorPlaceForLessons, InstructorReview, Parent, Student,
                              SpecialNeeds, StudentDetails, TiedStudent)
 from accounts.utils import get_geopoint_from_location
+from core.admin_search import TrigramSearchMixin
 
 User = get_user_model()
 
@@ -73,7 +74,7 @@ class InstructorPlaceForLessonsAdmin(admin.TabularInline):
     extra = 1
 
 
-class InstructorAdmin(admin.ModelAdmin):
+class InstructorAdmin(TrigramSearchMixin, admin.ModelAdmin):
     fields = ('user', 'display_name', 'age', 'avatar', 'bio_title', 'bio_description', 'bg_status', 'location', 'timezone',
               'music', 'screened', 'languages', 'studio_address', 'travel_distance', 'years_of_experience', 'video',
               'zoom_link')
@@ -204,10 +205,11 @@ class HasCoordinatesFilter(admin.SimpleListFilter):
             return queryset.filter(coordinates__isnull=True)
 
 
-class StudentAdmin(admin.ModelAdmin):
+class StudentAdmin(TrigramSearchMixin, admin.ModelAdmin):
     fields = ('user', 'display_name', 'age', 'avatar', 'birthday', 'gender', 'location', 'timezone', )
     list_display = ('pk', 'user', 'display_name',)
     list_filter = ('gender', HasCoordinatesFilter,)
+    list_select_related = ('user', )
     search_fields = ('user__email', 'display_name',)
     readonly_fields = ('user', 'display_name', 'age', 'timezone', )
 
@@ -253,10 +255,11 @@ class StudentDetailsAdmin(admin.ModelAdmin):
     get_tied_student_name.admin_order_field = 'tied_student__name'
 
 
-class ParentAdmin(admin.ModelAdmin):
+class ParentAdmin(TrigramSearchMixin, admin.ModelAdmin):
     fields = ('user', 'display_name', 'age', 'avatar', 'birthday', 'gender', 'location', 'timezone', )
     list_display = ('pk', 'user', 'display_name',)
     list_filter = ('gender', HasCoordinatesFilter,)
+    list_select_related = ('user', )
     search_fields = ('user__email', 'display_name',)
     readonly_fields = ('user', 'display_name', 'age', 'timezone', )
     inlines = (TiedStudentInline,)
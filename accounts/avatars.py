@@ -0,0 +1,71 @@
+"""Processing of uploaded avatars: image is decoded and validated with Pillow, and square thumbnails of fixed
+sizes are stored (in WebP and JPEG formats) next to original one, so lists can use small images."""
+from io import BytesIO
+from os import path
+
+from PIL import Image, ImageOps, features
+
+from django.core.files.base import ContentFile
+
+AVATAR_SIZES = {'small': 64, 'medium': 160, 'large': 320}   # side, in pixels
+AVATAR_FORMATS = {'webp': ('WEBP', 'webp', {'quality': 80, 'method': 4}),
+                  'jpeg': ('JPEG', 'jpg', {'quality': 85, 'optimize': True, 'progressive': True})}
+AVATAR_MAX_PIXELS = 40000000
+
+
+class InvalidAvatarError(Exception):
+    pass
+
+
+def open_avatar(field_file):
+    """Return decoded image (in RGB mode, oriented as indicated by EXIF data) of an avatar file.
+    Raise InvalidAvatarError if file is not a valid image"""
+    field_file.open('rb')
+    try:
+        content = field_file.read()
+    finally:
+        field_file.close()
+    try:
+        image = Image.open(BytesIO(content))
+        image.verify()
+        image = Image.open(BytesIO(content))   # verify() leaves image unusable
+        if image.width * image.height > AVATAR_MAX_PIXELS:
+            raise InvalidAvatarError(f'Image is too large ({image.width}x{image.height})')
+        image.load()
+    except (IOError, SyntaxError, ValueError, Image.DecompressionBombError) as e:
+        raise InvalidAvatarError(str(e))
+    image = ImageOps.exif_transpose(image)
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.split()[-1])
+        image = background
+    elif image.mode != 'RGB':
+        image = image.convert('RGB')
+    return image
+
+
+def build_avatar_variants(field_file):
+    """Store thumbnails of avatar in its storage; return their names, by size and format"""
+    image = open_avatar(field_file)
+    storage = field_file.storage
+    base_name = path.splitext(field_file.name)[0]
+    formats = [fmt for fmt in AVATAR_FORMATS if fmt != 'webp' or features.check('webp')]
+    variants = {}
+    for size_name, size in AVATAR_SIZES.items():
+        thumbnail = ImageOps.fit(image, (size, size), Image.LANCZOS)
+        variants[size_name] = {}
+        for fmt in formats:
+            pil_format, extension, options = AVATAR_FORMATS[fmt]
+            buffer = BytesIO()
+            thumbnail.save(buffer, pil_format, **options)
+            variants[size_name][fmt] = storage.save(f'{base_name}_{size_name}.{extension}',
+                                                    ContentFile(buffer.getvalue()))
+    return variants
+
+
+def delete_avatar_variants(storage, variants):
+    """Remove stored thumbnails of an avatar, given their names by size and format"""
+    for names in variants.values():
+        for name in names.values():
+            storage.delete(name)
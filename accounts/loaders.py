@@ -0,0 +1,43 @@
+"""Request-scoped identity map of accounts (Instructor, Parent or Student instances), keyed by user id.
+Inside a scope (opened for each request by AccountLoaderMiddleware), get_account returns the same instance
+for a user every time, and prime_accounts loads accounts of many users with one query per role;
+outside a scope, nothing is cached."""
+import threading
+from contextlib import contextmanager
+
+_state = threading.local()
+
+
+def is_active():
+    return getattr(_state, 'depth', 0) > 0
+
+
+@contextmanager
+def account_loader_scope():
+    """Open a scope for cached accounts; nested scopes share the cache of outermost one"""
+    if not is_active():
+        _state.accounts = {}
+    _state.depth = getattr(_state, 'depth', 0) + 1
+    try:
+        yield
+    finally:
+        _state.depth -= 1
+        if not _state.depth:
+            _state.accounts = {}
+
+
+def get_cached_account(user_id):
+    """Return cached account of user, or None"""
+    if not is_active():
+        return None
+    return _state.accounts.get(user_id)
+
+
+def cache_account(user_id, account):
+    if is_active() and account is not None:
+        _state.accounts[user_id] = account
+
+
+def discard_account(user_id):
+    if is_active():
+        _state.accounts.pop(user_id, None)
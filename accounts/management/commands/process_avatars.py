@@ -0,0 +1,24 @@
+from django.core.management import BaseCommand
+
+from accounts.models import Instructor, Parent, Student
+from accounts.tasks import process_avatar
+from core.models import TaskLog
+
+
+class Command(BaseCommand):
+    """Queue building of thumbnails for avatars uploaded before they were generated"""
+    help = 'Queue building of thumbnails for avatars without them'
+
+    def handle(self, *args, **options):
+        self.stdout.write('Start process ...')
+        self.stdout.flush()
+        for model in (Instructor, Parent, Student):
+            accounts = model.objects.exclude(avatar__isnull=True).exclude(avatar='').filter(avatar_variants={})
+            for account_id, avatar_name in accounts.values_list('id', 'avatar').iterator():
+                args = {'model_label': model._meta.label, 'account_id': account_id, 'avatar_name': avatar_name}
+                task_log = TaskLog.objects.create(task_name='process_avatar', args=args)
+                process_avatar.delay(*args.values(), task_log.id)
+                self.stdout.write(' . ')
+                self.stdout.flush()
+        self.stdout.write('Process complete ...')
+        self.stdout.flush()
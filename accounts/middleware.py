@@ -0,0 +1,12 @@
+from .loaders import account_loader_scope
+
+
+class AccountLoaderMiddleware:
+    """Keep accounts loaded during a request in a cache, so each one is queried once at most"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with account_loader_scope():
+            return self.get_response(request)
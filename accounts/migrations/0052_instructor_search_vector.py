@@ -0,0 +1,43 @@
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+def fill_search_vectors(apps, schema_editor):
+    """Same document as Instructor.update_search_vectors, as of this migration"""
+    table = apps.get_model('accounts', 'Instructor')._meta.db_table
+    instruments_table = apps.get_model('accounts', 'InstructorInstruments')._meta.db_table
+    instrument_table = apps.get_model('lesson', 'Instrument')._meta.db_table
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            f"UPDATE {table} SET search_vector = "
+            f"setweight(to_tsvector('english', coalesce(display_name, '') || ' ' || coalesce("
+            f"(SELECT string_agg(ins.name, ' ') FROM {instruments_table} ii "
+            f"JOIN {instrument_table} ins ON ins.id = ii.instrument_id "
+            f"WHERE ii.instructor_id = {table}.id), '')), 'A') || "
+            f"setweight(to_tsvector('english', coalesce(bio_title, '') || ' ' "
+            f"|| array_to_string(coalesce(music, '{{}}'), ' ') || ' ' "
+            f"|| array_to_string(coalesce(languages, '{{}}'), ' ')), 'B') || "
+            f"setweight(to_tsvector('english', coalesce(bio_description, '')), 'C')")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0051_avatar_variants'),
+        ('lesson', '0028_auto_20201003_1644'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='instructor',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='instructor',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'],
+                                                           name='instructor_search_vector_gin'),
+        ),
+        migrations.RunPython(fill_search_vectors, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+import django.contrib.postgres.indexes
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0052_instructor_search_vector'),
+        ('core', '0023_user_trigram_indexes'),   # creates pg_trgm extension
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='instructor',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['display_name'], name='instructor_display_name_trgm',
+                                                           opclasses=['gin_trgm_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='parent',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['display_name'], name='parent_display_name_trgm',
+                                                           opclasses=['gin_trgm_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='student',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['display_name'], name='student_display_name_trgm',
+                                                           opclasses=['gin_trgm_ops']),
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0053_display_name_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='instructor',
+            name='request_alert_sent_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -8,19 +8,31 @@ from pygeocoder import Geocoder, GeocoderError
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.gis.db.models import PointField
-from django.contrib.postgres.fields import HStoreField, ArrayField
-from django.db import models
+from django.contrib.postgres.fields import HStoreField, ArrayField, JSONField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.db import connection, models, transaction
 from django.db.models import Avg, Count
 from django.utils import timezone
 
+from accounts.loaders import cache_account, get_cached_account, is_active as loader_is_active
 from accounts.utils import add_to_email_list
 
+from core.cache import invalidate_cache_tags
 from core.constants import *
 from core.utils import send_admin_email
 
 User = get_user_model()
 coolname_config = load_config(path.join(settings.BASE_DIR, 'accounts', 'data'))
 generator = RandomGenerator(coolname_config)
+SEARCH_CONFIG = 'english'   # text search configuration for instructor profiles
+
+
+def get_referral_token_base(first_name, last_name):
+    """Return base for referral token of an user: first name and initial of last name (as in display name),
+    without spaces or dots, or a random name when user has no names"""
+    token = re.sub(r'[\s.]', '', f'{first_name or ""}{(last_name or "")[:1]}').lower()
+    return token or ''.join(generator.generate())
 
 
 def avatar_directory_path(instance, filename):
@@ -33,6 +45,7 @@ class IUserAccount(models.Model):
     display_name = models.CharField(max_length=100, blank=True, null=True)   # updated after save() method in User
     gender = models.CharField(max_length=100, blank=True, null=True, choices=GENDER_CHOICES)
     avatar = models.ImageField(blank=True, null=True, upload_to=avatar_directory_path)
+    avatar_variants = JSONField(blank=True, default=dict)   # names of thumbnails, by size and format
     birthday = models.DateField(blank=True, null=True)
     location = models.CharField(max_length=150, default='')
     coordinates = PointField(blank=True, null=True)
@@ -53,6 +66,15 @@ class IUserAccount(models.Model):
     def role(self):
         raise Exception('IUserAccount child class must implement this attribute')
 
+    def get_avatar_variants(self):
+        """Return URLs of avatar thumbnails, by size and format ({'small': {'webp': url, 'jpeg': url}, ...});
+        empty if there is no avatar, or it has not been processed yet"""
+        if not self.avatar:
+            return {}
+        storage = self.avatar.storage
+        return {size: {fmt: storage.url(name) for fmt, name in names.items()}
+                for size, names in self.avatar_variants.items()}
+
     @property
     def age(self):
         today = timezone.now()
@@ -155,37 +177,7 @@ class IUserAccount(models.Model):
         """Set referral token to related user.
         By placing here (account model), the existence of account is assured"""
         if not self.user.referral_token or self.user.referral_token[-6:].isdigit():   # assure to change only when is necessary
-            if not self.display_name.strip():
-                self.set_display_name()
-            if self.display_name.strip():
-                token = self.display_name.replace(' ', '').replace('.', '').lower()
-                regex = '^' + token + '\d*$'
-                regex2 = '^' + token + '(\d*)$'
-                existing_token = User.objects.filter(referral_token__iregex=regex)\
-                    .values_list('referral_token', flat=True).last()
-                if existing_token:
-                    res = re.match(regex2, existing_token)
-                    num_str = res.groups()[0]
-                    if not num_str:
-                        num_str = '1'
-                    token += str(int(num_str) + 1)
-            else:
-                for ind in range(20):
-                    token = ''.join(generator.generate())
-                    regex = '^' + token + '\d*$'
-                    regex2 = '^' + token + '(\d*)$'
-                    existing_token = User.objects.filter(referral_token__iregex=regex)\
-                        .values_list('referral_token', flat=True).last()
-                    if existing_token is None:
-                        break
-                if existing_token:
-                    res = re.match(regex2, existing_token)
-                    num_str = res.groups()[0]
-                    if not num_str:
-                        num_str = '1'
-                    token += str(int(num_str) + 1)
-            self.user.referral_token = token
-            self.user.save()
+            self.user.set_referral_token(get_referral_token_base(self.user.first_name, self.user.last_name))
 
     def get_lessons(self):
         from lesson.models import Lesson, LessonBooking
@@ -247,6 +239,9 @@ class Parent(IUserAccount):
     news_updates = models.BooleanField(default=False)
     offers = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [GinIndex(fields=['display_name'], name='parent_display_name_trgm', opclasses=['gin_trgm_ops'])]
+
     @property
     def role(self):
         return 'Parent'
@@ -282,12 +277,39 @@ class Instructor(IUserAccount):
     payment_receipts = models.BooleanField(default=False)
     news_updates = models.BooleanField(default=False)
     offers = models.BooleanField(default=False)
+    # last alert of new lesson request, to throttle alerts sent to instructor
+    request_alert_sent_at = models.DateTimeField(blank=True, null=True)
 
     disclosure_accepted_at = models.DateTimeField(blank=True, null=True)
+    # weighted document for full-text search, updated by update_search_vectors
+    search_vector = SearchVectorField(blank=True, null=True, editable=False)
+
+    class Meta:
+        indexes = [GinIndex(fields=['search_vector'], name='instructor_search_vector_gin'),
+                   GinIndex(fields=['display_name'], name='instructor_display_name_trgm', opclasses=['gin_trgm_ops'])]
 
     def __str__(self):
         return f'Instructor {self.user}'
 
+    @classmethod
+    def update_search_vectors(cls, instructor_ids):
+        """Update search_vector of instructors, in a single query: display name and instruments have greater
+        weight, followed by bio title, music genres and languages, and bio description"""
+        from lesson.models import Instrument
+        table = cls._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {table} SET search_vector = "
+                f"setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(display_name, '') || ' ' || coalesce("
+                f"(SELECT string_agg(ins.name, ' ') FROM {InstructorInstruments._meta.db_table} ii "
+                f"JOIN {Instrument._meta.db_table} ins ON ins.id = ii.instrument_id "
+                f"WHERE ii.instructor_id = {table}.id), '')), 'A') || "
+                f"setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(bio_title, '') || ' ' "
+                f"|| array_to_string(coalesce(music, '{{}}'), ' ') || ' ' "
+                f"|| array_to_string(coalesce(languages, '{{}}'), ' ')), 'B') || "
+                f"setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(bio_description, '')), 'C') "
+                f"WHERE id = ANY(%s)", [list(instructor_ids)])
+
     @property
     def role(self):
         return 'Instructor'
@@ -319,6 +341,7 @@ class Instructor(IUserAccount):
         curr_value = self.is_complete()
         if curr_value != self.complete:
             Instructor.objects.filter(id=self.id).update(complete=curr_value)   # update to avoid trigger signal for save
+            transaction.on_commit(lambda: invalidate_cache_tags('instructors'))
             if curr_value:
                 add_to_email_list(self.user, [], ['incomplete_profiles'])
 
@@ -583,6 +606,9 @@ class InstructorReview(models.Model):
 class Student(IUserAccount):
     parent = models.ForeignKey(Parent, on_delete=models.SET_NULL, blank=True, null=True, related_name='students')
 
+    class Meta:
+        indexes = [GinIndex(fields=['display_name'], name='student_display_name_trgm', opclasses=['gin_trgm_ops'])]
+
     @property
     def role(self):
         return 'Student'
@@ -641,47 +667,49 @@ class Affiliate(models.Model):
 
     def set_referrral_token(self):
         if not self.user.referral_token:   # assure to change only when is necessary
-            token = ''
-            if self.user.first_name or self.user.last_name:
-                if self.user.first_name:
-                    token = self.user.first_name.lower()
-                if token:
-                    if self.user.last_name:
-                        token += self.user.last_name[0].lower()
-            if token:
-                regex = '^' + token + '\d*$'
-                regex2 = '^' + token + '(\d*)$'
-                existing_token = User.objects.filter(referral_token__iregex=regex) \
-                    .values_list('referral_token', flat=True).last()
-                if existing_token:
-                    res = re.match(regex2, existing_token)
-                    num_str = res.groups()[0]
-                    if not num_str:
-                        num_str = '1'
-                    token += str(int(num_str) + 1)
-            else:
-                for ind in range(20):
-                    token = ''.join(generator.generate())
-                    regex = '^' + token + '\d*$'
-                    regex2 = '^' + token + '(\d*)$'
-                    existing_token = User.objects.filter(referral_token__iregex=regex)\
-                        .values_list('referral_token', flat=True).last()
-                    if existing_token is None:
-                        break
-                if existing_token:
-                    res = re.match(regex2, existing_token)
-                    num_str = res.groups()[0]
-                    if not num_str:
-                        num_str = '1'
-                    token += str(int(num_str) + 1)
-            self.user.referral_token = token
-            self.user.save()
+            self.user.set_referral_token(get_referral_token_base(self.user.first_name, self.user.last_name))
+
+
+def _get_account_model(role):
+    if role == ROLE_INSTRUCTOR:
+        return Instructor
+    if role == ROLE_PARENT:
+        return Parent
+    return Student
 
 
 def get_account(user):
-    """Get Instructor, Parent or Student instance, related to User instance."""
-    if user.get_role() == ROLE_INSTRUCTOR:
-        return Instructor.objects.filter(user=user).first()
-    if user.get_role() == ROLE_PARENT:
-        return Parent.objects.filter(user=user).first()
-    return Student.objects.filter(user=user).first()
+    """Get Instructor, Parent or Student instance, related to User instance.
+    During a request, account is taken from request-scoped cache when it was loaded before."""
+    account = get_cached_account(user.id)
+    if account is None:
+        account = _get_account_model(user.get_role()).objects.filter(user=user).first()
+        if account:
+            account.user = user
+            cache_account(user.id, account)
+    return account
+
+
+def prime_accounts(users):
+    """Load accounts of users into request-scoped cache, with one query per role, so next calls to get_account
+    for these users make no query. Users without stored role are looked up in every account model.
+    Outside a request scope, nothing is done."""
+    if not loader_is_active():
+        return None
+    pending = {}
+    for user in users:
+        if user is not None and user.id and get_cached_account(user.id) is None:
+            pending.setdefault(user.role, {})[user.id] = user
+    unknown = pending.pop('', {})
+    unknown.update(pending.pop(None, {}))
+    queries = {}
+    for role, users_by_id in pending.items():
+        queries.setdefault(_get_account_model(role), {}).update(users_by_id)
+    if unknown:
+        for model in (Instructor, Parent, Student):
+            queries.setdefault(model, {}).update(unknown)
+    for model, users_by_id in queries.items():
+        for account in model.objects.filter(user_id__in=list(users_by_id.keys())):
+            if get_cached_account(account.user_id) is None:
+                account.user = users_by_id[account.user_id]
+                cache_account(account.user_id, account)
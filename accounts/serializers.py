@@ -2,27 +2,57 @@ import re
 
 from django.contrib.auth import get_user_model
 from django.contrib.gis.geos import Point
+from django.core.exceptions import ObjectDoesNotExist
 from django.db import transaction
-from django.utils import timezone
 
 from rest_framework import serializers, validators
 
 from core.constants import (
     DAY_TUPLE, GENDER_CHOICES, LESSON_DURATION_30, PLACE_FOR_LESSONS_ONLINE, SKILL_LEVEL_CHOICES, PHONE_TYPE_MAIN,
 )
-from core.models import UserBenefits
+from core.models import TaskLog, UserBenefits
 from core.utils import update_model
 from lesson.models import Instrument, Lesson
 
+from .avatars import delete_avatar_variants
 from .models import (Affiliate, Availability, Education, Employment, Instructor, InstructorAdditionalQualifications,
                      InstructorAgeGroup, InstructorInstruments, InstructorPlaceForLessons, InstructorLessonRate,
                      InstructorLessonSize, InstructorReview, Parent, PhoneNumber, SpecialNeeds, Student, StudentDetails,
-                     TiedStudent, get_account)
-from .utils import add_to_email_list, init_kwargs
+                     TiedStudent, get_account, get_referral_token_base, prime_accounts)
+from .tasks import add_user_to_email_lists, process_avatar, set_account_timezone
+from .utils import init_kwargs
 
 User = get_user_model()
 
 
+def schedule_registration_tasks(account, list_names):
+    """Execute side effects of registration (time zone, email lists) in tasks, after commit,
+    so requests to external APIs don't delay registration"""
+    user_id = account.user_id
+    if account.coordinates:
+        tz_log = TaskLog.objects.create(task_name='set_account_timezone', args={'user_id': user_id})
+        transaction.on_commit(lambda: set_account_timezone.delay(user_id, tz_log.id))
+    lists_log = TaskLog.objects.create(task_name='add_user_to_email_lists',
+                                       args={'user_id': user_id, 'list_names': list_names})
+    transaction.on_commit(lambda: add_user_to_email_lists.delay(user_id, list_names, lists_log.id))
+
+
+class AccountsListSerializer(serializers.ListSerializer):
+    """List serializer loading accounts of all items at once (one query per role), before serializing them.
+    Child serializer indicates, in account_user_source attribute, the (dotted) path from item to user"""
+
+    def to_representation(self, data):
+        items = list(data.all() if hasattr(data, 'all') else data)
+        source = self.child.account_user_source.split('.')
+        users = []
+        for item in items:
+            for attr in source:
+                item = getattr(item, attr, None)
+            users.append(item)
+        prime_accounts(users)
+        return super().to_representation(items)
+
+
 class BaseCreateAccountSerializer(serializers.Serializer):
     first_name = serializers.CharField(max_length=30, required=False)
     last_name = serializers.CharField(max_length=150, required=False)
@@ -56,13 +86,10 @@ class BaseCreateAccountSerializer(serializers.Serializer):
             validated_data['referred_by'] = User.get_user_from_refer_code(ref_code)
         else:
             validated_data['referred_by'] = None
-        ind_at_sign = validated_data['email'].find('@')
-        if ind_at_sign > 8:
-            ind_at_sign = 8
         user = update_model(User(), **validated_data)
         user.set_password(validated_data['password'])
-        user.referral_token = validated_data['email'][:ind_at_sign] + timezone.now().strftime('%H%M%S%f')
-        user.save()
+        # final referral token is assigned in creation, so user is saved once
+        user.set_referral_token(get_referral_token_base(user.first_name, user.last_name))
         user.set_user_benefits()
         if validated_data.get('phone_number'):
             PhoneNumber.objects.create(user=user, number=validated_data['phone_number'], type=PHONE_TYPE_MAIN)
@@ -221,12 +248,10 @@ class ParentCreateAccountSerializer(BaseCreateAccountSerializer):
             lng = validated_data.pop('lng')
         parent = Parent.objects.create(user=user, **init_kwargs(Parent(), validated_data))
         parent.set_display_name()
-        parent.set_referral_token()
         if lat and lng:
             parent.coordinates = Point(lng, lat, srid=4326)
-            parent.timezone = parent.get_timezone_from_location_zipcode()
             parent.save()
-        add_to_email_list(user, ['parents', 'goal_schedule_trial']) # add to list in Sendgrid
+        schedule_registration_tasks(parent, ['parents', 'goal_schedule_trial'])
         return parent
 
 
@@ -241,12 +266,10 @@ class StudentCreateAccountSerializer(BaseCreateAccountSerializer):
             lng = validated_data.pop('lng')
         student = Student.objects.create(user=user, **init_kwargs(Student(), validated_data))
         student.set_display_name()
-        student.set_referral_token()
         if lat and lng:
             student.coordinates = Point(lng, lat, srid=4326)
-            student.timezone = student.get_timezone_from_location_zipcode()
             student.save()
-        add_to_email_list(user, ['students', 'goal_schedule_trial']) # add to list in Sendgrid
+        schedule_registration_tasks(student, ['students', 'goal_schedule_trial'])
         return student
 
 
@@ -256,8 +279,7 @@ class InstructorCreateAccountSerializer(BaseCreateAccountSerializer):
         user = super().create(validated_data)
         instructor = Instructor.objects.create(user=user, **init_kwargs(Instructor(), validated_data))
         instructor.set_display_name()
-        instructor.set_referral_token()
-        add_to_email_list(user, ['instructors', 'incomplete_profiles'])  # add to lists in Sendgrid
+        schedule_registration_tasks(instructor, ['instructors', 'incomplete_profiles'])
         return instructor
 
 
@@ -601,21 +623,44 @@ class UserPasswordSerializer(serializers.ModelSerializer):
         fields = ['password', ]
 
 
-class AvatarInstructorSerializer(serializers.ModelSerializer):
+class BaseAvatarSerializer(serializers.ModelSerializer):
+    """Store uploaded avatar; its thumbnails are built in a task, after commit, and thumbnails of previous
+    avatar are removed"""
+
+    def update(self, instance, validated_data):
+        old_variants = instance.avatar_variants
+        instance.avatar_variants = {}
+        instance = super().update(instance, validated_data)
+        if old_variants:
+            storage = instance._meta.get_field('avatar').storage
+            transaction.on_commit(lambda: delete_avatar_variants(storage, old_variants))
+        if instance.avatar:
+            args = {'model_label': instance._meta.label, 'account_id': instance.id, 'avatar_name': instance.avatar.name}
+            task_log = TaskLog.objects.create(task_name='process_avatar', args=args)
+            transaction.on_commit(lambda: process_avatar.delay(*args.values(), task_log.id))
+        return instance
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        data['avatarVariants'] = instance.get_avatar_variants()
+        return data
+
+
+class AvatarInstructorSerializer(BaseAvatarSerializer):
 
     class Meta:
         model = Instructor
         fields = ['avatar', ]
 
 
-class AvatarParentSerializer(serializers.ModelSerializer):
+class AvatarParentSerializer(BaseAvatarSerializer):
 
     class Meta:
         model = Parent
         fields = ['avatar', ]
 
 
-class AvatarStudentSerializer(serializers.ModelSerializer):
+class AvatarStudentSerializer(BaseAvatarSerializer):
 
     class Meta:
         model = Student
@@ -939,6 +984,7 @@ class InstructorQueryParamsSerializer(serializers.Serializer):
     qualifications = serializers.CharField(max_length=500, required=False)
     student_ages = serializers.CharField(max_length=100, required=False)
     sort = serializers.CharField(max_length=50, required=False)
+    q = serializers.CharField(max_length=200, required=False)   # free text, searched in profiles
 
     def to_internal_value(self, data):
         keys = dict.fromkeys(data, 1)
@@ -1015,8 +1061,65 @@ class InstructorQueryParamsSerializer(serializers.Serializer):
         return lat, lng
 
 
+# values and fields used to build representation of instructors in a single pass
+LESSON_RATE_FIELDS = ('mins30', 'mins45', 'mins60', 'mins90')
+PLACE_FOR_LESSONS_FIELDS = ('home', 'studio', 'online')
+AGE_GROUP_FIELDS = ('children', 'teens', 'adults', 'seniors')
+AVAILABILITY_FIELDS = tuple(f'{day}{hours}' for day in ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+                            for hours in ('8to10', '10to12', '12to3', '3to6', '6to9'))
+QUALIFICATION_FIELDS = (('certifiedTeacher', 'certified_teacher'), ('musicTherapy', 'music_therapy'),
+                        ('musicProduction', 'music_production'), ('earTraining', 'ear_training'),
+                        ('conducting', 'conducting'), ('virtuosoRecognition', 'virtuoso_recognition'),
+                        ('performance', 'performance'), ('musicTheory', 'music_theory'),
+                        ('youngChildrenExperience', 'young_children_experience'),
+                        ('repertoireSelection', 'repertoire_selection'))
+INSTRUCTOR_DATA_PREFETCH = ('instructorinstruments_set__instrument', 'instructorlessonrate_set',
+                            'instructorplaceforlessons_set', 'instructoradditionalqualifications_set',
+                            'instructoragegroup_set')
+_rate_field = serializers.DecimalField(max_digits=9, decimal_places=4)
+_last_login_field = serializers.DateTimeField(format='%Y-%m-%d %H:%M:%S')
+_member_since_field = serializers.DateTimeField(format='%Y')
+
+
+def _boolean_or_none(value):
+    return None if value is None else bool(value)
+
+
+def _str_or_none(value):
+    return None if value is None else str(value)
+
+
+def get_lesson_rate_data(instance):
+    """Return same data as LessonRateSerializer(instance).data, without building the serializer"""
+    data = {}
+    for field_name in LESSON_RATE_FIELDS:
+        value = getattr(instance, field_name)
+        if value is None:
+            data[field_name] = None
+            continue
+        value = _rate_field.to_representation(value)
+        if value[-2:] == '00':
+            value = value[:-2]
+        elif value[-1] == '0':
+            value = value[:-1]
+        data[field_name] = value
+    return data
+
+
+def get_boolean_fields_data(instance, field_names):
+    """Return a dict with values of boolean fields of instance, as a Serializer with BooleanFields does"""
+    return {field_name: _boolean_or_none(getattr(instance, field_name)) for field_name in field_names}
+
+
+def get_qualifications_data(instance):
+    """Return same data as AdditionalQualifications(instance).data, without building the serializer"""
+    return {camel_name: _boolean_or_none(getattr(instance, field_name))
+            for camel_name, field_name in QUALIFICATION_FIELDS}
+
+
 class InstructorDataSerializer(serializers.ModelSerializer):
-    """Serializer for return instructor data, to usage in searching instructor"""
+    """Serializer for return instructor data, to usage in searching instructor.
+    Representation is built in a single pass; queryset should prefetch related data (see INSTRUCTOR_DATA_PREFETCH)"""
     availability = AvailavilitySerializer(default={})
     distance = serializers.FloatField(source='distance.mi', read_only=True)
     instruments = serializers.SerializerMethodField()
@@ -1040,56 +1143,74 @@ class InstructorDataSerializer(serializers.ModelSerializer):
         return instructor.get_location()
 
     def get_instruments(self, instructor):
-        return [item.instrument.name
-                for item in instructor.instructorinstruments_set.select_related('instrument').all()]
+        return [item.instrument.name for item in instructor.instructorinstruments_set.all()]
 
     def get_rates(self, instructor):
         items = instructor.instructorlessonrate_set.all()
         if len(items):
-            ser = LessonRateSerializer(items[0])
-            return ser.data
+            return get_lesson_rate_data(items[0])
         else:
             return {'mins30': '', 'mins45': '', 'mins60': '', 'mins90': ''}
 
     def get_place_for_lessons(self, instructor):
         items = instructor.instructorplaceforlessons_set.all()
         if len(items):
-            ser = PlaceForLessonsSerializer(items[0])
-            return ser.data
+            return get_boolean_fields_data(items[0], PLACE_FOR_LESSONS_FIELDS)
         else:
             return {}
 
     def get_qualifications(self, instructor):
         items = instructor.instructoradditionalqualifications_set.all()
         if len(items):
-            ser = AdditionalQualifications(items[0])
-            return ser.data
+            return get_qualifications_data(items[0])
         else:
             return {}
 
     def get_student_ages(self, instructor):
         items = instructor.instructoragegroup_set.all()
         if len(items):
-            ser = AgeGroupsSerializer(items[0])
-            return ser.data
+            return get_boolean_fields_data(items[0], AGE_GROUP_FIELDS)
         else:
             return {}
 
+    def get_avatar(self, instructor):
+        if not instructor.avatar:
+            return None
+        url = instructor.avatar.url
+        request = self.context.get('request')
+        if request is not None:
+            return request.build_absolute_uri(url)
+        return url
+
+    def get_availability(self, instructor):
+        try:
+            availability = instructor.availability
+        except ObjectDoesNotExist:
+            return {}
+        return get_boolean_fields_data(availability, AVAILABILITY_FIELDS)
+
     def to_representation(self, instance):
-        data = super().to_representation(instance)
-        new_data = {'id': data.get('id'), 'displayName': data.get('display_name'), 'age': data.get('age'),
-                    'avatar': data.get('avatar') if data.get('avatar') else data.get('avatar'),
-                    'backgroundCheckStatus': data.get('bg_status'), 'distance': data.get('distance'),
-                    'bioTitle': data.get('bio_title'), 'bioDescription': data.get('bio_description'),
-                    'gender': data.get('gender'), 'reviews': data.get('reviews'), 'location': data.get('location'),
-                    'qualifications': data.get('qualifications'), 'screened': data.get('screened'),
-                    'lessonsTaught': data.get('lessons_taught'), 'instruments': data.get('instruments'),
-                    'rates': data.get('rates'), 'placeForLessons': data.get('place_for_lessons'),
-                    'availability': data.get('availability'), 'student_ages': data.get('student_ages'),
-                    'languages': data.get('languages'), 'yearsOfExperience': data.get('years_of_experience'),
-                    'lastLogin': data.get('last_login'), 'memberSince': data.get('member_since'),
-                    'video': data.get('video')}
-        return new_data
+        distance = getattr(instance, 'distance', None)
+        return {'id': instance.id, 'displayName': _str_or_none(instance.display_name),
+                'age': instance.age if instance.birthday else None,
+                'avatar': self.get_avatar(instance),
+                'avatarVariants': instance.get_avatar_variants(),
+                'backgroundCheckStatus': instance.bg_status,
+                'distance': float(distance.mi) if distance is not None else None,
+                'bioTitle': _str_or_none(instance.bio_title),
+                'bioDescription': _str_or_none(instance.bio_description),
+                'gender': instance.gender, 'reviews': instance.get_review_dict(),
+                'location': self.get_location(instance),
+                'qualifications': self.get_qualifications(instance),
+                'screened': _boolean_or_none(instance.screened),
+                'lessonsTaught': instance.lessons_taught(), 'instruments': self.get_instruments(instance),
+                'rates': self.get_rates(instance), 'placeForLessons': self.get_place_for_lessons(instance),
+                'availability': self.get_availability(instance), 'student_ages': self.get_student_ages(instance),
+                'languages': [str(item) for item in instance.languages] if instance.languages is not None else None,
+                'yearsOfExperience': instance.years_of_experience,
+                'lastLogin': _last_login_field.to_representation(instance.user.last_login),
+                'memberSince': _member_since_field.to_representation(instance.created_at),
+                'video': _str_or_none(instance.video)}
 
 
 class InstructorInstrumentSerializer(serializers.ModelSerializer):
@@ -1110,8 +1231,11 @@ class GetInstructorReviewSerializer(serializers.ModelSerializer):
     avatar = serializers.SerializerMethodField()
     date = serializers.DateField(source='reported_at')
 
+    account_user_source = 'user'
+
     class Meta:
         model = InstructorReview
+        list_serializer_class = AccountsListSerializer
         fields = ('displayName', 'avatar', 'rating', 'comment', 'date', )
 
     def get_displayName(self, instance):
@@ -1225,15 +1349,13 @@ class AffiliateRegisterSerializer(serializers.ModelSerializer):
         return data
 
     def create(self, validated_data):
-        user = User.objects.create(first_name=validated_data.get('first_name', ''),
-                                   last_name=validated_data.get('last_name', ''),
-                                   email=validated_data['email'])
+        user = User(first_name=validated_data.get('first_name', ''), last_name=validated_data.get('last_name', ''),
+                    email=validated_data['email'])
         user.set_password(validated_data['password'])
-        user.save()
+        user.set_referral_token(get_referral_token_base(user.first_name, user.last_name))   # user is saved here
         affiliate = Affiliate.objects.create(user=user,
                                              birth_date=validated_data.get('affiliate', {}).get('birth_date'),
                                              company_name=validated_data.get('affiliate', {}).get('company_name', ''))
-        affiliate.set_referrral_token()
         user.refresh_from_db()
         return user
 
@@ -1243,8 +1365,11 @@ class ReferralDashboardSerializer(serializers.ModelSerializer):
     amount = serializers.DecimalField(max_digits=9, decimal_places=4, source='benefit_qty')
     date = serializers.DateTimeField(source='modified_at', format='%Y-%m-%d')
 
+    account_user_source = 'provider'
+
     class Meta:
         model = UserBenefits
+        list_serializer_class = AccountsListSerializer
         fields = ('name', 'amount', 'date', 'source', )
 
     def get_name(self, instance):
@@ -1,15 +1,95 @@
+import threading
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db.models.signals import pre_save, post_save
+from django.db import transaction
+from django.db.models.signals import pre_save, post_delete, post_save
 from django.dispatch import receiver
+from django.utils import timezone
 
-from core.constants import ROLE_INSTRUCTOR
+from core.models import TaskLog
 from references.models import ReferenceRequest
 
-from .models import (Availability, Education, Employment, Instructor, InstructorInstruments, InstructorAgeGroup,
-                     InstructorLessonRate, InstructorLessonSize, PhoneNumber, get_account)
+from .loaders import discard_account, get_cached_account
+from .models import (Affiliate, Availability, Education, Employment, Instructor,
+                     InstructorAdditionalQualifications, InstructorInstruments, InstructorAgeGroup, InstructorLessonRate,
+                     InstructorLessonSize, InstructorPlaceForLessons, InstructorReview, Parent, PhoneNumber, Student,
+                     StudentDetails, TiedStudent, get_account)
 
 User = get_user_model()
 
+USER_NAME_FIELDS = ('first_name', 'last_name')
+USER_LOGIN_FIELDS = ('last_login', )
+FEED_FIELDS = ('coordinates', 'languages')   # fields of instructor involved in feed of lesson requests
+_pending_instructors = threading.local()
+
+
+def _get_pending_ids(name):
+    if not hasattr(_pending_instructors, name):
+        setattr(_pending_instructors, name, set())
+    return getattr(_pending_instructors, name)
+
+
+def update_pending_instructors():
+    """Update modified_at and search_vector, and recompute complete field, once, for every instructor marked
+    in current transaction"""
+    modified_ids = _get_pending_ids('modified_ids')
+    complete_ids = _get_pending_ids('complete_ids')
+    feed_ids = _get_pending_ids('feed_ids')
+    if feed_ids:
+        from lesson.tasks import fan_in_lesson_requests
+        feed_id_list = sorted(feed_ids)
+        feed_ids.clear()
+        task_log = TaskLog.objects.create(task_name='fan_in_lesson_requests', args={'instructor_ids': feed_id_list})
+        fan_in_lesson_requests.delay(feed_id_list, task_log.id)
+    if modified_ids:
+        # modified_at is used as watermark for conditional responses of profile endpoints
+        Instructor.objects.filter(id__in=modified_ids).update(modified_at=timezone.now())
+        Instructor.update_search_vectors(modified_ids)
+        modified_ids.clear()
+    if not complete_ids:
+        return None
+    id_list = sorted(complete_ids)
+    complete_ids.clear()
+    if getattr(settings, 'INSTRUCTOR_COMPLETE_ASYNC', False):
+        from .tasks import update_instructors_complete
+        task_log = TaskLog.objects.create(task_name='update_instructors_complete',
+                                          args={'instructor_ids': id_list})
+        update_instructors_complete.delay(id_list, task_log.id)
+    else:
+        for instructor in Instructor.objects.filter(id__in=id_list).select_related('user'):
+            instructor.update_complete()
+
+
+def mark_instructor_to_update(instructor_id, update_complete=True):
+    """Register instructor to update modified_at and (optionally) complete fields when current transaction
+    is committed"""
+    if not instructor_id:
+        return None
+    _get_pending_ids('modified_ids').add(instructor_id)
+    if update_complete:
+        _get_pending_ids('complete_ids').add(instructor_id)
+    # callback is registered on every mark, because callbacks of a rolled back transaction are discarded;
+    # the first executed callback takes all marked ids, the remaining ones do nothing
+    transaction.on_commit(update_pending_instructors)
+
+
+def mark_instructor_feed(instructor_id):
+    """Register instructor to update its feed of lesson requests when current transaction is committed"""
+    if not instructor_id:
+        return None
+    _get_pending_ids('feed_ids').add(instructor_id)
+    transaction.on_commit(update_pending_instructors)
+
+
+def touch_user_accounts(user_id, models=(Instructor, Parent, Student)):
+    """Update modified_at field of accounts related to user"""
+    if not user_id:
+        return None
+    now = timezone.now()
+    for model in models:
+        model.objects.filter(user_id=user_id).update(modified_at=now)
+
 
 @receiver(pre_save, sender=User)
 def set_username(sender, instance, **kwargs):
@@ -21,11 +101,46 @@ def set_username(sender, instance, **kwargs):
 def set_display_name(sender, instance, **kwargs):
     if kwargs.get('raw', False):   # to don't execute when fixtures are loaded
         return None
+    update_fields = kwargs.get('update_fields')
+    if update_fields is not None and not set(update_fields).intersection(USER_NAME_FIELDS):
+        return None   # display_name depends on user's names only (e.g. login updates last_login field only)
     account = get_account(instance)
     if account:
         account.set_display_name()
 
 
+@receiver(post_save, sender=Instructor)
+@receiver(post_save, sender=Parent)
+@receiver(post_save, sender=Student)
+@receiver(post_save, sender=Affiliate)
+@receiver(post_delete, sender=Instructor)
+@receiver(post_delete, sender=Parent)
+@receiver(post_delete, sender=Student)
+@receiver(post_delete, sender=Affiliate)
+def set_user_role(sender, instance, **kwargs):
+    """Store role of user when an account is created or deleted"""
+    if kwargs.get('raw', False) or not kwargs.get('created', True):
+        return None
+    User.objects.filter(id=instance.user_id).update(role='')
+    user = User(id=instance.user_id)
+    user.get_role()   # role is obtained from existing accounts, and stored
+    if sender._meta.get_field('user').is_cached(instance):
+        instance.user.role = user.role
+
+
+@receiver(post_save, sender=Instructor)
+@receiver(post_save, sender=Parent)
+@receiver(post_save, sender=Student)
+@receiver(post_delete, sender=Instructor)
+@receiver(post_delete, sender=Parent)
+@receiver(post_delete, sender=Student)
+def discard_loaded_account(sender, instance, **kwargs):
+    """Remove account from request-scoped cache, when it's saved from another instance or deleted"""
+    if kwargs.get('signal') == post_save and get_cached_account(instance.user_id) is instance:
+        return None
+    discard_account(instance.user_id)
+
+
 @receiver(post_save, sender=ReferenceRequest)
 @receiver(post_save, sender=Availability)
 @receiver(post_save, sender=Education)
@@ -37,19 +152,91 @@ def set_display_name(sender, instance, **kwargs):
 @receiver(post_save, sender=PhoneNumber)
 @receiver(post_save, sender=Instructor)
 @receiver(post_save, sender=User)
+@receiver(post_delete, sender=ReferenceRequest)
+@receiver(post_delete, sender=Availability)
+@receiver(post_delete, sender=Education)
+@receiver(post_delete, sender=Employment)
+@receiver(post_delete, sender=InstructorInstruments)
+@receiver(post_delete, sender=InstructorLessonSize)
+@receiver(post_delete, sender=InstructorLessonRate)
+@receiver(post_delete, sender=InstructorAgeGroup)
+@receiver(post_delete, sender=PhoneNumber)
 def change_completed_profile(sender, instance, **kwargs):
-    """Call method to update value of complete field"""
+    """Mark instructor to update value of complete field, when transaction is committed"""
+    if kwargs.get('raw', False):   # to don't execute when fixtures are loaded
+        return None
+    if isinstance(instance, Instructor):
+        mark_instructor_to_update(instance.id)
+    elif isinstance(instance, User):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and not set(update_fields).intersection(USER_NAME_FIELDS):
+            return None
+        mark_instructor_to_update(Instructor.objects.filter(user_id=instance.id)
+                                  .values_list('id', flat=True).first())
+    elif isinstance(instance, (PhoneNumber, ReferenceRequest)):
+        mark_instructor_to_update(Instructor.objects.filter(user_id=instance.user_id)
+                                  .values_list('id', flat=True).first())
+    elif isinstance(instance, (InstructorInstruments, InstructorAgeGroup, InstructorLessonRate, Availability,
+                               Education, Employment, InstructorLessonSize)):
+        mark_instructor_to_update(instance.instructor_id)
+
+
+@receiver(post_save, sender=InstructorPlaceForLessons)
+@receiver(post_save, sender=InstructorAdditionalQualifications)
+@receiver(post_save, sender=InstructorReview)
+@receiver(post_delete, sender=InstructorPlaceForLessons)
+@receiver(post_delete, sender=InstructorAdditionalQualifications)
+@receiver(post_delete, sender=InstructorReview)
+def change_instructor_data(sender, instance, **kwargs):
+    """Mark instructor to update modified_at field, for data not involved in complete field"""
+    if kwargs.get('raw', False):   # to don't execute when fixtures are loaded
+        return None
+    mark_instructor_to_update(instance.instructor_id, update_complete=False)
+    if isinstance(instance, InstructorReview):
+        touch_user_accounts(instance.user_id, models=(Parent, Student))   # reviews are displayed in dashboard
+
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=PhoneNumber)
+@receiver(post_save, sender=StudentDetails)
+@receiver(post_save, sender=TiedStudent)
+@receiver(post_delete, sender=PhoneNumber)
+@receiver(post_delete, sender=StudentDetails)
+@receiver(post_delete, sender=TiedStudent)
+def change_user_data(sender, instance, **kwargs):
+    """Update modified_at field of parent or student accounts, when data displayed with them changes"""
+    if kwargs.get('raw', False):   # to don't execute when fixtures are loaded
+        return None
+    if isinstance(instance, User):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and set(update_fields).issubset(USER_LOGIN_FIELDS):
+            return None
+        touch_user_accounts(instance.id)
+    elif isinstance(instance, TiedStudent):
+        Parent.objects.filter(id=instance.parent_id).update(modified_at=timezone.now())
+    else:
+        touch_user_accounts(instance.user_id, models=(Parent, Student))
+
+
+@receiver(pre_save, sender=Instructor)
+def check_feed_fields(sender, instance, **kwargs):
+    """Indicate (in _feed_outdated attribute) whether feed of lesson requests of instructor should be updated"""
+    if kwargs.get('raw', False):   # to don't execute when fixtures are loaded
+        return None
+    previous = Instructor.objects.filter(id=instance.id).values(*FEED_FIELDS).first() if instance.id else None
+    instance._feed_outdated = previous is None or any(previous[name] != getattr(instance, name)
+                                                      for name in FEED_FIELDS)
+
+
+@receiver(post_save, sender=Instructor)
+@receiver(post_save, sender=InstructorInstruments)
+@receiver(post_delete, sender=InstructorInstruments)
+def change_feed_data(sender, instance, **kwargs):
+    """Mark instructor to update its feed of lesson requests, when its instruments, languages or location change"""
     if kwargs.get('raw', False):   # to don't execute when fixtures are loaded
         return None
     if isinstance(instance, Instructor):
-        instance.update_complete()
-    if isinstance(instance, User) and instance.get_role() == ROLE_INSTRUCTOR:
-        instance.instructor.update_complete()
-    if isinstance(instance, PhoneNumber) and instance.user.get_role == ROLE_INSTRUCTOR:
-        instance.user.instructor.update_complete()
-    if isinstance(instance, InstructorInstruments) or isinstance(instance, InstructorAgeGroup) \
-            or isinstance(instance, InstructorLessonRate) or isinstance(instance, Availability) \
-            or isinstance(instance, Education) or isinstance(instance, Employment):
-        instance.instructor.update_complete()
-    if isinstance(instance, ReferenceRequest):
-        instance.user.instructor.update_complete()
+        if getattr(instance, '_feed_outdated', False):
+            mark_instructor_feed(instance.id)
+    else:
+        mark_instructor_feed(instance.instructor_id)
@@ -1,14 +1,19 @@
+from django.apps import apps
 from django.contrib.auth import get_user_model
 
 from core.models import TaskLog
 from core.utils import send_admin_email
 from nabi_api_django.celery_config import app
 
-from .models import InstructorReview
-from .utils import send_instructor_info_review
+from .avatars import InvalidAvatarError, build_avatar_variants, delete_avatar_variants
+from .models import Instructor, InstructorReview, get_account
+from .utils import add_to_email_list, send_instructor_info_review
 
 User = get_user_model()
 
+REGISTRATION_MAX_RETRIES = 5
+REGISTRATION_RETRY_DELAY = 60   # seconds, doubled in each retry
+
 
 @app.task
 def alert_user_without_location_coordinates():
@@ -54,3 +59,79 @@ def info_instructor_review(obj_id, task_log_id):
         )
     send_instructor_info_review(instructor_review)
     TaskLog.objects.filter(id=task_log_id).delete()
+
+
+@app.task
+def update_instructors_complete(instructor_ids, task_log_id):
+    """Update value of complete field for provided instructors"""
+    for instructor in Instructor.objects.filter(id__in=instructor_ids).select_related('user'):
+        instructor.update_complete()
+    TaskLog.objects.filter(id=task_log_id).delete()
+
+
+@app.task(bind=True, max_retries=REGISTRATION_MAX_RETRIES)
+def set_account_timezone(self, user_id, task_log_id):
+    """Set time zone of a registered account, from its coordinates (requests to Google APIs, retried on error)"""
+    user = User.objects.filter(id=user_id).first()
+    account = user and get_account(user)
+    if not account:
+        send_admin_email(
+            'Error executing set_account_timezone task',
+            f'Executing task set_account_timezone (params: user_id {user_id}, task_log_id {task_log_id}) '
+            f'no account was obtained'
+        )
+        return None
+    try:
+        time_zone = account.get_timezone_from_location_zipcode()
+    except Exception as e:
+        raise self.retry(exc=e, countdown=REGISTRATION_RETRY_DELAY * 2 ** self.request.retries)
+    # only time zone is updated, so concurrent changes of account are kept
+    type(account).objects.filter(id=account.id).update(timezone=time_zone)
+    TaskLog.objects.filter(id=task_log_id).delete()
+
+
+@app.task(bind=True, max_retries=REGISTRATION_MAX_RETRIES)
+def add_user_to_email_lists(self, user_id, list_names, task_log_id):
+    """Add a registered user to email lists (in Sendgrid), retried on error"""
+    try:
+        user = User.objects.get(id=user_id)
+    except User.DoesNotExist:
+        send_admin_email(
+            'Error executing add_user_to_email_lists task',
+            f'Executing task add_user_to_email_lists (params: user_id {user_id}, task_log_id {task_log_id}) '
+            f'User DoesNotExist error was raised'
+        )
+        return None
+    try:
+        add_to_email_list(user, list_names)
+    except Exception as e:
+        raise self.retry(exc=e, countdown=REGISTRATION_RETRY_DELAY * 2 ** self.request.retries)
+    TaskLog.objects.filter(id=task_log_id).delete()
+
+
+@app.task(bind=True, max_retries=REGISTRATION_MAX_RETRIES)
+def process_avatar(self, model_label, account_id, avatar_name, task_log_id):
+    """Store thumbnails of an uploaded avatar. An avatar that is not a valid image is removed;
+    if avatar was replaced meanwhile, nothing is done (task of new one builds its thumbnails)"""
+    model = apps.get_model(model_label)
+    account = model.objects.filter(id=account_id).first()
+    if not account:
+        send_admin_email(
+            'Error executing process_avatar task',
+            f'Executing task process_avatar (params: model_label {model_label}, account_id {account_id}, '
+            f'task_log_id {task_log_id}) no account was obtained'
+        )
+        return None
+    if account.avatar.name == avatar_name:
+        try:
+            variants = build_avatar_variants(account.avatar)
+        except InvalidAvatarError:
+            if model.objects.filter(id=account_id, avatar=avatar_name).update(avatar=None, avatar_variants={}):
+                account.avatar.delete(save=False)
+        except Exception as e:
+            raise self.retry(exc=e, countdown=REGISTRATION_RETRY_DELAY * 2 ** self.request.retries)
+        else:
+            # conditional update, so an avatar uploaded meanwhile doesn't get these thumbnails
+            if not model.objects.filter(id=account_id, avatar=avatar_name).update(avatar_variants=variants):
+                delete_avatar_variants(account.avatar.storage, variants)
+    TaskLog.objects.filter(id=task_log_id).delete()
@@ -1,6 +1,7 @@
 import operator
 
 from django.conf import settings
+from django.core.cache import cache
 
 from rest_framework import status
 from rest_framework.test import APITestCase
@@ -23,6 +24,7 @@ class BaseTest(APITestCase):
 
     def setUp(self):
         """Set token authorization in client"""
+        cache.clear()   # to avoid responses cached in previous tests
         token = self.get_token(**self.login_data)
         self.client.credentials(HTTP_AUTHORIZATION='Bearer {}'.format(token))
         self.maxDiff = None
@@ -0,0 +1,48 @@
+"""Tests for request-scoped cache of accounts"""
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+
+from ..loaders import account_loader_scope
+from ..models import Instructor, Parent, Student, get_account, prime_accounts
+
+User = get_user_model()
+
+
+class AccountLoaderTest(TestCase):
+    fixtures = ['01_core_users.json', '02_accounts_instructors.json', '03_accounts_parents.json',
+                '04_accounts_students.json']
+
+    def setUp(self):
+        self.users = list(User.objects.filter(email__in=['luisinstruct@yopmail.com', 'luisparent@yopmail.com',
+                                                         'luisstudent@yopmail.com']).order_by('email'))
+        for user in self.users:
+            user.get_role()
+
+    def test_account_loaded_once(self):
+        """Inside a scope, account of a user is queried once; outside, it's queried every time"""
+        user = self.users[0]
+        with account_loader_scope():
+            with self.assertNumQueries(1):
+                account = get_account(user)
+                self.assertIs(get_account(user), account)
+        with self.assertNumQueries(2):
+            get_account(user)
+            get_account(user)
+
+    def test_prime_accounts(self):
+        """Accounts of many users are loaded with one query per role"""
+        with account_loader_scope():
+            with self.assertNumQueries(3):
+                prime_accounts(self.users)
+            with self.assertNumQueries(0):
+                accounts = [get_account(user) for user in self.users]
+        self.assertEqual([type(account) for account in accounts], [Instructor, Parent, Student])
+        self.assertTrue(all(account.user is user for account, user in zip(accounts, self.users)))
+
+    def test_saved_account_discarded(self):
+        """An account saved from another instance is queried again"""
+        user = self.users[2]
+        with account_loader_scope():
+            account = get_account(user)
+            Student.objects.get(user=user).save()
+            self.assertIsNot(get_account(user), account)
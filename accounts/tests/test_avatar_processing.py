@@ -0,0 +1,92 @@
+"""Tests for processing of uploaded avatars"""
+import shutil
+import tempfile
+from io import BytesIO, StringIO
+from unittest import mock
+
+from PIL import Image
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from core.models import TaskLog
+
+from ..avatars import AVATAR_SIZES
+from ..models import Student
+from ..serializers import AvatarStudentSerializer
+from ..tasks import process_avatar
+
+User = get_user_model()
+
+
+def png_content(size=(600, 400)):
+    buffer = BytesIO()
+    Image.new('RGBA', size, (200, 10, 10, 128)).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+class AvatarTestMixin:
+    fixtures = ['01_core_users.json', '04_accounts_students.json']
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.student = Student.objects.get(user__email='luisstudent@yopmail.com')
+
+    def upload_avatar(self, content):
+        self.student.avatar.save('avatar.png', ContentFile(content))
+        task_log = TaskLog.objects.create(task_name='process_avatar', args={})
+        process_avatar('accounts.Student', self.student.id, self.student.avatar.name, task_log.id)
+        self.assertFalse(TaskLog.objects.filter(id=task_log.id).exists())
+        self.student.refresh_from_db()
+
+
+class AvatarProcessingTest(AvatarTestMixin, TestCase):
+
+    def test_thumbnails_built(self):
+        self.upload_avatar(png_content())
+        self.assertEqual(set(self.student.avatar_variants.keys()), set(AVATAR_SIZES.keys()))
+        for size_name, side in AVATAR_SIZES.items():
+            with self.student.avatar.storage.open(self.student.avatar_variants[size_name]['jpeg']) as thumbnail:
+                image = Image.open(thumbnail)
+                self.assertEqual((image.format, image.size), ('JPEG', (side, side)))
+        self.assertIn('jpeg', self.student.get_avatar_variants()['small'])
+
+    def test_invalid_avatar_removed(self):
+        self.upload_avatar(b'not an image')
+        self.assertFalse(self.student.avatar)
+        self.assertEqual(self.student.avatar_variants, {})
+
+    def test_command_queues_pending_avatars(self):
+        """Command queues processing of avatars without thumbnails only"""
+        self.student.avatar.save('avatar.png', ContentFile(png_content()))
+        with mock.patch('accounts.management.commands.process_avatars.process_avatar.delay') as delay:
+            call_command('process_avatars', stdout=StringIO())
+        task_log = TaskLog.objects.get(task_name='process_avatar')
+        delay.assert_called_once_with('accounts.Student', self.student.id, self.student.avatar.name, task_log.id)
+
+
+class AvatarReplacementTest(AvatarTestMixin, TransactionTestCase):
+
+    def test_previous_thumbnails_removed(self):
+        """Thumbnails of replaced avatar are removed when the new one is stored"""
+        self.upload_avatar(png_content())
+        storage = self.student.avatar.storage
+        old_names = [name for names in self.student.avatar_variants.values() for name in names.values()]
+        self.assertTrue(all(storage.exists(name) for name in old_names))
+        serializer = AvatarStudentSerializer(self.student, partial=True, data={
+            'avatar': SimpleUploadedFile('new.png', png_content((300, 300)), content_type='image/png')
+        })
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        with mock.patch('accounts.serializers.process_avatar.delay') as delay:
+            serializer.save()
+        self.assertEqual(delay.call_count, 1)
+        self.assertFalse(any(storage.exists(name) for name in old_names))
+        self.student.refresh_from_db()
+        self.assertEqual(self.student.avatar_variants, {})
@@ -114,18 +114,21 @@ class DashboardInstructorTest(BaseTest):
                                       'students': [{'name': 'Santiago', 'age': 9}, {'name': 'Teresa', 'age': 7}]}
                                      ],
                          'requests': [{'id': 3, 'displayName': 'Luis S.', 'role': 'student', 'avatar': '',
+                                       'avatarVariants': {},
                                        'distance': '1143.40', 'requestTitle': 'Flute Instructor needed',
                                        'instrument': 'flute', 'placeForLessons': 'online', 'skillLevel': 'beginner',
                                        'lessonDuration': '30 mins', 'location': 'Boon, MI',
                                        'studentDetails': {'age': 29},
                                        'applicationsReceived': 0},
                                       {'id': 4, 'displayName': 'Luis P.', 'role': 'parent', 'avatar': '',
+                                       'avatarVariants': {},
                                        'distance': '36.96', 'requestTitle': 'Piano Instructor needed',
                                        'instrument': 'piano', 'placeForLessons': 'online', 'skillLevel': 'beginner',
                                        'lessonDuration': '30 mins', 'location': 'Montgomery, TX',
                                        'studentDetails': [{'name': 'Paul', 'age': 10}],
                                        'applicationsReceived': 0},
                                       {'id': 5, 'displayName': 'Luis P.', 'role': 'parent', 'avatar': '',
+                                       'avatarVariants': {},
                                        'distance': '110.79', 'requestTitle': 'Searching for a Guitar Instructor',
                                        'instrument': 'guitar', 'placeForLessons': 'home', 'skillLevel': 'beginner',
                                        'lessonDuration': '30 mins', 'location': 'Cameron, LA',
@@ -0,0 +1,71 @@
+"""Tests for single pass representation of InstructorDataSerializer"""
+from django.core.exceptions import ObjectDoesNotExist
+from django.test import TestCase
+
+from rest_framework import serializers
+from rest_framework.test import APIRequestFactory
+
+from ..models import Instructor
+from ..serializers import (INSTRUCTOR_DATA_PREFETCH, AdditionalQualifications, AgeGroupsSerializer,
+                           AvailavilitySerializer, InstructorDataSerializer, LessonRateSerializer,
+                           PlaceForLessonsSerializer)
+
+
+def first_item_data(items, serializer_class, default):
+    """Data of first item with serializer_class, as previous method fields did"""
+    items = list(items)
+    return serializer_class(items[0]).data if items else default
+
+
+def reference_representation(serializer, instance):
+    """Representation obtained from DRF fields and nested serializers, as InstructorDataSerializer did previously"""
+    data = serializers.ModelSerializer.to_representation(serializer, instance)
+    try:
+        availability = AvailavilitySerializer(instance.availability).data
+    except ObjectDoesNotExist:
+        availability = {}
+    return {'id': data.get('id'), 'displayName': data.get('display_name'), 'age': data.get('age'),
+            'avatar': data.get('avatar'), 'avatarVariants': instance.get_avatar_variants(),
+            'backgroundCheckStatus': data.get('bg_status'),
+            'distance': data.get('distance'), 'bioTitle': data.get('bio_title'),
+            'bioDescription': data.get('bio_description'), 'gender': data.get('gender'),
+            'reviews': data.get('reviews'), 'location': instance.get_location(),
+            'qualifications': first_item_data(instance.instructoradditionalqualifications_set.all(),
+                                              AdditionalQualifications, {}),
+            'screened': data.get('screened'), 'lessonsTaught': data.get('lessons_taught'),
+            'instruments': [item.instrument.name
+                            for item in instance.instructorinstruments_set.select_related('instrument').all()],
+            'rates': first_item_data(instance.instructorlessonrate_set.all(), LessonRateSerializer,
+                                     {'mins30': '', 'mins45': '', 'mins60': '', 'mins90': ''}),
+            'placeForLessons': first_item_data(instance.instructorplaceforlessons_set.all(),
+                                               PlaceForLessonsSerializer, {}),
+            'availability': availability,
+            'student_ages': first_item_data(instance.instructoragegroup_set.all(), AgeGroupsSerializer, {}),
+            'languages': data.get('languages'), 'yearsOfExperience': data.get('years_of_experience'),
+            'lastLogin': data.get('last_login'), 'memberSince': data.get('member_since'), 'video': data.get('video')}
+
+
+class InstructorDataSerializerTest(TestCase):
+    """Compare single pass representation with representation built from DRF fields"""
+    fixtures = ['01_core_users.json', '02_accounts_instructors.json', '05_lesson_instruments.json',
+                '06_accounts_availabilities.json', '07_accounts_educations.json', '08_accounts_employments.json',
+                '09_accounts_instructoradditionalqualifications.json', '10_accounts_instructoragegroups.json',
+                '11_accounts_instructorinstruments.json', '12_accounts_instructorlessonrates.json',
+                '14_accounts_instructorplaceforlessons.json', '18_phonenumbers.json']
+
+    def test_same_representation(self):
+        request = APIRequestFactory().get('/v1/instructors/')
+        qs = Instructor.objects.select_related('user', 'availability').prefetch_related(*INSTRUCTOR_DATA_PREFETCH)
+        self.assertTrue(qs.exists())
+        serializer = InstructorDataSerializer(context={'request': request})
+        for instance in qs.all():
+            self.assertDictEqual(serializer.to_representation(instance),
+                                 reference_representation(serializer, instance))
+
+    def test_without_availability(self):
+        """Instructors without availability have empty dict, as before"""
+        serializer = InstructorDataSerializer()
+        qs = Instructor.objects.filter(availability__isnull=True)
+        self.assertTrue(qs.exists())
+        for instance in qs:
+            self.assertEqual(serializer.to_representation(instance)['availability'], {})
@@ -0,0 +1,44 @@
+"""Tests for updates of instructors marked in a transaction, executed once when it's committed"""
+from unittest import mock
+
+from django.db import transaction
+from django.test import TransactionTestCase, override_settings
+
+from core.models import TaskLog
+
+from ..models import Instructor, InstructorAgeGroup, InstructorLessonSize
+
+
+@mock.patch('lesson.tasks.fan_in_lesson_requests.delay')
+class InstructorPendingUpdatesTest(TransactionTestCase):
+    fixtures = ['01_core_users.json', '02_accounts_instructors.json']
+
+    def setUp(self):
+        self.instructor = Instructor.objects.get(user__email='luisinstruct@yopmail.com')
+        Instructor.objects.filter(id=self.instructor.id).update(modified_at=self.instructor.created_at)
+
+    def write_profile(self):
+        """Several writes affecting completeness of instructor, in a single transaction"""
+        with transaction.atomic():
+            InstructorAgeGroup.objects.create(instructor=self.instructor, children=True)
+            lesson_size = InstructorLessonSize.objects.create(instructor=self.instructor, one_student=True)
+            lesson_size.small_groups = True
+            lesson_size.save()
+            self.assertEqual(Instructor.objects.get(id=self.instructor.id).modified_at, self.instructor.created_at)
+
+    def test_single_update(self, fan_in_delay):
+        with mock.patch.object(Instructor, 'update_complete', autospec=True) as update_complete:
+            self.write_profile()
+        self.assertEqual(update_complete.call_count, 1)
+        self.assertEqual(update_complete.call_args[0][0].id, self.instructor.id)
+        self.assertGreater(Instructor.objects.get(id=self.instructor.id).modified_at, self.instructor.created_at)
+
+    @override_settings(INSTRUCTOR_COMPLETE_ASYNC=True)
+    def test_single_task(self, fan_in_delay):
+        with mock.patch('accounts.tasks.update_instructors_complete.delay') as delay, \
+                mock.patch.object(Instructor, 'update_complete', autospec=True) as update_complete:
+            self.write_profile()
+        self.assertEqual(update_complete.call_count, 0)
+        task_log = TaskLog.objects.get(task_name='update_instructors_complete')
+        self.assertEqual(task_log.args, {'instructor_ids': [self.instructor.id]})
+        delay.assert_called_once_with([self.instructor.id], task_log.id)
@@ -5,6 +5,7 @@ from django.conf import settings
 
 from rest_framework import status
 
+from ..models import Instructor
 from .base_test_class import BaseTest
 
 
@@ -19,7 +20,8 @@ class InstructorsListTest(BaseTest):
         'email': 'luisinstruct@yopmail.com',
         'password': 'T3st11ng'
     }
-    current_data = [{"id": 1, "displayName": "Luis I.", "age": 44, "avatar": None, "interviewed": False, "gender": None,
+    current_data = [{"id": 1, "displayName": "Luis I.", "age": 44, "avatar": None, "avatarVariants": {},
+                     "interviewed": False, "gender": None,
                      "bioTitle": "Music instructor", "bioDescription": "I'm a professional music instructor",
                      "location": "Houston, TX", "reviews": 0, "lessonsTaught": 0, "instruments": ['guitar', 'piano'],
                      "rates": {'mins30': '10.00', 'mins45': '15.00', 'mins60': '20.00', 'mins90': '30.00'},
@@ -127,6 +129,17 @@ class InstructorsListNoAuthTest(BaseTest):
         self.assertEqual(data['count'], 2)
         self.assertEqual(len(data['results']), 2)
 
+    def test_search(self):
+        """Free text search in profiles, combined with other filters"""
+        Instructor.update_search_vectors(Instructor.objects.values_list('id', flat=True))
+        response = self.client.get(self.url + '?q=guitar music')
+        self.assertEqual(response.status_code, status.HTTP_200_OK, msg=response.content.decode())
+        self.assertEqual([item['id'] for item in response.json()['results']], [1])
+        response = self.client.get(self.url + '?q=flute')
+        self.assertEqual([item['id'] for item in response.json()['results']], [2])
+        response = self.client.get(self.url + '?q=guitar&instruments=flute')
+        self.assertEqual(response.json()['count'], 0)
+
 
 class DetailInstructorBasicTest(BaseTest):
     """Test for instructor's detail API endpoint"""
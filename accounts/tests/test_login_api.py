@@ -6,6 +6,10 @@ from django.conf import settings
 from rest_framework import status
 from rest_framework.test import APITestCase
 
+from core.models import User
+
+from ..models import Parent
+
 
 class LoginInstructorTest(APITestCase):
     fixtures = ['01_core_users.json', '02_accounts_instructors.json']
@@ -80,3 +84,29 @@ class LoginParentTest(APITestCase):
         """Test failed login parent"""
         response = self.client.post(self.url, data=json.dumps(self.payload_wrong_pass), content_type='application/json')
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, msg=response.content.decode())
+
+
+class UserRoleTest(APITestCase):
+    fixtures = ['01_core_users.json', '02_accounts_instructors.json']
+
+    def test_stored_role(self):
+        """Role of user is stored, so checking own role costs no queries"""
+        response = self.client.post('{}/v1/api-token/'.format(settings.HOSTNAME_PROTOCOL),
+                                    data={'email': 'luisinstruct@yopmail.com', 'password': 'T3st11ng'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK, msg=response.content.decode())
+        user = User.objects.get(email='luisinstruct@yopmail.com')
+        self.assertEqual(user.role, 'instructor')
+        with self.assertNumQueries(0):
+            self.assertTrue(user.is_instructor())
+        self.assertFalse(user.is_parent())
+        self.assertFalse(user.is_student())
+
+    def test_several_accounts(self):
+        """An user with several accounts is instructor and parent, as before storing role"""
+        user = User.objects.get(email='luisinstruct@yopmail.com')
+        Parent.objects.create(user=user)
+        user = User.objects.get(email='luisinstruct@yopmail.com')
+        self.assertEqual(user.get_role(), 'instructor')
+        self.assertTrue(user.is_instructor())
+        self.assertTrue(user.is_parent())
+        self.assertFalse(user.is_student())
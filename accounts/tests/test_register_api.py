@@ -6,7 +6,7 @@ from django.conf import settings
 from rest_framework import status
 from rest_framework.test import APITestCase
 
-from core.models import User, UserBenefits
+from core.models import TaskLog, User, UserBenefits
 
 from ..models import Instructor, Parent, Student
 
@@ -382,3 +382,31 @@ class CreateUserWithReferringCodeTest(APITestCase):
             user=User.objects.get(email=self.payload_referred_student['email']),
             user_origin=referring_user,
         ).exists())
+
+
+class RegistrationTasksTest(APITestCase):
+    """Side effects of registration (time zone, email lists) are left to tasks, executed after commit"""
+
+    def setUp(self):
+        self.url = '{}/v1/register/'.format(settings.HOSTNAME_PROTOCOL)
+
+    def test_parent_with_coordinates(self):
+        payload = {"email": "parent10@yopmail.com", "password": "123456", "role": "parent",
+                   "birthday": "1990-11-19", "lat": 40.7128, "lng": -74.006}
+        response = self.client.post(self.url, data=json.dumps(payload), content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK, msg=response.content.decode())
+        user_id = response.json()['id']
+        self.assertEqual(response.json()['timezone'], '')
+        self.assertTrue(TaskLog.objects.filter(task_name='set_account_timezone', args={'user_id': user_id}).exists())
+        self.assertTrue(TaskLog.objects.filter(task_name='add_user_to_email_lists',
+                                               args={'user_id': user_id,
+                                                     'list_names': ['parents', 'goal_schedule_trial']}).exists())
+
+    def test_instructor(self):
+        payload = {"email": "instructor10@yopmail.com", "password": "123456", "role": "instructor",
+                   "birthday": "1990-11-19"}
+        response = self.client.post(self.url, data=json.dumps(payload), content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK, msg=response.content.decode())
+        self.assertFalse(TaskLog.objects.filter(task_name='set_account_timezone').exists())
+        self.assertTrue(TaskLog.objects.filter(task_name='add_user_to_email_lists',
+                                               args__user_id=response.json()['id']).exists())
@@ -135,3 +135,37 @@ class WhoAmiStudentTest2(BaseTest):
                           "gender": None, "avatar": None, "location": "", "lat": "", "lng": "",
                           "referralToken": "R72-BlRs7HAAenV0"}
                          )
+
+
+class WhoAmiConditionalTest(BaseTest):
+    fixtures = ['01_core_users.json', '02_accounts_instructors.json']
+    login_data = {
+        'email': 'luisinstruct@yopmail.com',
+        'password': 'T3st11ng'
+    }
+
+    def setUp(self):
+        super().setUp()
+        self.url = '{}/v1/whoami/'.format(settings.HOSTNAME_PROTOCOL)
+
+    def test_not_modified(self):
+        """Test whoami returns 304 when data has not changed"""
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, msg=response.content.decode())
+        self.assertTrue(response.has_header('ETag'))
+        response2 = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response2.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response2['ETag'], response['ETag'])
+
+    def test_modified(self):
+        """Test whoami returns data when account has changed"""
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, msg=response.content.decode())
+        from ..models import Instructor
+        instructor = Instructor.objects.get(user__email=self.login_data['email'])
+        instructor.bio_title = 'Piano instructor'
+        instructor.save()
+        response2 = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response2.status_code, status.HTTP_200_OK, msg=response2.content.decode())
+        self.assertEqual(response2.json()['bioTitle'], 'Piano instructor')
+        self.assertNotEqual(response2['ETag'], response['ETag'])
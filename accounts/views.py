@@ -10,8 +10,9 @@ from django.contrib.gis.db.models import PointField
 from django.contrib.gis.db.models.functions import Distance
 from django.contrib.gis.geos import Point
 from django.contrib.gis.measure import D
+from django.contrib.postgres.search import SearchQuery, SearchRank
 from django.db import transaction
-from django.db.models import Min, ObjectDoesNotExist, Prefetch, Q, Sum
+from django.db.models import Count, F, Max, Min, ObjectDoesNotExist, Prefetch, Q, Sum
 from django.db.models.functions import Cast
 from django.middleware.csrf import get_token
 from django.utils import timezone
@@ -23,16 +24,17 @@ from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 from rest_framework_simplejwt.tokens import RefreshToken
 
+from core.cache import cache_response
 from core.constants import *
 from core.models import TaskLog, UserBenefits, UserToken
-from core.utils import build_error_dict, generate_token_reset_password
-from lesson.models import Instrument, Lesson
+from core.utils import build_error_dict, conditional_get, generate_token_reset_password, latest_datetime
+from lesson.models import Instrument, Lesson, LessonBooking
 from lesson.serializers import BestInstructorMatchSerializer, InstructorDashboardSerializer, ScheduledLessonSerializer
 
 from . import serializers as sers
 from .models import (Availability, Education, Employment, Instructor, InstructorAgeGroup, InstructorInstruments,
                      InstructorLessonRate, InstructorPlaceForLessons, InstructorAdditionalQualifications,
-                     PhoneNumber, StudentDetails, TiedStudent, get_account, get_user_phone)
+                     PhoneNumber, StudentDetails, TiedStudent, SEARCH_CONFIG, get_account, get_user_phone)
 from .tasks import info_instructor_review
 from .utils import send_referral_invitation_email, send_reset_password_email
 
@@ -89,6 +91,65 @@ def get_instructor_profile(user_cc):
         return {}
 
 
+def account_watermark(request, *args, **kwargs):
+    """Return watermark (last modification, values for ETag) of account of logged user"""
+    if not request.user.is_authenticated:
+        return None
+    account = get_account(request.user)
+    if not account:
+        return None
+    return account.modified_at, [request.user.get_role(), account.modified_at.isoformat()]
+
+
+def lessons_watermark(lessons_qs):
+    """Return watermark of lessons in queryset; lessons moved to past are counted, because of next lesson data"""
+    result = lessons_qs.aggregate(last=Max('updated'), qty=Count('id'),
+                                  past=Count('id', filter=Q(scheduled_datetime__lt=timezone.now())))
+    return result['last'], [result['last'] and result['last'].isoformat(), result['qty'], result['past']]
+
+
+def instructor_detail_watermark(request, pk):
+    """Return watermark of data of an instructor, displayed in instructor detail"""
+    instructor = Instructor.objects.filter(pk=pk).values('modified_at').first()
+    if not instructor:
+        return None
+    last_lesson, lesson_values = lessons_watermark(Lesson.objects.filter(instructor_id=pk))
+    return latest_datetime(instructor['modified_at'], last_lesson), [instructor['modified_at'].isoformat()] \
+        + lesson_values
+
+
+def dashboard_watermark(request):
+    """Return watermark of data displayed in dashboard of logged user"""
+    watermark = account_watermark(request)
+    if watermark is None:
+        return None
+    last_modified, values = watermark
+    if request.user.is_instructor():
+        lessons_qs = Lesson.objects.filter(booking__instructor__user=request.user)
+        bookings_qs = LessonBooking.objects.filter(instructor__user=request.user)
+    else:
+        lessons_qs = Lesson.objects.filter(booking__user=request.user)
+        bookings_qs = LessonBooking.objects.filter(user=request.user)
+    last_lesson, lesson_values = lessons_watermark(lessons_qs)
+    # data of students (names, details) is taken from accounts of users who made the bookings
+    bookings = bookings_qs.aggregate(last=Max('updated_at'), qty=Count('id'),
+                                     parent=Max('user__parent__modified_at'),
+                                     student=Max('user__student__modified_at'))
+    last_modified = latest_datetime(last_modified, last_lesson, bookings['last'], bookings['parent'],
+                                    bookings['student'])
+    # dashboard data changes as time goes by (next lesson), then only ETag is used
+    return None, values + lesson_values + [bookings['qty'], last_modified.isoformat()]
+
+
+def referral_dashboard_watermark(request):
+    """Return watermark of benefits displayed in referral dashboard of logged user"""
+    result = UserBenefits.objects.filter(beneficiary=request.user)\
+        .aggregate(last=Max('modified_at'), qty=Count('id'), instructor=Max('provider__instructor__modified_at'),
+                   parent=Max('provider__parent__modified_at'), student=Max('provider__student__modified_at'))
+    last_modified = latest_datetime(result['last'], result['instructor'], result['parent'], result['student'])
+    return last_modified, [result['qty'], last_modified and last_modified.isoformat()]
+
+
 class CreateAccount(views.APIView):
     permission_classes = ()
 
@@ -189,6 +250,7 @@ class CsrfTokenView(views.APIView):
 
 
 class WhoAmIView(views.APIView):
+    @conditional_get(account_watermark)
     def get(self, request):
         if not request.user.is_authenticated:
             return {'id': None, 'email': None, 'role': None, 'firstName': None, 'middleName': None, 'lastName': None,
@@ -349,6 +411,7 @@ class WhoAmIView(views.APIView):
 
 
 class FetchInstructor(views.APIView):
+    @conditional_get(account_watermark)
     def get(self, request):
         data = {}
         if request.user.is_authenticated:
@@ -487,6 +550,7 @@ class InstructorEducationItemView(views.APIView):
 class InstructorDetailView(views.APIView):
     permission_classes = (AllowAny,)
 
+    @conditional_get(instructor_detail_watermark, user_dependent=False)
     def get(self, request, pk):
         try:
             instructor = Instructor.objects.get(pk=pk)
@@ -659,6 +723,7 @@ class InstructorEmploymentItemView(views.APIView):
 class InstructorListView(views.APIView):
     permission_classes = (AllowAny, )
 
+    @cache_response(['instructors'], timeout=settings.CACHE_VIEW_SHORT_TIMEOUT, anonymous_only=True)
     def get(self, request):
         qs = Instructor.objects.filter(complete__isnull=False)
         # adjust qs for each received param
@@ -719,6 +784,12 @@ class InstructorListView(views.APIView):
                 instrument_list = query_serializer.validated_data.get('instruments', '').split(',')
                 qs = qs.filter(id__in=InstructorInstruments.objects.filter(instrument__name__in=instrument_list)\
                                .values_list('instructor_id'))
+            search_query = None
+            if query_serializer.validated_data.get('q'):
+                # answered by GIN index on search_vector; results are ordered by rank when no sort is requested
+                search_query = SearchQuery(query_serializer.validated_data['q'], config=SEARCH_CONFIG)
+                qs = qs.filter(search_vector=search_query).annotate(rank=SearchRank(F('search_vector'), search_query))
+            default_order = ('-rank', '-user__last_login') if search_query else ('-user__last_login', )
             if isinstance(request.user, AnonymousUser):
                 account = None
             else:
@@ -742,7 +813,7 @@ class InstructorListView(views.APIView):
                     else:
                         qs = qs.order_by(query_serializer.validated_data['sort'], '-user__last_login')
                 else:
-                    qs = qs.order_by('-user__last_login')
+                    qs = qs.order_by(*default_order)
             else:
                 qs = qs.annotate(distance=Distance('coordinates', Cast(None, PointField())))
                 if query_serializer.validated_data.get('sort'):
@@ -751,11 +822,12 @@ class InstructorListView(views.APIView):
                     elif query_serializer.validated_data['sort'] == '-rate':
                         qs = qs.order_by('-instructorlessonrate__mins30', 'user__first_name')
                     else:
-                        qs = qs.order_by('-user__last_login')
+                        qs = qs.order_by(*default_order)
                 else:
-                    qs = qs.order_by('-user__last_login')
+                    qs = qs.order_by(*default_order)
             # return data with pagination
             paginator = PageNumberPagination()
+            qs = qs.select_related('user', 'availability').prefetch_related(*sers.INSTRUCTOR_DATA_PREFETCH)
             result_page = paginator.paginate_queryset(qs, request)
             serializer = sers.InstructorDataSerializer(result_page, many=True, context={'request': request})
             return paginator.get_paginated_response(serializer.data)
@@ -767,6 +839,7 @@ class InstructorListView(views.APIView):
 class MinimalLessonRateView(views.APIView):
     permission_classes = (AllowAny, )
 
+    @cache_response(['instructors'])
     def get(self, request):
         res = InstructorLessonRate.objects.aggregate(min_rate=Min('mins30'))
         return Response({'minRate': res['min_rate']})
@@ -789,6 +862,7 @@ class AffiliateRegisterView(views.APIView):
 class DashboardView(views.APIView):
     """Return data for display in user dashboard"""
 
+    @conditional_get(dashboard_watermark)
     def get(self, request):
         if request.user.is_instructor():
             serializer = InstructorDashboardSerializer(request.user.instructor)
@@ -828,9 +902,10 @@ class ReferralInfoView(views.APIView):
 
 class ReferralDashboardView(views.APIView):
 
+    @conditional_get(referral_dashboard_watermark)
     def get(self, request):
         qs = UserBenefits.objects.filter(beneficiary=request.user, status=BENEFIT_READY, benefit_type=BENEFIT_AMOUNT)
-        ser = sers.ReferralDashboardSerializer(qs, many=True)
+        ser = sers.ReferralDashboardSerializer(qs.select_related('provider'), many=True)
         response_data = ser.data.copy()
         total = qs.aggregate(total=Sum('benefit_qty'))
         if total['total'] is None:
@@ -5,6 +5,7 @@ from accounts.models import PhoneNumber
 from accounts.serializers import (InstructorCreateAccountSerializer, ParentCreateAccountSerializer,
                                   StudentCreateAccountSerializer)
 
+from .admin_search import TrigramSearchMixin
 from .constants import BENEFIT_PENDING, ROLE_INSTRUCTOR, ROLE_PARENT, ROLE_STUDENT
 from .forms import CreateUserForm
 from .models import ScheduledTask, UserBenefits
@@ -65,7 +66,7 @@ def send_email_reset_password(user):
         return None         
 
 
-class UserAdmin(admin.ModelAdmin):
+class UserAdmin(TrigramSearchMixin, admin.ModelAdmin):
     """Copied from django.contrib.auth.admin.UserAdmin"""
     fieldsets = (
         (None, {'fields': ('email', 'first_name', 'last_name', 'profile',)}),
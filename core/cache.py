@@ -0,0 +1,108 @@
+"""Cache of view responses, invalidated by tags.
+Each tag has a version stored in cache; cache keys of responses include versions of their tags, then
+invalidating a tag (incrementing its version) makes unreachable all responses cached with it."""
+import functools
+import json
+import time
+
+from hashlib import md5
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+
+from rest_framework.response import Response
+
+# models whose changes invalidate each tag
+CACHE_TAG_MODELS = {
+    'instructors': ('accounts.Instructor', 'accounts.InstructorLessonRate', 'accounts.InstructorInstruments',
+                    'accounts.InstructorAgeGroup', 'accounts.InstructorPlaceForLessons',
+                    'accounts.InstructorAdditionalQualifications', 'accounts.Availability',
+                    'accounts.InstructorReview', 'lesson.Instrument', 'lesson.Lesson'),
+    'lesson_requests': ('lesson.LessonRequest', 'lesson.Application', 'accounts.Parent', 'accounts.Student',
+                        'accounts.TiedStudent'),
+    'offers': ('notices.Offer', ),
+}
+
+
+def _tag_key(tag):
+    return f'cache_tag:{tag}'
+
+
+def get_tag_versions(tags):
+    """Return a list with current version of each tag"""
+    keys = [_tag_key(tag) for tag in tags]
+    versions = cache.get_many(keys)
+    missing = {key: int(time.time() * 1000) for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, None)
+        versions.update(missing)
+    return [versions[key] for key in keys]
+
+
+def invalidate_cache_tags(*tags):
+    """Invalidate all responses cached with any of provided tags"""
+    for tag in tags:
+        try:
+            cache.incr(_tag_key(tag))
+        except ValueError:   # tag version is not stored
+            cache.set(_tag_key(tag), int(time.time() * 1000), None)
+
+
+def build_view_cache_key(view_name, request, tags, args=(), kwargs=None):
+    """Return cache key for a view response, from url params, normalized query params and versions of tags"""
+    params = sorted((key, sorted(values)) for key, values in request.query_params.lists())
+    raw_key = json.dumps([request.get_host(), [str(arg) for arg in args],
+                          sorted((key, str(value)) for key, value in (kwargs or {}).items()),
+                          params, get_tag_versions(tags)])
+    return f'view:{view_name}:{md5(raw_key.encode()).hexdigest()}'
+
+
+def cache_response(tags, timeout=None, anonymous_only=False):
+    """Decorator for get method of an APIView, to store in cache successful responses.
+    Responses are invalidated when a model related to any of tags is saved or deleted."""
+    def decorator(method):
+        view_name = method.__qualname__
+
+        @functools.wraps(method)
+        def wrapper(view, request, *args, **kwargs):
+            if anonymous_only and request.user.is_authenticated:
+                return method(view, request, *args, **kwargs)
+            key = build_view_cache_key(view_name, request, tags, args, kwargs)
+            data = cache.get(key)
+            if data is not None:
+                return Response(data)
+            response = method(view, request, *args, **kwargs)
+            if response.status_code == 200:
+                cache.set(key, response.data,
+                          timeout if timeout is not None else settings.CACHE_VIEW_TIMEOUT)
+            return response
+        return wrapper
+    return decorator
+
+
+def _invalidate_receiver(tags):
+    def invalidate(sender, **kwargs):
+        # executed for fixtures too, as cached data becomes outdated. Versions are changed after commit,
+        # otherwise a concurrent request could cache rows read before commit with the new versions
+        transaction.on_commit(lambda: invalidate_cache_tags(*tags))
+    return invalidate
+
+
+_receivers = []
+
+
+def connect_cache_invalidation():
+    """Connect post_save and post_delete signals of models in CACHE_TAG_MODELS, to invalidate their tags"""
+    model_tags = {}
+    for tag, model_labels in CACHE_TAG_MODELS.items():
+        for model_label in model_labels:
+            model_tags.setdefault(model_label, []).append(tag)
+    for model_label, tags in model_tags.items():
+        model = apps.get_model(model_label)
+        receiver = _invalidate_receiver(tuple(tags))
+        _receivers.append(receiver)   # signals keep weak references to receivers
+        post_save.connect(receiver, sender=model, dispatch_uid=f'cache_invalidation_save_{model_label}')
+        post_delete.connect(receiver, sender=model, dispatch_uid=f'cache_invalidation_delete_{model_label}')
@@ -287,15 +287,19 @@ SERVICES_CHOICES = (
 )
 
 # --- statuses for payment ---
-PY_REGISTERED = 'registered'
+PY_PENDING = 'pending'   # registered before requesting charge to Stripe
+PY_REGISTERED = 'registered'   # charged
 PY_PROCESSED = 'processed'   # ToDo: to delete it
 PY_APPLIED = 'applied'
 PY_CANCELLED = 'cancelled'
+PY_FAILED = 'failed'
 PY_STATUSES = (
+    (PY_PENDING, PY_PENDING),
     (PY_REGISTERED, PY_REGISTERED),
     (PY_PROCESSED, PY_PROCESSED),
     (PY_APPLIED, PY_APPLIED),
     (PY_CANCELLED, PY_CANCELLED),
+    (PY_FAILED, PY_FAILED),
 )
 
 # --- PACKAGES FOR LESSONS ---
@@ -0,0 +1,36 @@
+import timeit
+from os import path
+
+from django.conf import settings
+from django.core.management import BaseCommand
+
+from storages.backends.s3boto3 import S3Boto3Storage
+
+from accounts.avatars import AVATAR_SIZES
+from accounts.models import Instructor
+from core.storage_backends import MediaStorage
+
+
+class Command(BaseCommand):
+    help = 'Compare time to build avatar urls of a page of instructors, with signed S3 urls and with MediaStorage'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=20)
+        parser.add_argument('--repeat', type=int, default=50)
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        names = list(Instructor.objects.exclude(avatar='').exclude(avatar__isnull=True)
+                     .values_list('avatar', flat=True)[:rows])
+        # fake names are used when there are not enough avatars; urls are built without requests to S3
+        names += [f'avatars/instructor{i}@example.com/avatar.jpg' for i in range(rows - len(names))]
+        # each row shows original avatar and its thumbnails
+        names += [f'{path.splitext(name)[0]}_{size}.jpg' for name in names for size in AVATAR_SIZES]
+        storages = [('signed S3 urls', S3Boto3Storage(location=settings.MEDIA_LOCATION, querystring_auth=True,
+                                                       custom_domain=None)),
+                    ('MediaStorage', MediaStorage())]
+        for label, storage in storages:
+            storage.url(names[0])   # boto3 client is created in first call
+            seconds = timeit.timeit(lambda: [storage.url(name) for name in names], number=options['repeat'])
+            self.stdout.write(f'{label}: {seconds * 1000 / options["repeat"]:.2f} ms per page '
+                              f'({rows} rows, {len(names)} urls)')
@@ -0,0 +1,45 @@
+import re
+
+from django.db import migrations, models
+
+# tokens assigned temporarily in registration (email prefix and a timestamp) are not counted
+TIMESTAMP_SUFFIX_LENGTH = 6
+
+
+def fill_counters(apps, schema_editor):
+    """Register a counter for each base of existing referral tokens, with greatest used suffix"""
+    User = apps.get_model('core', 'User')
+    ReferralTokenCounter = apps.get_model('core', 'ReferralTokenCounter')
+    User.objects.filter(referral_token='').update(referral_token=None)
+    counters = {}
+    for token in User.objects.exclude(referral_token__isnull=True).values_list('referral_token', flat=True):
+        base_token, suffix = re.match(r'^(.*?)(\d*)$', token.lower()).groups()
+        if not base_token or len(suffix) >= TIMESTAMP_SUFFIX_LENGTH:
+            continue
+        counters[base_token] = max(counters.get(base_token, 0), int(suffix) if suffix else 1)
+    ReferralTokenCounter.objects.bulk_create([ReferralTokenCounter(base_token=base_token, last_suffix=suffix)
+                                              for base_token, suffix in counters.items()], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0020_scheduledtask_limit_execution'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReferralTokenCounter',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('base_token', models.CharField(max_length=20, unique=True)),
+                ('last_suffix', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='referral_token',
+            field=models.CharField(blank=True, max_length=20, null=True, unique=True),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
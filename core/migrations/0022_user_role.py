@@ -0,0 +1,29 @@
+from django.db import migrations, models
+
+# lower precedence first, so role of users with several accounts is the one with greater precedence
+ACCOUNT_MODELS = (('affiliate', 'Affiliate'), ('student', 'Student'), ('parent', 'Parent'),
+                  ('instructor', 'Instructor'))
+
+
+def fill_roles(apps, schema_editor):
+    User = apps.get_model('core', 'User')
+    for role, model_name in ACCOUNT_MODELS:
+        account_model = apps.get_model('accounts', model_name)
+        User.objects.filter(id__in=account_model.objects.values('user_id')).update(role=role)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0050_auto_20201008_1210'),
+        ('core', '0021_referraltokencounter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='role',
+            field=models.CharField(blank=True, choices=[('instructor', 'instructor'), ('parent', 'parent'), ('student', 'student'), ('affiliate', 'affiliate')], max_length=20),
+        ),
+        migrations.RunPython(fill_roles, migrations.RunPython.noop),
+    ]
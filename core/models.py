@@ -1,6 +1,7 @@
 from django.contrib.auth.models import AbstractUser, BaseUserManager
 from django.contrib.postgres.fields import JSONField
-from django.db import models
+from django.contrib.postgres.indexes import GinIndex
+from django.db import IntegrityError, connection, models, transaction
 from django.utils import timezone
 
 from .constants import (
@@ -10,6 +11,13 @@ from .constants import (
 )
 
 
+# in order of precedence, when an user has several accounts
+ACCOUNT_ROLES = (ROLE_INSTRUCTOR, ROLE_PARENT, ROLE_STUDENT, ROLE_AFFILIATE)
+ROLE_CHOICES = tuple((role, role) for role in ACCOUNT_ROLES)
+REFERRAL_TOKEN_BASE_LENGTH = 16
+REFERRAL_TOKEN_MAX_ATTEMPTS = 100
+
+
 class UserManager(BaseUserManager):
     """Define required methods for custom User model usage."""
 
@@ -25,6 +33,7 @@ class UserManager(BaseUserManager):
             ind_at_sign = 8
         user = self.model(email=email, **extra_fields)
         user.set_password(password)
+        # temporary token (ending in digits), replaced by a name based one when account is created
         user.referral_token = email[:ind_at_sign] + timezone.now().strftime('%H%M%S%f')
         user.save()
         user.set_user_benefits()
@@ -48,8 +57,16 @@ class UserManager(BaseUserManager):
 class User(AbstractUser):
     email = models.EmailField('email address', unique=True)
     username = models.CharField(blank=True, default='', max_length=120)
-    referral_token = models.CharField(max_length=20, blank=True, unique=True)
+    referral_token = models.CharField(max_length=20, blank=True, null=True, unique=True)
     referred_by = models.ForeignKey('self', blank=True, null=True, related_name='referrals', on_delete=models.SET_NULL)
+    role = models.CharField(max_length=20, blank=True, choices=ROLE_CHOICES)   # set when account is created
+    calendar_token_version = models.PositiveIntegerField(default=0)   # increased to revoke calendar feed url
+
+    class Meta(AbstractUser.Meta):
+        # trigram indexes, for searches in admin
+        indexes = [GinIndex(fields=['email'], name='user_email_trgm', opclasses=['gin_trgm_ops']),
+                   GinIndex(fields=['first_name'], name='user_first_name_trgm', opclasses=['gin_trgm_ops']),
+                   GinIndex(fields=['last_name'], name='user_last_name_trgm', opclasses=['gin_trgm_ops'])]
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = []
@@ -57,16 +74,17 @@ class User(AbstractUser):
     objects = UserManager()
 
     def get_role(self):
-        if hasattr(self, 'instructor'):
-            return ROLE_INSTRUCTOR
-        elif hasattr(self, 'parent'):
-            return ROLE_PARENT
-        elif hasattr(self, 'student'):
-            return ROLE_STUDENT
-        elif hasattr(self, 'affiliate'):
-            return ROLE_AFFILIATE
-        else:
-            return 'unknown'
+        """Return role of user, stored in role field (set when account is created). If it's not stored,
+        role is obtained with a single query, and stored."""
+        if not self.role and self.pk:
+            account_ids = User.objects.filter(pk=self.pk)\
+                .values_list('instructor__id', 'parent__id', 'student__id', 'affiliate__id').first() or ()
+            for role, account_id in zip(ACCOUNT_ROLES, account_ids):
+                if account_id:
+                    self.role = role
+                    User.objects.filter(pk=self.pk).update(role=role)
+                    break
+        return self.role or 'unknown'
 
     @classmethod
     def get_user_from_refer_code(cls, ref_code):
@@ -78,6 +96,22 @@ class User(AbstractUser):
             pass
         return user
 
+    def set_referral_token(self, base_token):
+        """Assign a unique referral token derived from base_token (base_token, base_token2, base_token3, ...)
+        and save user. Tokens are allocated by ReferralTokenCounter, in a single query; a token registered
+        by other means (so it's not counted) raises an IntegrityError, then next one is allocated."""
+        base_token = base_token.lower()[:REFERRAL_TOKEN_BASE_LENGTH] or 'user'
+        for attempt in range(REFERRAL_TOKEN_MAX_ATTEMPTS):
+            self.referral_token = ReferralTokenCounter.allocate(base_token)
+            try:
+                with transaction.atomic():
+                    self.save()
+                return self.referral_token
+            except IntegrityError:
+                if not User.objects.filter(referral_token=self.referral_token).exclude(pk=self.pk).exists():
+                    raise
+        raise IntegrityError(f'Referral token could not be allocated for {base_token}')
+
     def set_user_benefits(self):
         """Create benefits to user whether have been referred by another user."""
         if self.referred_by:
@@ -91,14 +125,49 @@ class User(AbstractUser):
                                         benefit_type=BENEFIT_AMOUNT, benefit_qty=5,
                                         status=BENEFIT_PENDING, source='Registration of referred user')
 
+    def has_account(self, role):
+        """Return True if user has an account of provided role. Stored role is the first one in ACCOUNT_ROLES, so
+        an account of a later role is possible only for users with several accounts, and that is queried"""
+        user_role = self.get_role()
+        if user_role == role:
+            return True
+        if user_role in ACCOUNT_ROLES and ACCOUNT_ROLES.index(user_role) < ACCOUNT_ROLES.index(role):
+            return hasattr(self, role)
+        return False
+
     def is_instructor(self):
-        return hasattr(self, 'instructor')
+        return self.has_account(ROLE_INSTRUCTOR)
 
     def is_parent(self):
-        return hasattr(self, 'parent')
+        return self.has_account(ROLE_PARENT)
 
     def is_student(self):
-        return hasattr(self, 'student')
+        return self.has_account(ROLE_STUDENT)
+
+
+class ReferralTokenCounter(models.Model):
+    """Last suffix used for referral tokens with a base token; tokens are base_token (suffix 1),
+    base_token2, base_token3, ..."""
+    base_token = models.CharField(max_length=20, unique=True)
+    last_suffix = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.base_token} ({self.last_suffix})'
+
+    @classmethod
+    def allocate(cls, base_token):
+        """Return next referral token for base_token. Counter is incremented in a single statement
+        (INSERT ... ON CONFLICT), so concurrent registrations obtain different tokens"""
+        table = cls._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(f'INSERT INTO {table} (base_token, last_suffix) VALUES (%s, 1) '
+                           f'ON CONFLICT (base_token) DO UPDATE SET last_suffix = {table}.last_suffix + 1 '
+                           f'RETURNING last_suffix', [base_token])
+            suffix = cursor.fetchone()[0]
+        if suffix == 1:
+            return base_token
+        suffix = str(suffix)
+        return base_token[:User._meta.get_field('referral_token').max_length - len(suffix)] + suffix
 
 
 class UserToken(models.Model):
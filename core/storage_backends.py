@@ -1,7 +1,37 @@
+from hashlib import md5
+
 from django.conf import settings
+from django.core.cache import cache
 
 from storages.backends.s3boto3 import S3Boto3Storage
 
+# signed urls are cached until this number of seconds before they expire
+MEDIA_SIGNED_URL_MARGIN = 3600
+
 
 class MediaStorage(S3Boto3Storage):
+    """Storage of uploaded files. Urls are public ones, in MEDIA_CUSTOM_DOMAIN (a CDN or bucket domain), built
+    without boto3. When MEDIA_SIGNED_URLS is set, signed urls are generated once and cached by object name,
+    so a file keeps the same url (cacheable by browsers) until a while before it expires.
+    Files are never overwritten, so they can be cached for long."""
     location = settings.MEDIA_LOCATION
+    file_overwrite = False
+    object_parameters = {'CacheControl': f'max-age={getattr(settings, "MEDIA_CACHE_MAX_AGE", 31536000)}'}
+    querystring_auth = getattr(settings, 'MEDIA_SIGNED_URLS', False)
+    querystring_expire = getattr(settings, 'MEDIA_SIGNED_URL_EXPIRE', 7 * 24 * 3600)
+    # urls can't be signed with a custom domain
+    custom_domain = None if querystring_auth else getattr(settings, 'MEDIA_CUSTOM_DOMAIN', None)
+
+    def url(self, name, parameters=None, expire=None):
+        if parameters or expire or self.custom_domain:
+            # with custom domain, url is built from name only
+            return super().url(name, parameters=parameters, expire=expire)
+        key = f'media_url:{md5(name.encode()).hexdigest()}'
+        url = cache.get(key)
+        if url is None:
+            url = super().url(name)
+            if self.querystring_auth:
+                cache.set(key, url, max(self.querystring_expire - MEDIA_SIGNED_URL_MARGIN, 0))
+            else:
+                cache.set(key, url, None)
+        return url
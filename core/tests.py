@@ -1,3 +1,108 @@
-from django.test import TestCase
+from django.contrib import admin
+from django.core.cache import cache
+from django.test import RequestFactory, TestCase
 
-# Create your tests here.
+from rest_framework import views
+from rest_framework.permissions import AllowAny
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory
+
+from accounts.models import Student
+
+from .admin_search import EstimatedCountPaginator
+from .cache import cache_response, get_tag_versions, invalidate_cache_tags
+from .models import ReferralTokenCounter, User
+
+
+class CountingView(views.APIView):
+    permission_classes = (AllowAny, )
+    calls = 0
+
+    @cache_response(['test_tag'])
+    def get(self, request):
+        CountingView.calls += 1
+        return Response({'calls': CountingView.calls, 'param': request.query_params.get('param')})
+
+
+class CacheResponseTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        CountingView.calls = 0
+        self.factory = APIRequestFactory()
+        self.view = CountingView.as_view()
+
+    def test_cached_response(self):
+        response = self.view(self.factory.get('/test/', {'param': 'a', 'other': 'b'}))
+        self.assertEqual(response.data, {'calls': 1, 'param': 'a'})
+        # same params in different order get cached response
+        response = self.view(self.factory.get('/test/?other=b&param=a'))
+        self.assertEqual(response.data, {'calls': 1, 'param': 'a'})
+        response = self.view(self.factory.get('/test/', {'param': 'c'}))
+        self.assertEqual(response.data, {'calls': 2, 'param': 'c'})
+
+    def test_invalidation(self):
+        versions = get_tag_versions(['test_tag'])
+        self.view(self.factory.get('/test/'))
+        invalidate_cache_tags('test_tag')
+        self.assertNotEqual(get_tag_versions(['test_tag']), versions)
+        response = self.view(self.factory.get('/test/'))
+        self.assertEqual(response.data, {'calls': 2, 'param': None})
+
+
+class ReferralTokenTest(TestCase):
+
+    def test_consecutive_tokens(self):
+        """Tokens with same base are numbered, starting from second one"""
+        tokens = []
+        for ind in range(3):
+            user = User(email=f'john@example{ind}.com')
+            tokens.append(user.set_referral_token('john'))
+        self.assertEqual(tokens, ['john', 'john2', 'john3'])
+        user1 = User(email='luis1@example.com')
+        user1.set_referral_token('luisd')
+        user2 = User(email='luis2@example.com')
+        user2.set_referral_token('LuisD')
+        self.assertEqual([user1.referral_token, user2.referral_token], ['luisd', 'luisd2'])
+        self.assertEqual(ReferralTokenCounter.objects.get(base_token='luisd').last_suffix, 2)
+
+    def test_temporary_token_replaced(self):
+        """Token of an user created by manager is temporary, and doesn't use counters; account sets final one"""
+        user = User.objects.create_user('john@example.com', 'pass', first_name='John', last_name='Doe')
+        self.assertTrue(user.referral_token[-6:].isdigit())
+        self.assertFalse(ReferralTokenCounter.objects.exists())
+        Student.objects.create(user=user).set_referral_token()
+        user.refresh_from_db()
+        self.assertEqual(user.referral_token, 'johnd')
+
+    def test_token_not_counted(self):
+        """A token assigned without counter is skipped"""
+        User.objects.create(email='old@example.com', referral_token='mariap2')
+        ReferralTokenCounter.objects.create(base_token='mariap', last_suffix=1)
+        user = User(email='maria@example.com')
+        user.set_referral_token('mariap')
+        self.assertEqual(user.referral_token, 'mariap3')
+        self.assertIsNotNone(user.pk)
+
+
+class AdminSearchTest(TestCase):
+    """Tests for trigram search and estimated count in admin changelists"""
+    fixtures = ['01_core_users.json', '03_accounts_parents.json', '04_accounts_students.json']
+
+    def setUp(self):
+        self.model_admin = admin.site._registry[Student]
+        self.request = RequestFactory().get('/admin/accounts/student/')
+
+    def test_search_terms(self):
+        """Every term should be found, in any of search fields (case insensitive)"""
+        queryset, use_distinct = self.model_admin.get_search_results(self.request, Student.objects.all(),
+                                                                     'LUISSTUDENT@ yopmail')
+        self.assertFalse(use_distinct)
+        self.assertIn(Student.objects.get(user__email='luisstudent@yopmail.com'), queryset)
+        self.assertFalse(queryset.filter(user__email='luisparent@yopmail.com').exists())
+        queryset, _ = self.model_admin.get_search_results(self.request, Student.objects.all(), 'luisstudent nomatch')
+        self.assertFalse(queryset.exists())
+
+    def test_count_of_small_table(self):
+        """Tables with few rows are counted exactly"""
+        self.assertEqual(EstimatedCountPaginator(Student.objects.all(), 20).count, Student.objects.count())
@@ -1,3 +1,4 @@
+import functools
 import random
 import requests
 import string
@@ -5,13 +6,15 @@ import string
 from datetime import datetime, timedelta
 from dateutil import relativedelta
 from djchoices import ChoiceItem, DjangoChoices
-from hashlib import sha1
+from hashlib import md5, sha1
 
 from django.conf import settings
 from django.core.mail import EmailMessage, EmailMultiAlternatives
 from django.db import IntegrityError
 from django.template import loader
 from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
 
 from core.constants import (DAY_MONDAY, DAY_TUESDAY, DAY_WEDNESDAY, DAY_THURSDAY, DAY_FRIDAY, DAY_SATURDAY, DAY_SUNDAY,
                             MONTH_CHOICES)
@@ -182,3 +185,43 @@ def build_error_dict(errors):
     if non_field_err:
         result['detail'] = non_field_err
     return result
+
+
+def build_etag(*values):
+    """Return a strong ETag built from provided values"""
+    return quote_etag(md5('|'.join(str(value) for value in values).encode()).hexdigest())
+
+
+def latest_datetime(*values):
+    """Return the most recent of provided datetimes, ignoring None values"""
+    values = [value for value in values if value is not None]
+    return max(values) if values else None
+
+
+def conditional_get(watermark_func, user_dependent=True):
+    """Decorator for get method of an APIView, to answer conditional requests (If-None-Match, If-Modified-Since)
+    with a 304 response, without building the payload.
+    watermark_func receives same params as get method and returns a tuple (last_modified, list_of_values),
+    being the values used to build the ETag; when it returns None, the request is processed as usual."""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(view, request, *args, **kwargs):
+            watermark = watermark_func(request, *args, **kwargs)
+            if watermark is None:
+                return method(view, request, *args, **kwargs)
+            last_modified, values = watermark
+            if user_dependent:
+                values = [request.user.id] + list(values)
+            etag = build_etag(request.get_full_path(), *values)
+            timestamp = int(last_modified.timestamp()) if last_modified else None
+            response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+            if response is None:
+                response = method(view, request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+            response['ETag'] = etag
+            if timestamp is not None:
+                response['Last-Modified'] = http_date(timestamp)
+            return response
+        return wrapper
+    return decorator
@@ -6,6 +6,7 @@ from django.utils import timezone
 
 from accounts.models import Instructor, TiedStudent
 from accounts.utils import add_to_email_list
+from core.admin_search import TrigramSearchMixin
 from core.constants import LESSON_REQUEST_ACTIVE, LESSON_REQUEST_CLOSED, PY_APPLIED
 from core.models import ScheduledTask, TaskLog, UserBenefits
 from lesson.models import Instrument
@@ -52,11 +53,12 @@ class ApplicationAdmin(admin.ModelAdmin):
         return super().formfield_for_foreignkey(db_field, request, **kwargs)
 
 
-class LessonBookingAdmin(admin.ModelAdmin):
+class LessonBookingAdmin(TrigramSearchMixin, admin.ModelAdmin):
     fields = ('view_application', 'application', 'request', 'user', 'tied_student', 'instructor', 'rate',
               'quantity', 'total_amount', 'description', 'payment', 'status')
     list_display = ('pk', 'get_user_email', 'application_id', 'quantity', 'total_amount', 'status', )
     list_filter = ('status', )
+    list_select_related = ('user', )
     readonly_fields = ('view_application', )
     search_fields = ('user__email', )
 
@@ -173,7 +175,7 @@ def close_lesson_request(model_admin, request, queryset):
 close_lesson_request.short_description = 'Close selected lesson requests'
 
 
-class LessonRequestAdmin(admin.ModelAdmin):
+class LessonRequestAdmin(TrigramSearchMixin, admin.ModelAdmin):
     list_display = ('pk', 'get_user_email',  'title', 'get_instrument', 'status')
     list_filter = ('status', 'skill_level', 'place_for_lessons', 'lessons_duration', )
     list_select_related = ('user', 'instrument', )
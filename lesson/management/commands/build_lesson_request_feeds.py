@@ -0,0 +1,19 @@
+from django.core.management import BaseCommand
+
+from core.constants import LESSON_REQUEST_CLOSED
+from lesson.models import LessonRequest, LessonRequestFeedItem
+
+
+class Command(BaseCommand):
+    help = 'Write feed items of active lesson requests, for instructors eligible for them'
+
+    def handle(self, *args, **options):
+        self.stdout.write('Start process ...')
+        self.stdout.flush()
+        for lesson_request in LessonRequest.objects.exclude(status=LESSON_REQUEST_CLOSED).select_related('user'):
+            # existing items are kept, so command can be run again
+            LessonRequestFeedItem.fan_out(lesson_request)
+            self.stdout.write(' . ')
+            self.stdout.flush()
+        self.stdout.write('Process complete ...')
+        self.stdout.flush()
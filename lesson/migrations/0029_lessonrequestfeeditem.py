@@ -0,0 +1,34 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0053_display_name_trigram_indexes'),
+        ('lesson', '0028_auto_20201003_1644'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LessonRequestFeedItem',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('distance', models.FloatField(blank=True, null=True)),
+                ('rank', models.FloatField()),
+                ('seen', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('instructor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE,
+                                                 related_name='request_feed', to='accounts.Instructor')),
+                ('request', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE,
+                                              related_name='feed_items', to='lesson.LessonRequest')),
+            ],
+            options={
+                'unique_together': {('instructor', 'request')},
+            },
+        ),
+        migrations.AddIndex(
+            model_name='lessonrequestfeeditem',
+            index=models.Index(fields=['instructor', '-rank'], name='feed_instructor_rank_idx'),
+        ),
+    ]
@@ -1,19 +1,28 @@
 import datetime as dt
+from functools import reduce
+from operator import or_
 
 from django.contrib.auth import get_user_model
+from django.contrib.gis.db.models import PointField
+from django.contrib.gis.db.models.functions import Distance
+from django.contrib.gis.measure import D
 from django.contrib.postgres.fields import JSONField
 from django.db import models, transaction
 from django.utils import timezone
 
-from accounts.models import Instructor, Parent, Student, TiedStudent
+from accounts.models import Instructor, InstructorInstruments, Parent, Student, TiedStudent, get_account
+from core.cache import invalidate_cache_tags
 from core.constants import *
-from core.models import ScheduledTask
+from core.models import ScheduledTask, TaskLog, UserBenefits
 from payments.models import Payment
 
-from lesson.utils import get_next_date_same_weekday, ABREV_DAY_TO_STRING, TIMEFRAME_TO_STRING
+from lesson.utils import (get_next_date_same_weekday, get_skill_levels_to_teach, ABREV_DAY_TO_STRING,
+                          TIMEFRAME_TO_STRING)
 
 User = get_user_model()
 POPULAR_INSTRUMENTS = ['piano', 'guitar', 'singing', 'violin', 'drums', 'flute', 'ukulele', ]
+FEED_DEFAULT_DISTANCE = 50   # miles, for lesson requests without travel distance
+FEED_DISTANCE_PENALTY = 360   # seconds per mile, for ranking of requests in instructors' feed
 
 
 class Instrument(models.Model):
@@ -67,6 +76,29 @@ class LessonRequest(models.Model):
         else:
             return None
 
+    def get_eligible_instructors(self):
+        """Return instructors eligible for lesson request: teaching its instrument at its skill level,
+        speaking its language (if any) and, when lessons aren't online, close enough to requestor.
+        Instructors are annotated with distance to requestor (None when requestor location is unknown)"""
+        instructors = Instructor.objects.filter(id__in=InstructorInstruments.objects.filter(
+            instrument_id=self.instrument_id,
+            skill_level__in=get_skill_levels_to_teach(self.skill_level)
+        ).values('instructor_id'))
+        if self.language:
+            instructors = instructors.filter(languages__icontains=self.language)
+        account = get_account(self.user)
+        point = account.coordinates if account else None
+        if self.place_for_lessons != PLACE_FOR_LESSONS_ONLINE:
+            if point is None:
+                instructors = instructors.none()
+            else:
+                instructors = instructors.filter(coordinates__distance_lte=(
+                    point, D(mi=self.travel_distance or FEED_DEFAULT_DISTANCE)
+                ))
+        if point is not None:
+            return instructors.annotate(distance=Distance('coordinates', point))
+        return instructors.annotate(distance=models.Value(None, output_field=models.FloatField()))
+
     def availability_as_string(self):
         resp_list = []
         for item in self.trial_availability_schedule:
@@ -75,6 +107,76 @@ class LessonRequest(models.Model):
         return ', '.join(resp_list)
 
 
+class LessonRequestFeedItem(models.Model):
+    """Lesson request offered to an instructor. Items are written once, when request is created
+    (fan_out_lesson_request task), so feed of an instructor is read with an index range scan"""
+    instructor = models.ForeignKey(Instructor, related_name='request_feed', on_delete=models.CASCADE)
+    request = models.ForeignKey(LessonRequest, related_name='feed_items', on_delete=models.CASCADE)
+    distance = models.FloatField(blank=True, null=True)   # in miles, None when it's unknown
+    rank = models.FloatField()   # greater rank first
+    seen = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('instructor', 'request')
+        indexes = [models.Index(fields=['instructor', '-rank'], name='feed_instructor_rank_idx')]
+
+    @classmethod
+    def build(cls, instructor_id, lesson_request, miles):
+        """Return (unsaved) feed item; newer requests go first, and closer ones are moved up as they were created
+        FEED_DISTANCE_PENALTY seconds later per mile"""
+        return cls(instructor_id=instructor_id, request=lesson_request, distance=miles,
+                   rank=lesson_request.created_at.timestamp() - (miles or 0) * FEED_DISTANCE_PENALTY)
+
+    @classmethod
+    def fan_out(cls, lesson_request):
+        """Write feed items for instructors eligible for lesson request. Return number of instructors"""
+        values = lesson_request.get_eligible_instructors().values_list('id', 'distance')
+        items = [cls.build(instructor_id, lesson_request, distance.mi if distance is not None else None)
+                 for instructor_id, distance in values]
+        cls.objects.bulk_create(items, batch_size=1000, ignore_conflicts=True)
+        return len(items)
+
+    @classmethod
+    def fan_in(cls, instructor):
+        """Write feed items of active lesson requests which instructor is eligible for (rules of
+        LessonRequest.get_eligible_instructors), and remove items of active requests it's not eligible for anymore.
+        Used when instruments, languages or location of instructor change. Return number of requests in feed"""
+        conditions = []
+        for item in instructor.instructorinstruments_set.all():
+            skill_levels = [level for level, _ in SKILL_LEVEL_CHOICES
+                            if item.skill_level in get_skill_levels_to_teach(level)]
+            conditions.append(models.Q(instrument_id=item.instrument_id, skill_level__in=skill_levels))
+        active_requests = LessonRequest.objects.exclude(status=LESSON_REQUEST_CLOSED)
+        items = []
+        if conditions:
+            qs = active_requests.filter(reduce(or_, conditions)).annotate(coords=models.Case(
+                models.When(user__parent__isnull=False, then=models.F('user__parent__coordinates')),
+                models.When(user__student__isnull=False, then=models.F('user__student__coordinates')),
+                default=None,
+                output_field=PointField())
+            )
+            if instructor.coordinates:
+                qs = qs.annotate(distance=Distance('coords', instructor.coordinates))
+            else:
+                qs = qs.annotate(distance=models.Value(None, output_field=models.FloatField()))
+            # languages are matched as icontains lookup does, against text of array
+            languages = ','.join(instructor.languages or []).upper()
+            for lesson_request in qs:
+                if lesson_request.language and lesson_request.language.upper() not in languages:
+                    continue
+                miles = lesson_request.distance.mi if lesson_request.distance is not None else None
+                if lesson_request.place_for_lessons != PLACE_FOR_LESSONS_ONLINE and \
+                        (miles is None or miles > (lesson_request.travel_distance or FEED_DEFAULT_DISTANCE)):
+                    continue
+                items.append(cls.build(instructor.id, lesson_request, miles))
+        with transaction.atomic():
+            cls.objects.filter(instructor=instructor, request__in=active_requests)\
+                .exclude(request_id__in=[item.request_id for item in items]).delete()
+            cls.objects.bulk_create(items, batch_size=1000, ignore_conflicts=True)
+        return len(items)
+
+
 class Application(models.Model):
     request = models.ForeignKey(LessonRequest, related_name='applications', on_delete=models.PROTECT)
     instructor = models.ForeignKey(Instructor, related_name='applications', on_delete=models.CASCADE)
@@ -183,38 +285,78 @@ class LessonBooking(models.Model):
             return None
 
     def create_lessons(self, last_lesson):
+        """Create lessons of booking (weekly, after last_lesson) and their reminders, in bulk"""
         next_date = get_next_date_same_weekday(last_lesson.scheduled_datetime.date())
-        next_datetime = dt.datetime.combine(next_date, last_lesson.scheduled_datetime.time(),
-                                            tzinfo=last_lesson.scheduled_datetime.tzinfo)
+        lessons = []
         for i in range(self.quantity):
-            lesson = Lesson.objects.create(booking=self,
-                                           scheduled_datetime=next_datetime,
-                                           scheduled_timezone=last_lesson.scheduled_timezone,
-                                           instructor=self.instructor,
-                                           rate=self.rate,
-                                           status=Lesson.SCHEDULED)
-            ScheduledTask.objects.create(function_name='send_lesson_reminder',
-                                         schedule=lesson.scheduled_datetime - timezone.timedelta(minutes=60),
-                                         limit_execution=lesson.scheduled_datetime + timezone.timedelta(minutes=60),
-                                         parameters={'lesson_id': lesson.id, 'user_id': lesson.booking.user.id})
-            sch_time = lesson.scheduled_datetime.time()
-            minutes_before = 10 if sch_time.minute % 5 == 0 else 15
-            ScheduledTask.objects.create(function_name='send_sms_reminder_lesson',
-                                         schedule=lesson.scheduled_datetime - timezone.timedelta(minutes=minutes_before),
-                                         limit_execution=lesson.scheduled_datetime + timezone.timedelta(minutes=10),
-                                         parameters={'lesson_id': lesson.id})
-            if lesson.instructor:
-                ScheduledTask.objects.create(function_name='send_reminder_grade_lesson',
-                                             schedule=lesson.scheduled_datetime + timezone.timedelta(minutes=30),
-                                             limit_execution=lesson.scheduled_datetime + timezone.timedelta(minutes=60),
-                                             parameters={'lesson_id': lesson.id})
-                ScheduledTask.objects.create(function_name='send_lesson_reminder',
-                                             schedule=lesson.scheduled_datetime - timezone.timedelta(minutes=60),
-                                             limit_execution=lesson.scheduled_datetime + timezone.timedelta(minutes=60),
-                                             parameters={'lesson_id': lesson.id, 'user_id': lesson.instructor.user.id})
-            next_date = next_date + dt.timedelta(days=7)
             next_datetime = dt.datetime.combine(next_date, last_lesson.scheduled_datetime.time(),
                                                 tzinfo=last_lesson.scheduled_datetime.tzinfo)
+            lessons.append(Lesson(booking=self,
+                                  scheduled_datetime=next_datetime,
+                                  scheduled_timezone=last_lesson.scheduled_timezone,
+                                  instructor=self.instructor,
+                                  rate=self.rate,
+                                  status=Lesson.SCHEDULED))
+            next_date = next_date + dt.timedelta(days=7)
+        lessons = Lesson.objects.bulk_create(lessons)
+        tasks = []
+        for lesson in lessons:
+            tasks.append(ScheduledTask(function_name='send_lesson_reminder',
+                                       schedule=lesson.scheduled_datetime - timezone.timedelta(minutes=60),
+                                       limit_execution=lesson.scheduled_datetime + timezone.timedelta(minutes=60),
+                                       parameters={'lesson_id': lesson.id, 'user_id': self.user_id}))
+            sch_time = lesson.scheduled_datetime.time()
+            minutes_before = 10 if sch_time.minute % 5 == 0 else 15
+            tasks.append(ScheduledTask(function_name='send_sms_reminder_lesson',
+                                       schedule=lesson.scheduled_datetime - timezone.timedelta(minutes=minutes_before),
+                                       limit_execution=lesson.scheduled_datetime + timezone.timedelta(minutes=10),
+                                       parameters={'lesson_id': lesson.id}))
+            if self.instructor:
+                tasks.append(ScheduledTask(function_name='send_reminder_grade_lesson',
+                                           schedule=lesson.scheduled_datetime + timezone.timedelta(minutes=30),
+                                           limit_execution=lesson.scheduled_datetime + timezone.timedelta(minutes=60),
+                                           parameters={'lesson_id': lesson.id}))
+                tasks.append(ScheduledTask(function_name='send_lesson_reminder',
+                                           schedule=lesson.scheduled_datetime - timezone.timedelta(minutes=60),
+                                           limit_execution=lesson.scheduled_datetime + timezone.timedelta(minutes=60),
+                                           parameters={'lesson_id': lesson.id, 'user_id': self.instructor.user_id}))
+        ScheduledTask.objects.bulk_create(tasks)
+        # post_save is not sent by bulk creation, so cached responses and instructor's occupancy are updated here
+        transaction.on_commit(lambda: invalidate_cache_tags('instructors'))
+        if self.instructor_id:
+            from schedule.signals import update_occupancies_on_commit
+            update_occupancies_on_commit([(self.instructor_id, lesson.scheduled_datetime) for lesson in lessons])
+        return lessons
+
+    def apply_payment(self, payment):
+        """Post-payment stage: set booking as paid with charged payment, creating its lessons and updating
+        benefits of user. Booking row is locked, so it's applied once; notifications are sent after commit.
+        Return True if payment was applied by this call."""
+        from .tasks import send_booking_invoice, update_email_lists_booking_paid
+        with transaction.atomic():
+            booking = LessonBooking.objects.select_for_update().get(id=self.id)
+            if booking.status == LessonBooking.PAID:
+                return False
+            # last lesson is obtained before creating booking's lessons
+            last_lesson = Lesson.get_last_lesson(user=booking.user, tied_student=booking.tied_student)
+            booking.payment = payment
+            booking.status = LessonBooking.PAID
+            booking.save()
+            if booking.request:
+                booking.request.status = LESSON_REQUEST_CLOSED
+                booking.request.save()
+            payment.status = PY_APPLIED
+            payment.save()
+            if last_lesson and booking.lessons.count() == 0:
+                booking.create_lessons(last_lesson)
+            # update data for applicable benefits
+            UserBenefits.update_applicable_benefits(booking.user)
+            invoice_log = TaskLog.objects.create(task_name='send_booking_invoice', args={'booking_id': booking.id})
+            lists_log = TaskLog.objects.create(task_name='update_email_lists_booking_paid',
+                                               args={'user_id': booking.user_id})
+            transaction.on_commit(lambda: send_booking_invoice.delay(booking.id, invoice_log.id))
+            transaction.on_commit(lambda: update_email_lists_booking_paid.delay(booking.user_id, lists_log.id))
+        return True
 
 
 class Lesson(models.Model):
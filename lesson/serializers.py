@@ -1,18 +1,20 @@
-import datetime
 import stripe
 from dateutil import relativedelta
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.contrib.gis.measure import D
 from django.db.models import Q
 from django.utils import timezone
 
 from rest_framework import serializers
 
 from accounts.models import Instructor, TiedStudent, get_account
-from accounts.serializers import AvailavilitySerializer
+from accounts.serializers import AccountsListSerializer, AvailavilitySerializer
 from accounts.utils import get_stripe_customer_id
 from core.constants import *
+from payments.utils import is_customer_payment_method
+from schedule.intervals import localize_datetime
 
 from .models import Application, Instrument, Lesson, LessonBooking, LessonRequest, POPULAR_INSTRUMENTS
 from .utils import ABREV_DAYS, PACKAGES, RANGE_HOURS_CONV, get_date_time_from_datetime_timezone
@@ -21,6 +23,13 @@ User = get_user_model()
 stripe.api_key = settings.STRIPE_SECRET_KEY
 
 
+_created_at_field = serializers.DateTimeField(format='%Y-%m-%d %H:%M:%S')
+
+
+def _str_or_none(value):
+    return None if value is None else str(value)
+
+
 def validate_timezone(value):
     return value in timezone.pytz.all_timezones
 
@@ -120,8 +129,8 @@ class LessonRequestSerializer(serializers.ModelSerializer):
         validated_data['instrument_id'] = instrument.id
         if validated_data.get('date'):
             time_zone = validated_data.pop('timezone')
-            tz_offset = datetime.datetime.now(timezone.pytz.timezone(time_zone)).strftime('%z')
-            validated_data['trial_proposed_datetime'] = f"{validated_data.pop('date')} {validated_data.pop('time')}{tz_offset}"
+            validated_data['trial_proposed_datetime'] = localize_datetime(validated_data.pop('date'),
+                                                                          validated_data.pop('time'), time_zone)
             validated_data['trial_proposed_timezone'] = time_zone
         if self.context['is_parent']:
             parent_obj = User.objects.get(id=validated_data['user_id']).parent
@@ -297,8 +306,11 @@ class ApplicationListSerializer(serializers.ModelSerializer):
     title = serializers.CharField(max_length=100, source='request.title', read_only=True)
     date_applied = serializers.DateTimeField(format='%Y-%m-%d', source='created_at')
 
+    account_user_source = 'request.user'
+
     class Meta:
         model = Application
+        list_serializer_class = AccountsListSerializer
         fields = ('display_name', 'id', 'request_id', 'seen', 'title', 'date_applied')
 
     def get_display_name(self, instance):
@@ -376,11 +388,12 @@ class LessonRequestItemSerializer(serializers.ModelSerializer):
                   'gender', 'language', 'applications_received', 'applied', 'date', 'time', 'timezone')
 
     def get_applications_received(self, instance):
-        return instance.applications.count()
+        return len(instance.applications.all())
 
     def get_applied(self, instance):
         if self.context.get('user'):
-            return instance.applications.filter(instructor=self.context['user'].instructor).exists()
+            instructor_id = self.context['user'].instructor.id
+            return any(item.instructor_id == instructor_id for item in instance.applications.all())
         else:
             return False
 
@@ -391,52 +404,66 @@ class LessonRequestItemSerializer(serializers.ModelSerializer):
         else:
             return ''
 
-    def to_representation(self, instance):
-        data = super().to_representation(instance)
-        new_data = {'createdAt': data.get('created_at'),
-                    'displayName': data.get('display_name'),
-                    'distance': data.get('distance'),
-                    'id': data.get('id'),
-                    'instrument': data.get('instrument'),
-                    'lessonDuration': data.get('lessons_duration'),
-                    'gender': data.get('gender'),
-                    'language': data.get('language'),
-                    'requestMessage': data.get('message'),
-                    'placeForLessons': data.get('place_for_lessons'),
-                    'skillLevel': data.get('skill_level'),
-                    'requestTitle': data.get('title'),
-                    'role': data.get('role'),
-                    'applicationsReceived': data.get('applications_received'),
-                    'applied': data.get('applied')
-                    }
-        if data.get('role') == ROLE_STUDENT:
-            new_data['studentDetails'] = [{'name': instance.user.first_name, 'age': instance.user.student.age}]
-            try:
-                new_data['avatar'] = instance.user.student.avatar.url
-            except ValueError:
-                new_data['avatar'] = ''
-            new_data['location'] = instance.user.student.location
-        else:
-            new_data['studentDetails'] = data.get('students')
-            try:
-                new_data['avatar'] = instance.user.parent.avatar.url
-            except ValueError:
-                new_data['avatar'] = ''
-            new_data['location'] = instance.user.parent.location
-        if instance.trial_proposed_datetime:
+    def get_user_timezone(self):
+        """Return timezone of user in context, obtained once for all lesson requests"""
+        if not hasattr(self, '_user_timezone'):
             if self.context.get('user'):
                 account = get_account(self.context['user'])
-                if account.timezone:
-                    new_data['timezone'] = account.timezone
-                else:
-                    new_data['timezone'] = account.get_timezone_from_location_zipcode()
+                self._user_timezone = account.timezone or account.get_timezone_from_location_zipcode()
             else:
-                new_data['timezone'] = 'US/Eastern'
+                self._user_timezone = 'US/Eastern'
+        return self._user_timezone
+
+    def to_representation(self, instance):
+        """Build representation in a single pass; applications and students should be prefetched"""
+        role = instance.user.get_role()
+        if role == ROLE_STUDENT:
+            account = instance.user.student
+            student_details = [{'name': instance.user.first_name, 'age': account.age}]
+        else:
+            account = instance.user.parent
+            student_details = [{'name': _str_or_none(item.name), 'age': item.age} for item in instance.students.all()]
+        distance = getattr(instance, 'distance', None)
+        new_data = {'createdAt': _created_at_field.to_representation(instance.created_at),
+                    'displayName': account.display_name,
+                    'distance': float(distance.mi) if distance is not None else None,
+                    'id': instance.id,
+                    'instrument': _str_or_none(instance.instrument.name) if instance.instrument else None,
+                    'lessonDuration': instance.lessons_duration,
+                    'gender': instance.gender,
+                    'language': _str_or_none(instance.language),
+                    'requestMessage': _str_or_none(instance.message),
+                    'placeForLessons': instance.place_for_lessons,
+                    'skillLevel': instance.skill_level,
+                    'requestTitle': _str_or_none(instance.title),
+                    'role': role,
+                    'applicationsReceived': self.get_applications_received(instance),
+                    'applied': self.get_applied(instance),
+                    'studentDetails': student_details,
+                    'location': account.location,
+                    }
+        try:
+            new_data['avatar'] = account.avatar.url
+        except ValueError:
+            new_data['avatar'] = ''
+        new_data['avatarVariants'] = account.get_avatar_variants()
+        if instance.trial_proposed_datetime:
+            new_data['timezone'] = self.get_user_timezone()
             new_data['date'], new_data['time'] = get_date_time_from_datetime_timezone(instance.trial_proposed_datetime,
                                                                                       new_data['timezone'])
         return new_data
 
 
+class LessonRequestFeedSerializer(LessonRequestItemSerializer):
+    """Serializer for lesson requests in feed of an instructor; feed_distance and feed_seen should be annotated"""
+
+    def to_representation(self, instance):
+        instance.distance = D(mi=instance.feed_distance) if instance.feed_distance is not None else None
+        new_data = super().to_representation(instance)
+        new_data['seen'] = instance.feed_seen
+        return new_data
+
+
 class LessonRequestListQueryParamsSerializer(serializers.Serializer):
     """Serializer to be used with GET parameters in lesson request list endpoint."""
     distance = serializers.IntegerField(min_value=0, required=False)
@@ -584,6 +611,9 @@ class LessonBookingRegisterSerializer(serializers.Serializer):
     def validate_paymentMethodCode(self, value):
         user = User.objects.get(id=self.initial_data['userId'])
         customer_id = get_stripe_customer_id(user)
+        if customer_id and is_customer_payment_method(value, customer_id):
+            return value
+        # not in local mirror yet (webhook could be pending), then it's verified in Stripe
         try:
             pm = stripe.PaymentMethod.retrieve(value)
         except stripe.error.InvalidRequestError:
@@ -772,7 +802,10 @@ class InstructorDashboardSerializer(serializers.ModelSerializer):
                 return None
 
         def to_representation(self, instance):
-            data = super().to_representation(instance)
+            """Build representation in a single pass"""
+            data = {'bookingId': instance.id, 'instrument': self.get_instrument(instance),
+                    'lessonsBooked': instance.quantity, 'lessonsRemaining': self.get_lessonsRemaining(instance),
+                    'skillLevel': self.get_skillLevel(instance), 'lastLessonId': self.get_lastLessonId(instance)}
             if instance.user.is_parent():
                 data['parent'] = instance.user.parent.display_name
                 if instance.tied_student:
@@ -797,6 +830,7 @@ class InstructorDashboardSerializer(serializers.ModelSerializer):
         list_bookings = []
         user_id_ant = student_id_ant = 0
         for booking in instance.bookings.filter(status__in=[LessonBooking.PAID, LessonBooking.TRIAL])\
+                .select_related('user__parent', 'user__student', 'tied_student__tied_student_details__instrument')\
                 .order_by('user', 'tied_student', '-id'):
             if booking.user_id != user_id_ant or booking.tied_student_id != student_id_ant:
                 list_bookings.append(booking)
@@ -820,13 +854,14 @@ class LessonRequestInstructorDashboardSerializer(serializers.ModelSerializer):
     applicationsReceived = serializers.IntegerField(source='applications.count', read_only=True)
     studentDetails = serializers.SerializerMethodField()
     avatar = serializers.SerializerMethodField()
+    avatarVariants = serializers.SerializerMethodField()
     location = serializers.SerializerMethodField()
 
     class Meta:
         model = LessonRequest
         fields = ('id', 'requestTitle', 'displayName', 'distance', 'instrument', 'lessonDuration',
                   'placeForLessons', 'skillLevel', 'elapsedTime', 'role', 'applicationsReceived', 'studentDetails',
-                  'avatar', 'location')
+                  'avatar', 'avatarVariants', 'location')
 
     def get_displayName(self, instance):
         if instance.user.is_parent():
@@ -852,6 +887,12 @@ class LessonRequestInstructorDashboardSerializer(serializers.ModelSerializer):
             else:
                 return ''
 
+    def get_avatarVariants(self, instance):
+        if instance.user.is_parent():
+            return instance.user.parent.get_avatar_variants()
+        else:
+            return instance.user.student.get_avatar_variants()
+
     def get_location(self, instance):
         if instance.user.is_parent():
             return instance.user.parent.get_location()
@@ -903,8 +944,8 @@ class CreateLessonSerializer(serializers.ModelSerializer):
             validated_data['status'] = Lesson.SCHEDULED
         account = get_account(booking.user)
         time_zone = account.get_timezone_from_location_zipcode()
-        tz_offset = datetime.datetime.now(timezone.pytz.timezone(time_zone)).strftime('%z')
-        validated_data['scheduled_datetime'] = f"{validated_data.pop('date')} {validated_data.pop('time')}{tz_offset}"
+        validated_data['scheduled_datetime'] = localize_datetime(validated_data.pop('date'), validated_data.pop('time'),
+                                                                 time_zone)
         validated_data['scheduled_timezone'] = time_zone
         return super().create(validated_data)
 
@@ -942,8 +983,7 @@ class UpdateLessonSerializer(serializers.ModelSerializer):
         account = get_account(self.instance.booking.user)
         if attrs.get("date") and attrs.get("time"):
             time_zone = account.get_timezone_from_location_zipcode()
-            tz_offset = datetime.datetime.now(timezone.pytz.timezone(time_zone)).strftime('%z')
-            attrs['scheduled_datetime'] = f'{attrs.pop("date")} {attrs.pop("time")}{tz_offset}'
+            attrs['scheduled_datetime'] = localize_datetime(attrs.pop('date'), attrs.pop('time'), time_zone)
             attrs['scheduled_timezone'] = time_zone
         # verify data existence for grade a lesson
         if (keys.get('grade', 0) + keys.get('comment', 0)) == 1:
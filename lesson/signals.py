@@ -0,0 +1,25 @@
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from core.models import TaskLog
+from payments.models import Payment
+from payments.signals import payment_captured
+
+from .models import LessonBooking, LessonRequest
+
+
+@receiver(payment_captured, sender=Payment)
+def apply_booking_payment(sender, payment, **kwargs):
+    booking = LessonBooking.objects.filter(payment=payment).first()
+    if booking:
+        booking.apply_payment(payment)
+
+
+@receiver(post_save, sender=LessonRequest)
+def fan_out_created_lesson_request(sender, instance, created, raw, **kwargs):
+    if raw or not created:
+        return
+    from .tasks import fan_out_lesson_request
+    task_log = TaskLog.objects.create(task_name='fan_out_lesson_request', args={'request_id': instance.id})
+    transaction.on_commit(lambda: fan_out_lesson_request.delay(instance.id, task_log.id))
@@ -13,9 +13,9 @@ from core.utils import send_admin_email
 from nabi_api_django.celery_config import app
 
 from core.models import ScheduledTask
-from .models import Lesson, LessonBooking, LessonRequest
+from .models import Lesson, LessonBooking, LessonRequest, LessonRequestFeedItem
 from .utils import (get_availability_field_names_from_availability_json, send_advice_assigned_instructor,
-                    send_alert_booking, send_info_lesson_graded,
+                    send_alert_booking, send_alert_request_instructors, send_info_lesson_graded,
                     send_info_lesson_student_parent, send_info_lesson_instructor,
                     send_invoice_booking, send_reschedule_lesson, send_trial_confirmation,
                     send_instructor_lesson_completed, )
@@ -69,6 +69,22 @@ def send_booking_invoice(booking_id, task_log_id):
     TaskLog.objects.filter(id=task_log_id).delete()
 
 
+@app.task
+def update_email_lists_booking_paid(user_id, task_log_id):
+    """Update email lists of user, when a booking was paid"""
+    try:
+        user = User.objects.get(id=user_id)
+    except User.DoesNotExist:
+        send_admin_email(
+            'Error executing update_email_lists_booking_paid task',
+            f'Executing task update_email_lists_booking_paid (params: user_id {user_id}, task_log_id {task_log_id}) '
+            f'User DoesNotExist error is raised'
+        )
+        return None
+    add_to_email_list(user, [], ['goal_trial_to_purchase'])
+    TaskLog.objects.filter(id=task_log_id).delete()
+
+
 @app.task
 def send_booking_alert(booking_id, task_log_id):
     """Send email to instructor which application was booked by a student/parent. And send email to administrator too"""
@@ -305,3 +321,28 @@ def send_email_assigned_instructor(booking_id, task_log_id):
         return None
     send_advice_assigned_instructor(booking)
     TaskLog.objects.filter(id=task_log_id).delete()
+
+
+@app.task
+def fan_out_lesson_request(request_id, task_log_id):
+    """Write lesson request in feeds of eligible instructors, and alert them via email"""
+    try:
+        lesson_request = LessonRequest.objects.get(id=request_id)
+    except LessonRequest.DoesNotExist:
+        send_admin_email(
+            'Error executing fan_out_lesson_request task',
+            f'Executing task fan_out_lesson_request (params: request_id {request_id}, task_log_id {task_log_id}) '
+            f'LessonRequest DoesNotExist error was raised'
+        )
+        return None
+    LessonRequestFeedItem.fan_out(lesson_request)
+    send_alert_request_instructors(lesson_request)
+    TaskLog.objects.filter(id=task_log_id).delete()
+
+
+@app.task
+def fan_in_lesson_requests(instructor_ids, task_log_id):
+    """Update feeds of instructors whose instruments, languages or location changed, with active lesson requests"""
+    for instructor in Instructor.objects.filter(id__in=instructor_ids).prefetch_related('instructorinstruments_set'):
+        LessonRequestFeedItem.fan_in(instructor)
+    TaskLog.objects.filter(id=task_log_id).delete()
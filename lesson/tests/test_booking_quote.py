@@ -0,0 +1,71 @@
+"""Property based tests for booking quotes, against formulas used previously in get_booking_data_v2"""
+from decimal import Decimal
+from types import SimpleNamespace
+
+from django.test import SimpleTestCase
+from hypothesis import given, strategies as st
+
+from core.constants import BENEFIT_AMOUNT, BENEFIT_DISCOUNT, BENEFIT_LESSON
+
+from ..utils import PACKAGES, build_additional_items, compute_booking_quote, select_benefit_to_redeem
+
+
+def reference_quote(additional_items, package_name, rate):
+    """Booking data as obtained previously in get_booking_data_v2"""
+    data = dict(additional_items)
+    data['lessonRate'] = rate
+    if data.get('freeLesson'):
+        data['lessonsPrice'] = rate * (PACKAGES[package_name].get('lesson_qty') - 1)
+    else:
+        data['lessonsPrice'] = rate * PACKAGES[package_name].get('lesson_qty')
+    sub_total = data['lessonsPrice'] + data.get('placementFee', 0)
+    data['subTotal'] = round((sub_total + Decimal('0.30')) / (Decimal(1 - 0.029)), 2)
+    data['processingFee'] = data['subTotal'] - sub_total
+    if data.get('discounts'):
+        total = round(data['lessonsPrice'] * (Decimal('100.0000') - data.get('discounts')) / Decimal('100.0'), 4)
+    else:
+        total = data['lessonsPrice']
+    total = total - data.get('credits', 0)
+    if package_name == 'virtuoso':
+        data['virtuosoDiscount'] = PACKAGES[package_name].get('discount')
+        total = round(total * (Decimal('100.0000') - data['virtuosoDiscount']) / 100, 4)
+    total += data.get('placementFee', 0)
+    data['total'] = round((total + Decimal('0.30')) / (Decimal(1 - 0.029)), 2)
+    data['processingFee'] = data['total'] - total
+    return data
+
+
+amounts = st.decimals(min_value=0, max_value=1000, places=4, allow_nan=False, allow_infinity=False)
+percents = st.decimals(min_value=0, max_value=100, places=4, allow_nan=False, allow_infinity=False)
+benefit_data = st.fixed_dictionaries({'free_lesson': st.booleans(), 'discount': percents, 'amount': amounts})
+
+
+class BookingQuoteTest(SimpleTestCase):
+
+    @given(rate=amounts, quantities=st.lists(st.integers(min_value=1, max_value=12), max_size=2),
+           benefits=benefit_data, package_name=st.sampled_from(list(PACKAGES.keys())))
+    def test_same_as_reference(self, rate, quantities, benefits, package_name):
+        additional_items = build_additional_items(quantities, benefits)
+        self.assertEqual(compute_booking_quote(additional_items, package_name, rate),
+                         reference_quote(additional_items, package_name, rate))
+
+    @given(rate=amounts, benefits=benefit_data)
+    def test_additional_items_not_changed(self, rate, benefits):
+        additional_items = build_additional_items([1], benefits)
+        expected = dict(additional_items)
+        for package_name in PACKAGES:
+            compute_booking_quote(additional_items, package_name, rate)
+        self.assertEqual(additional_items, expected)
+
+    def test_select_benefit(self):
+        benefits = [SimpleNamespace(benefit_type=BENEFIT_DISCOUNT, benefit_qty=Decimal('20')),
+                    SimpleNamespace(benefit_type=BENEFIT_AMOUNT, benefit_qty=Decimal('5')),
+                    SimpleNamespace(benefit_type=BENEFIT_DISCOUNT, benefit_qty=Decimal('10'))]
+        offer = SimpleNamespace(free_lesson=False, percent_discount=15)
+        self.assertEqual(select_benefit_to_redeem(benefits, offer),
+                         {'free_lesson': False, 'discount': Decimal('15'), 'amount': Decimal('5'), 'source': 'offer'})
+        self.assertEqual(select_benefit_to_redeem(benefits, None),
+                         {'free_lesson': False, 'discount': Decimal('10'), 'amount': Decimal('5'), 'source': 'benefit'})
+        benefits.append(SimpleNamespace(benefit_type=BENEFIT_LESSON, benefit_qty=Decimal('1')))
+        self.assertEqual(select_benefit_to_redeem(benefits, offer),
+                         {'free_lesson': True, 'discount': 0, 'amount': 0, 'source': 'benefit'})
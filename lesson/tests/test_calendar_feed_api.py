@@ -0,0 +1,86 @@
+"""Tests for calendar feed of lessons"""
+from django.conf import settings
+from django.utils import timezone
+
+from rest_framework import status
+
+from accounts.tests.base_test_class import BaseTest
+
+from ..models import Lesson
+
+
+class CalendarFeedTest(BaseTest):
+    """Tests for iCalendar feed of lessons, and url to access it"""
+    fixtures = ['01_core_users.json', '02_accounts_instructors.json', '03_accounts_parents.json',
+                '04_accounts_students.json', '05_lesson_instruments.json', '15_accounts_tiedstudents',
+                '16_accounts_studentdetails', '01_lesson_requests.json', '02_applications.json', '01_payments.json',
+                '04_lesson_bookings.json']
+    login_data = {
+        'email': 'luisstudent@yopmail.com',
+        'password': 'T3st11ng'
+    }
+
+    def setUp(self):
+        super().setUp()
+        self.lesson = Lesson.objects.create(booking_id=1, instructor_id=1, status=Lesson.SCHEDULED,
+                                            scheduled_datetime=timezone.now() + timezone.timedelta(days=2))
+        response = self.client.get('{}/v1/lessons/calendar-url/'.format(settings.HOSTNAME_PROTOCOL))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.url = response.json()['url']
+        self.client.credentials()
+
+    def test_feed(self):
+        """Feed includes lessons of user, with duration of lesson request"""
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/calendar'))
+        content = b''.join(response.streaming_content).decode()
+        self.assertTrue(content.startswith('BEGIN:VCALENDAR\r\n'))
+        self.assertIn(f'UID:lesson-{self.lesson.id}@nabimusic.com\r\n', content)
+        end = self.lesson.scheduled_datetime + timezone.timedelta(minutes=45)
+        self.assertIn('DTEND:{}\r\n'.format(end.astimezone(timezone.utc).strftime('%Y%m%dT%H%M%SZ')), content)
+        self.assertTrue(content.endswith('END:VCALENDAR\r\n'))
+
+    def test_not_modified(self):
+        """Conditional request is answered with 304 until a lesson changes"""
+        response = self.client.get(self.url)
+        etag = response['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.lesson.scheduled_datetime += timezone.timedelta(hours=1)
+        self.lesson.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_status(self):
+        """Missed lessons are cancelled events, pending lessons are tentative ones"""
+        missed = Lesson.objects.create(booking_id=1, instructor_id=1, status=Lesson.MISSED,
+                                       scheduled_datetime=timezone.now() - timezone.timedelta(days=1))
+        pending = Lesson.objects.create(booking_id=1, instructor_id=1, status=Lesson.PENDING,
+                                        scheduled_datetime=timezone.now() + timezone.timedelta(days=9))
+        response = self.client.get(self.url)
+        events = b''.join(response.streaming_content).decode().split('BEGIN:VEVENT\r\n')[1:]
+        statuses = {}
+        for event in events:
+            uid = event.split('UID:', 1)[1].split('\r\n', 1)[0]
+            statuses[uid] = event.split('STATUS:', 1)[1].split('\r\n', 1)[0]
+        self.assertDictEqual(statuses, {f'lesson-{missed.id}@nabimusic.com': 'CANCELLED',
+                                        f'lesson-{self.lesson.id}@nabimusic.com': 'CONFIRMED',
+                                        f'lesson-{pending.id}@nabimusic.com': 'TENTATIVE'})
+
+    def test_rotate_url(self):
+        """Requesting a new url revokes the previous one"""
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer {}'.format(self.get_token(**self.login_data)))
+        response = self.client.post('{}/v1/lessons/calendar-url/'.format(settings.HOSTNAME_PROTOCOL))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        new_url = response.json()['url']
+        self.assertNotEqual(new_url, self.url)
+        self.client.credentials()
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.get(new_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_wrong_token(self):
+        response = self.client.get('{}/v1/lessons/calendar/1:0:wrongsignature.ics'.format(settings.HOSTNAME_PROTOCOL))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
@@ -0,0 +1,123 @@
+import json
+from unittest import mock
+
+from django.conf import settings
+from django.test import TestCase
+from django.utils import timezone
+
+from rest_framework import status
+
+from accounts.models import Instructor
+from core.constants import LESSON_REQUEST_CLOSED
+from accounts.tests.base_test_class import BaseTest
+
+from ..models import Application, LessonRequest, LessonRequestFeedItem
+from ..utils import send_alert_request_instructors
+
+
+class LessonRequestFeedTest(BaseTest):
+    """Tests for get feed of lesson requests of an instructor"""
+    fixtures = ['01_core_users.json', '02_accounts_instructors.json', '03_accounts_parents.json',
+                '04_accounts_students.json', '05_lesson_instruments.json', '11_accounts_instructorinstruments.json',
+                '15_accounts_tiedstudents', '16_accounts_studentdetails', '01_lesson_requests.json']
+    login_data = {
+        'email': 'luisinstruct@yopmail.com',
+        'password': 'T3st11ng'
+    }
+
+    def setUp(self):
+        super().setUp()
+        self.url = '{}/v1/lesson-request-feed/'.format(settings.HOSTNAME_PROTOCOL)
+        for lesson_request in LessonRequest.objects.all():
+            LessonRequestFeedItem.fan_out(lesson_request)
+
+    def test_success(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, msg=response.content.decode())
+        results = response.json().get('results')
+        # request 5 is beyond its travel distance, closed requests are excluded
+        self.assertEqual([item.get('id') for item in results], [4])
+        self.assertFalse(results[0].get('seen'))
+        self.assertFalse(results[0].get('applied'))
+        self.assertEqual(results[0].get('applicationsReceived'), 0)
+
+    def test_applied_and_seen(self):
+        Application.objects.create(request_id=4, instructor_id=1, rate=30, message='Hello')
+        response = self.client.get('{}/v1/lesson-request-item/4/'.format(settings.HOSTNAME_PROTOCOL))
+        self.assertEqual(response.status_code, status.HTTP_200_OK, msg=response.content.decode())
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, msg=response.content.decode())
+        item = response.json().get('results')[0]
+        self.assertTrue(item.get('seen'))
+        self.assertTrue(item.get('applied'))
+        self.assertEqual(item.get('applicationsReceived'), 1)
+
+
+class LessonRequestFanInTest(TestCase):
+    """Tests for update of feed of an instructor, with active lesson requests"""
+    fixtures = ['01_core_users.json', '02_accounts_instructors.json', '03_accounts_parents.json',
+                '04_accounts_students.json', '05_lesson_instruments.json', '11_accounts_instructorinstruments.json',
+                '15_accounts_tiedstudents', '16_accounts_studentdetails', '01_lesson_requests.json']
+
+    def feed(self, instructor):
+        return set(LessonRequestFeedItem.objects.filter(instructor=instructor).values_list('request_id', flat=True))
+
+    def test_same_as_fan_out(self):
+        """Requests written by fan_in are the ones written by fan_out, for active requests"""
+        for lesson_request in LessonRequest.objects.exclude(status=LESSON_REQUEST_CLOSED):
+            LessonRequestFeedItem.fan_out(lesson_request)
+        expected = {instructor.id: self.feed(instructor) for instructor in Instructor.objects.all()}
+        LessonRequestFeedItem.objects.all().delete()
+        for instructor in Instructor.objects.all():
+            LessonRequestFeedItem.fan_in(instructor)
+            self.assertEqual(self.feed(instructor), expected[instructor.id])
+        self.assertEqual(expected[1], {4})
+
+    def test_instrument_removed(self):
+        instructor = Instructor.objects.get(id=1)
+        LessonRequestFeedItem.fan_in(instructor)
+        self.assertEqual(self.feed(instructor), {4})
+        instructor.instructorinstruments_set.filter(instrument_id=1).delete()
+        LessonRequestFeedItem.fan_in(instructor)
+        self.assertEqual(self.feed(instructor), set())
+
+
+class LessonRequestAlertTest(TestCase):
+    """Tests for selection of instructors alerted of a new lesson request"""
+    fixtures = ['01_core_users.json', '02_accounts_instructors.json', '03_accounts_parents.json',
+                '04_accounts_students.json', '05_lesson_instruments.json', '11_accounts_instructorinstruments.json',
+                '15_accounts_tiedstudents', '16_accounts_studentdetails', '01_lesson_requests.json']
+
+    def test_eligible_instructors(self):
+        self.assertEqual(list(LessonRequest.objects.get(id=4).get_eligible_instructors().values_list('id', flat=True)),
+                         [1])
+        self.assertFalse(LessonRequest.objects.get(id=5).get_eligible_instructors().exists())
+
+    def test_alert_preferences(self):
+        lesson_request = LessonRequest.objects.get(id=4)
+        # instructor doesn't want alerts
+        self.assertEqual(send_alert_request_instructors(lesson_request), 0)
+        # instructor was alerted recently
+        Instructor.objects.filter(id=1).update(request_posted=True, request_alert_sent_at=timezone.now())
+        self.assertEqual(send_alert_request_instructors(lesson_request), 0)
+
+    def test_batches(self):
+        """Each instructor gets a personalization; only instructors of accepted batches are marked as alerted"""
+        Instructor.objects.update(request_posted=True)
+        lesson_request = LessonRequest.objects.get(id=4)
+        instructors = Instructor.objects.order_by('id')
+        emails = list(instructors.values_list('user__email', flat=True))
+        responses = [mock.Mock(status_code=202), mock.Mock(status_code=500, content=b'error')]
+        with mock.patch.object(LessonRequest, 'get_eligible_instructors', lambda request: instructors), \
+                mock.patch('lesson.utils.SENDGRID_MAX_PERSONALIZATIONS', 2), \
+                mock.patch('lesson.utils.send_admin_email') as send_admin_email, \
+                mock.patch('lesson.utils.requests.post', side_effect=responses) as post:
+            self.assertEqual(send_alert_request_instructors(lesson_request), 2)
+        self.assertEqual(post.call_count, 2)
+        batches = [[item['to'] for item in json.loads(call[1]['data'])['personalizations']]
+                   for call in post.call_args_list]
+        self.assertEqual(batches, [[[{'email': emails[0]}], [{'email': emails[1]}]],
+                                   [[{'email': emails[2]}], [{'email': emails[3]}]]])
+        self.assertEqual(send_admin_email.call_count, 1)
+        alerted = [bool(sent_at) for sent_at in instructors.values_list('request_alert_sent_at', flat=True)]
+        self.assertEqual(alerted, [True, True, False, False])
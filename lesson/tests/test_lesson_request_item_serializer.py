@@ -0,0 +1,72 @@
+"""Tests for single pass representation of LessonRequestItemSerializer"""
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+
+from rest_framework import serializers
+
+from accounts.models import get_account
+from core.constants import ROLE_STUDENT
+
+from ..models import LessonRequest
+from ..serializers import LessonRequestItemSerializer
+from ..utils import get_date_time_from_datetime_timezone
+
+User = get_user_model()
+
+
+def reference_representation(serializer, instance):
+    """Representation obtained from DRF fields, as LessonRequestItemSerializer did previously;
+    method fields are computed with queries, as previous methods did"""
+    data = serializers.ModelSerializer.to_representation(serializer, instance)
+    if serializer.context.get('user'):
+        applied = instance.applications.filter(instructor=serializer.context['user'].instructor).exists()
+    else:
+        applied = False
+    account = get_account(instance.user)
+    new_data = {'createdAt': data.get('created_at'), 'displayName': account.display_name if account else '',
+                'distance': data.get('distance'), 'id': data.get('id'), 'instrument': data.get('instrument'),
+                'lessonDuration': data.get('lessons_duration'), 'gender': data.get('gender'),
+                'language': data.get('language'), 'requestMessage': data.get('message'),
+                'placeForLessons': data.get('place_for_lessons'), 'skillLevel': data.get('skill_level'),
+                'requestTitle': data.get('title'), 'role': data.get('role'),
+                'applicationsReceived': instance.applications.count(), 'applied': applied}
+    if data.get('role') == ROLE_STUDENT:
+        account = instance.user.student
+        new_data['studentDetails'] = [{'name': instance.user.first_name, 'age': account.age}]
+    else:
+        account = instance.user.parent
+        new_data['studentDetails'] = data.get('students')
+    new_data['avatar'] = account.avatar.url if account.avatar else ''
+    new_data['avatarVariants'] = account.get_avatar_variants()
+    new_data['location'] = account.location
+    if instance.trial_proposed_datetime:
+        if serializer.context.get('user'):
+            user_account = get_account(serializer.context['user'])
+            new_data['timezone'] = user_account.timezone or user_account.get_timezone_from_location_zipcode()
+        else:
+            new_data['timezone'] = 'US/Eastern'
+        new_data['date'], new_data['time'] = get_date_time_from_datetime_timezone(instance.trial_proposed_datetime,
+                                                                                  new_data['timezone'])
+    return new_data
+
+
+class LessonRequestItemSerializerTest(TestCase):
+    """Compare single pass representation with representation built from DRF fields"""
+    fixtures = ['01_core_users.json', '02_accounts_instructors.json', '03_accounts_parents.json',
+                '04_accounts_students.json', '05_lesson_instruments.json', '15_accounts_tiedstudents',
+                '16_accounts_studentdetails', '01_lesson_requests.json', '02_applications.json']
+
+    def compare_representations(self, context):
+        qs = LessonRequest.objects.select_related('instrument', 'user__instructor', 'user__parent', 'user__student')\
+            .prefetch_related('students', 'applications')
+        self.assertTrue(qs.exists())
+        serializer = LessonRequestItemSerializer(context=context)
+        for instance in qs.all():
+            self.assertDictEqual(serializer.to_representation(instance),
+                                 reference_representation(serializer, instance))
+
+    def test_same_representation_anonymous(self):
+        self.compare_representations({})
+
+    def test_same_representation_instructor(self):
+        self.compare_representations({'user': User.objects.get(email='luisinstruct@yopmail.com')})
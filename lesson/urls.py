@@ -8,6 +8,7 @@ urlpatterns = [
     path('lesson-request/<int:pk>/', views.LessonRequestItemView.as_view()),
     path('applications/', views.ApplicationView.as_view()),
     # path('lesson-request-list/', views.LessonRequestListView.as_view()),
+    path('lesson-request-feed/', views.LessonRequestFeedView.as_view(), name='lesson_request_feed'),
     path('lesson-request-item/<int:pk>/', views.LessonRequestItemListView.as_view(), name='lesson_request_item'),
     path('booking-data/<int:student_id>/', views.AmountsForBookingView.as_view()),
     path('get-booking-data/<str:email>/<int:student_id>/', views.DataForBookingView.as_view()),
@@ -16,6 +17,8 @@ urlpatterns = [
     path('accept-request/', views.AcceptLessonRequestView.as_view()),
     path('lessons/', views.LessonCreateView.as_view()),
     path('lessons/<int:lesson_id>/', views.LessonView.as_view()),
+    path('lessons/calendar/<str:token>.ics', views.CalendarFeedView.as_view(), name='lessons_calendar'),
+    path('lessons/calendar-url/', views.CalendarFeedUrlView.as_view()),
     path('best-instructors/', views.BestInstructorsView.as_view()),
     path('best-instructor-match/<int:request_id>/', views.BestInstructorMatchView.as_view()),
     path('instructors-match/<int:request_id>/<int:instructor_id>/', views.InstructorsMatchView.as_view()),
@@ -7,12 +7,19 @@ from twilio.rest import Client
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core import signing
+from django.db import transaction
+from django.db.models import Q
+from django.template import loader
 from django.utils import timezone
 
+from accounts.models import Instructor, get_account
 from core.constants import (BENEFIT_AMOUNT, BENEFIT_DISCOUNT, BENEFIT_LESSON, BENEFIT_READY,
-                            PACKAGE_ARTIST, PACKAGE_MAESTRO, PACKAGE_TRIAL, PACKAGE_VIRTUOSO)
-from core.utils import send_admin_email, send_email
+                            PACKAGE_ARTIST, PACKAGE_MAESTRO, PACKAGE_TRIAL, PACKAGE_VIRTUOSO,
+                            SKILL_LEVEL_ADVANCED, SKILL_LEVEL_BEGINNER, SKILL_LEVEL_INTERMEDIATE)
+from core.utils import send_admin_email
 from notices.models import Offer
+from schedule.intervals import get_duration_minutes
 
 User = get_user_model()
 PACKAGES = {
@@ -23,6 +30,12 @@ PACKAGES = {
 }
 RANGE_HOURS_CONV = {'early-morning': '8to10', 'late-morning': '10to12', 'early-afternoon': '12to3',
                     'late-afternoon': '3to6', 'evening': '6to9'}
+# fees charged by Stripe for each payment
+STRIPE_FIXED_FEE = Decimal('0.30')
+STRIPE_PERCENT_FEE = Decimal('0.029')
+CALENDAR_TOKEN_SALT = 'lesson.calendar'
+ICAL_DATETIME_FORMAT = '%Y%m%dT%H%M%SZ'
+SENDGRID_MAX_PERSONALIZATIONS = 1000   # limit of personalizations in a request to mail/send
 TIMEFRAME_TO_STRING = {'early-morning': 'early morning (8am-10am)',
                        'late-morning': 'late morning (10am-12pm)',
                        'early-afternoon': 'early afternoon (12pm-3pm)',
@@ -33,20 +46,53 @@ ABREV_DAY_TO_STRING = {'mon': 'Monday', 'tue': 'Tuesday', 'wed': 'Wednesday', 't
                        'fri': 'Friday', 'sat': 'Saturday', 'sun': 'Sunday'}
 
 
-def send_alert_request_instructor_ant(instructor, lesson_request, requestor_account):
-    # ToDo: delete this
-    """Send advice of new request via email for instructors"""
-    from_email = 'Nabi Music <' + settings.DEFAULT_FROM_EMAIL + '>'
-    template = 'request_advice_email.html'
-    plain_template = 'request_advice_email_plain.html'
-    subject = 'There is a New Lesson Request Near You'
-    location_tuple = requestor_account.get_location(result_type='tuple')
+def send_alert_request_instructors(lesson_request):
+    """Send advice of new lesson request via email to eligible instructors with request_posted notifications,
+    except those alerted in last REQUEST_ALERT_INTERVAL minutes. Instructors are selected in a single query,
+    and emails are sent in batches of personalizations; only instructors of batches accepted by SendGrid are
+    marked as alerted. Return number of alerted instructors"""
+    threshold = timezone.now() - dt.timedelta(minutes=settings.REQUEST_ALERT_INTERVAL)
+    account = get_account(lesson_request.user)
     params = {
         'request_title': lesson_request.title,
-        'location': '{}, {}'.format(location_tuple[2], location_tuple[1]),
+        'location': (account.location or account.get_location()) if account else '',
         'reference_url': '{}/request/{}'.format(settings.HOSTNAME_PROTOCOL, lesson_request.id)
     }
-    send_email(from_email, [instructor.user.email], subject, template, plain_template, params)
+    content = [{'type': 'text/plain', 'value': loader.render_to_string('request_advice_email_plain.html', params)},
+               {'type': 'text/html', 'value': loader.render_to_string('request_advice_email.html', params)}]
+    headers = {'Authorization': 'Bearer {}'.format(settings.EMAIL_HOST_PASSWORD), 'Content-Type': 'application/json'}
+    alerted = 0
+    with transaction.atomic():
+        # selected instructors stay locked until emails are sent, so alerts for another request skip them
+        recipients = list(lesson_request.get_eligible_instructors()
+                          .filter(request_posted=True)
+                          .filter(Q(request_alert_sent_at__isnull=True) | Q(request_alert_sent_at__lt=threshold))
+                          .select_for_update(skip_locked=True, of=('self', ))
+                          .values_list('id', 'user__email'))
+        for start in range(0, len(recipients), SENDGRID_MAX_PERSONALIZATIONS):
+            batch = recipients[start:start + SENDGRID_MAX_PERSONALIZATIONS]
+            # each instructor gets a personalization, so recipients don't see each other
+            data = {"from": {"email": settings.DEFAULT_FROM_EMAIL, "name": 'Nabi Music'},
+                    "subject": 'There is a New Lesson Request Near You',
+                    "content": content,
+                    "personalizations": [{"to": [{"email": email}]} for _, email in batch]}
+            try:
+                response = requests.post(settings.SENDGRID_API_BASE_URL + 'mail/send', headers=headers,
+                                         data=json.dumps(data))
+            except requests.RequestException as e:
+                send_admin_email("[INFO] Error sending emails to instructors, with new lesson request",
+                                 "The request to SendGrid failed: {}.".format(e))
+                continue
+            if response.status_code != 202:
+                send_admin_email("[INFO] Error sending emails to instructors, with new lesson request",
+                                 "The error code is {} and response content: {}.".format(response.status_code,
+                                                                                         response.content.decode())
+                                 )
+                continue
+            Instructor.objects.filter(id__in=[instructor_id for instructor_id, _ in batch])\
+                .update(request_alert_sent_at=timezone.now())
+            alerted += len(batch)
+    return alerted
 
 
 def send_info_lesson_student_parent(lesson):
@@ -447,25 +493,24 @@ def send_sms_reminder_lesson(lesson_id):
                          )
 
 
-def get_benefit_to_redeem(user):
-    """Return a dict for existing benefit that can be used in lesson booking"""
+def select_benefit_to_redeem(benefits, active_offer):
+    """Return a dict for existing benefit that can be used in lesson booking.
+    :param benefits: list of user's benefits ready to be used, ordered by id
+    :param active_offer: active Offer instance, or None"""
     data = {'free_lesson': False, 'discount': 0, 'amount': 0, 'source': ''}
-    benefits = user.benefits.filter(status=BENEFIT_READY)
-    active_offer = Offer.get_last_active_offer()
-
     if active_offer and active_offer.free_lesson:
         data['source'] = 'offer'
         data['free_lesson'] = True
-    elif benefits.count() and benefits.filter(benefit_type=BENEFIT_LESSON).exists():
+    elif any(benefit.benefit_type == BENEFIT_LESSON for benefit in benefits):
         data['source'] = 'benefit'
         data['free_lesson'] = True
     if data.get('free_lesson'):
         return data
 
-    benefit_discount = benefits.filter(benefit_type=BENEFIT_DISCOUNT)
+    benefit_discount = [benefit for benefit in benefits if benefit.benefit_type == BENEFIT_DISCOUNT]
     if active_offer and active_offer.percent_discount:
-        if benefit_discount.exists():
-            benefit = benefit_discount.last()
+        if benefit_discount:
+            benefit = benefit_discount[-1]
             if benefit.benefit_qty > active_offer.percent_discount:
                 data['source'] = 'benefit'
                 data['discount'] = benefit.benefit_qty
@@ -475,38 +520,46 @@ def get_benefit_to_redeem(user):
         else:
             data['source'] = 'offer'
             data['discount'] = Decimal(active_offer.percent_discount)
-    elif benefit_discount.exists():
-        benefit = benefit_discount.last()
+    elif benefit_discount:
+        benefit = benefit_discount[-1]
         data['source'] = 'benefit'
         data['discount'] = benefit.benefit_qty
 
-    benefit_amount = benefits.filter(benefit_type=BENEFIT_AMOUNT)
-    if benefit_amount.exists():
-        benefit = benefit_amount.last()
-        data['amount'] = benefit.benefit_qty
+    benefit_amount = [benefit for benefit in benefits if benefit.benefit_type == BENEFIT_AMOUNT]
+    if benefit_amount:
+        data['amount'] = benefit_amount[-1].benefit_qty
     return data
 
 
-def get_additional_items_booking(user):
-    """Return additional items to add in a lesson booking"""
-    booking_count = user.lesson_bookings.count()
-    if booking_count == 1:
-        if user.lesson_bookings.all()[0].quantity == 1:
-            data = {'placementFee': Decimal('12.0000')}
-        else:
-            data = {}
+def get_benefit_to_redeem(user):
+    """Return a dict for existing benefit that can be used in lesson booking"""
+    return select_benefit_to_redeem(list(user.benefits.filter(status=BENEFIT_READY).order_by('id')),
+                                    Offer.get_last_active_offer())
+
+
+def build_additional_items(booking_quantities, benefit_data):
+    """Return additional items to add in a lesson booking.
+    :param booking_quantities: list of quantities of user's bookings (two at most are required)
+    :param benefit_data: dict returned by select_benefit_to_redeem"""
+    if len(booking_quantities) == 1 and booking_quantities[0] == 1:
+        data = {'placementFee': Decimal('12.0000')}
     else:
         data = {}
-    benefits = get_benefit_to_redeem(user)
-    if benefits.get('discount'):
-        data['discounts'] = benefits.get('discount')
-    if benefits.get('amount'):
-        data['credits'] = benefits.get('amount')
-    if benefits.get('free_lesson'):
-        data['freeLesson'] = benefits.get('free_lesson')
+    if benefit_data.get('discount'):
+        data['discounts'] = benefit_data.get('discount')
+    if benefit_data.get('amount'):
+        data['credits'] = benefit_data.get('amount')
+    if benefit_data.get('free_lesson'):
+        data['freeLesson'] = benefit_data.get('free_lesson')
     return data
 
 
+def get_additional_items_booking(user):
+    """Return additional items to add in a lesson booking"""
+    return build_additional_items(list(user.lesson_bookings.values_list('quantity', flat=True)[:2]),
+                                  get_benefit_to_redeem(user))
+
+
 def get_booking_data(user, package_name, application):
     """Get data related to booking: total amount, fees, discounts, etc"""
     data = get_additional_items_booking(user)
@@ -534,21 +587,20 @@ def get_booking_data(user, package_name, application):
     return data
 
 
-def get_booking_data_v2(user, package_name, last_lesson):
-    """Get data related to booking: total amount, fees, discounts, etc"""
-    data = get_additional_items_booking(user)
-    data['lessonRate'] = last_lesson.rate
+def compute_booking_quote(additional_items, package_name, rate):
+    """Return data related to booking (total amount, fees, discounts, etc) of a package, for a lesson rate.
+    Processing fee is added so that amount received, once Stripe fee is discounted, is the amount to charge.
+    :param additional_items: dict returned by get_additional_items_booking"""
+    data = dict(additional_items)
+    data['lessonRate'] = rate
     if data.get('freeLesson'):
-        data['lessonsPrice'] = last_lesson.rate * (PACKAGES[package_name].get('lesson_qty') - 1)
+        data['lessonsPrice'] = rate * (PACKAGES[package_name].get('lesson_qty') - 1)
     else:
-        data['lessonsPrice'] = last_lesson.rate * PACKAGES[package_name].get('lesson_qty')
+        data['lessonsPrice'] = rate * PACKAGES[package_name].get('lesson_qty')
     # SubTotal is amount to pay if there is not discounts
     sub_total = data['lessonsPrice'] + data.get('placementFee', 0)   # this variable does not include processingFee
-
-    data['subTotal'] = round((sub_total + Decimal('0.30')) / (Decimal(1 - 0.029)), 2)  # to display, add processing fee
+    data['subTotal'] = round((sub_total + STRIPE_FIXED_FEE) / (1 - STRIPE_PERCENT_FEE), 2)  # to display, add fee
     data['processingFee'] = data['subTotal'] - sub_total
-    # data['processingFee'] = round(Decimal('0.029') * sub_total + Decimal('0.30'), 2)
-    # data['subTotal'] = round(sub_total + data['processingFee'], 2)   # to display, add processing fee
 
     # Now, calculate total
     if data.get('discounts'):
@@ -556,24 +608,44 @@ def get_booking_data_v2(user, package_name, last_lesson):
     else:
         total = data['lessonsPrice']
     total = total - data.get('credits', 0)
-    if package_name == 'virtuoso':
+    if package_name == PACKAGE_VIRTUOSO:
         data['virtuosoDiscount'] = PACKAGES[package_name].get('discount')
         total = round(total * (Decimal('100.0000') - data['virtuosoDiscount']) / 100, 4)
     total += data.get('placementFee', 0)
 
-    data['total'] = round((total + Decimal('0.30')) / (Decimal(1 - 0.029)), 2)
+    data['total'] = round((total + STRIPE_FIXED_FEE) / (1 - STRIPE_PERCENT_FEE), 2)
     data['processingFee'] = data['total'] - total
-    # data['processingFee'] = round(Decimal('0.029') * total + Decimal('0.30'), 2)
-    # data['total'] = round(total + data['processingFee'], 2)
     return data
 
 
+def get_booking_data_v2(user, package_name, last_lesson):
+    """Get data related to booking: total amount, fees, discounts, etc"""
+    return compute_booking_quote(get_additional_items_booking(user), package_name, last_lesson.rate)
+
+
+def get_booking_quotes(user, rate):
+    """Get data related to booking for all packages, as a dict {package_name: data};
+    user's bookings, benefits and active offer are loaded once"""
+    additional_items = get_additional_items_booking(user)
+    return {package_name: compute_booking_quote(additional_items, package_name, rate) for package_name in PACKAGES}
+
+
 def get_date_time_from_datetime_timezone(datetime_value, time_zone, date_format='%Y-%m-%d', time_format='%H:%M'):
     """Get date and time elements of a datetime, after apply it a time_zone"""
     localize_datetime = datetime_value.astimezone(timezone.pytz.timezone(time_zone))
     return localize_datetime.strftime(date_format), localize_datetime.strftime(time_format)
 
 
+def get_skill_levels_to_teach(skill_level):
+    """Return skill levels an instructor should teach, to take students with skill_level"""
+    if skill_level == SKILL_LEVEL_BEGINNER:
+        return [SKILL_LEVEL_BEGINNER, SKILL_LEVEL_INTERMEDIATE, SKILL_LEVEL_ADVANCED]
+    elif skill_level == SKILL_LEVEL_INTERMEDIATE:
+        return [SKILL_LEVEL_INTERMEDIATE, SKILL_LEVEL_ADVANCED]
+    else:
+        return [SKILL_LEVEL_ADVANCED]
+
+
 def get_next_date_same_weekday(previous_date):
     """Return next date with same weekday as previous_date"""
     next_week_day = previous_date.weekday()
@@ -632,3 +704,75 @@ def send_advice_assigned_instructor(booking):
                                                                                              response.content.decode())
                          )
         return None
+
+
+def get_calendar_token(user):
+    """Return token to access calendar feed of user's lessons"""
+    return signing.Signer(salt=CALENDAR_TOKEN_SALT).sign(f'{user.id}:{user.calendar_token_version}')
+
+
+def get_user_from_calendar_token(token):
+    """Return user owner of calendar token, or None if token is not valid or was revoked"""
+    try:
+        value = signing.Signer(salt=CALENDAR_TOKEN_SALT).unsign(token)
+        user_id, _, version = value.partition(':')
+        user_id, version = int(user_id), int(version or 0)   # tokens without version were issued as version 0
+    except (signing.BadSignature, ValueError):
+        return None
+    return User.objects.filter(id=user_id, calendar_token_version=version).first()
+
+
+def ical_text(value):
+    """Escape a text value for iCalendar format"""
+    return str(value).replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+
+def ical_line(name, value):
+    """Return a content line for iCalendar format, folded in lines up to 75 octets"""
+    lines = ['']
+    size = 0
+    for char in f'{name}:{value}':
+        char_size = len(char.encode())
+        if size + char_size > 75:
+            lines.append(' ')
+            size = 1
+        lines[-1] += char
+        size += char_size
+    return '\r\n'.join(lines) + '\r\n'
+
+
+def generate_calendar_feed(lessons, is_instructor, calendar_name):
+    """Generator of iCalendar content for lessons, one event per lesson.
+    :param lessons: iterable of lessons, with booking (its request or application) and instructor related data"""
+    from lesson.models import Lesson
+    statuses = {Lesson.PENDING: 'TENTATIVE', Lesson.MISSED: 'CANCELLED'}   # other lessons are CONFIRMED
+    yield 'BEGIN:VCALENDAR\r\n'
+    yield ical_line('VERSION', '2.0')
+    yield ical_line('PRODID', '-//Nabi Music//Lessons//EN')
+    yield ical_line('X-WR-CALNAME', ical_text(calendar_name))
+    stamp = timezone.now().strftime(ICAL_DATETIME_FORMAT)
+    for lesson in lessons:
+        request = lesson.booking.get_request()
+        instrument = request.instrument.name if request else ''
+        if is_instructor:
+            if lesson.booking.tied_student:
+                counterpart = lesson.booking.tied_student.name
+            else:
+                counterpart = lesson.booking.user.first_name
+        else:
+            counterpart = lesson.instructor.display_name if lesson.instructor else ''
+        summary = ' '.join(item for item in [instrument.capitalize(), 'lesson'] if item)
+        if counterpart:
+            summary += f' with {counterpart}'
+        end = lesson.scheduled_datetime + dt.timedelta(
+            minutes=get_duration_minutes(request.lessons_duration if request else None))
+        yield 'BEGIN:VEVENT\r\n'
+        yield ical_line('UID', f'lesson-{lesson.id}@nabimusic.com')
+        yield ical_line('DTSTAMP', stamp)
+        yield ical_line('LAST-MODIFIED', lesson.updated.astimezone(timezone.utc).strftime(ICAL_DATETIME_FORMAT))
+        yield ical_line('DTSTART', lesson.scheduled_datetime.astimezone(timezone.utc).strftime(ICAL_DATETIME_FORMAT))
+        yield ical_line('DTEND', end.astimezone(timezone.utc).strftime(ICAL_DATETIME_FORMAT))
+        yield ical_line('SUMMARY', ical_text(summary))
+        yield ical_line('STATUS', statuses.get(lesson.status, 'CONFIRMED'))
+        yield 'END:VEVENT\r\n'
+    yield 'END:VCALENDAR\r\n'
@@ -11,8 +11,9 @@ from django.contrib.gis.db.models.functions import Distance
 from django.contrib.gis.geos import Point
 from django.contrib.gis.measure import D
 from django.db import transaction
-from django.db.models import Case, F, ObjectDoesNotExist, Q, When
+from django.db.models import Case, Count, F, Max, ObjectDoesNotExist, Q, When
 from django.db.models.functions import Cast
+from django.http import Http404, StreamingHttpResponse
 from django.utils import timezone
 
 from rest_framework import status, views
@@ -23,23 +24,29 @@ from rest_framework.response import Response
 from accounts.models import Instructor, InstructorInstruments, TiedStudent, get_account
 from accounts.serializers import MinimalTiedStudentSerializer
 from accounts.utils import add_to_email_list
+from core.cache import cache_response
 from core.constants import *
-from core.models import ScheduledTask, TaskLog, UserBenefits
+from core.models import ScheduledTask, TaskLog
 from core.permissions import AccessForInstructor, AccessForParentOrStudent
-from core.utils import build_error_dict, send_admin_email
+from core.utils import build_error_dict, conditional_get
 from lesson.models import Instrument
-from lesson.utils import get_availability_field_names_from_availability_json
+from lesson.utils import get_availability_field_names_from_availability_json, get_skill_levels_to_teach
 from payments.models import Payment
-from payments.serializers import GetPaymentMethodSerializer
+from payments.tasks import capture_payment
+from payments.utils import get_or_create_customer, get_payment_methods_data
+from schedule.utils import get_overbooking_penalties
 
 from . import serializers as sers
-from .models import Application, InstructorAcceptanceLessonRequest, LessonBooking, LessonRequest, Lesson
-from .tasks import (send_alert_admin_request_closed, send_booking_invoice, send_email_assigned_instructor,
+from .models import (Application, InstructorAcceptanceLessonRequest, LessonBooking, LessonRequest,
+                     LessonRequestFeedItem, Lesson)
+from .tasks import (send_alert_admin_request_closed, send_email_assigned_instructor,
                     send_info_grade_lesson, send_lesson_reschedule, send_trial_confirm,
                     send_instructor_complete_lesson, send_admin_completed_instructor)
-from .utils import get_booking_data_v2, PACKAGES
+from .utils import (generate_calendar_feed, get_booking_data_v2, get_booking_quotes, get_calendar_token,
+                    get_user_from_calendar_token, PACKAGES)
 
 User = get_user_model()
+CALENDAR_PAST_DAYS = 90
 stripe.api_key = settings.STRIPE_SECRET_KEY
 
 
@@ -130,7 +137,9 @@ class LessonRequestListView(views.APIView):
             account = None
         else:
             account = get_account(request.user)
-        qs = LessonRequest.objects.exclude(status=LESSON_REQUEST_CLOSED).annotate(coords=Case(
+        qs = LessonRequest.objects.exclude(status=LESSON_REQUEST_CLOSED)\
+            .select_related('instrument', 'user__instructor', 'user__parent', 'user__student')\
+            .prefetch_related('students', 'applications').annotate(coords=Case(
             When(user__parent__isnull=False, then=F('user__parent__coordinates')),
             When(user__student__isnull=False, then=F('user__student__coordinates')),
             default=None,
@@ -194,6 +203,7 @@ class LessonRequestItemListView(views.APIView):
     """Return data of a lesson request created by a parent or student"""
     permission_classes = (AllowAny, )
 
+    @cache_response(['lesson_requests'], anonymous_only=True)
     def get(self, request, pk):
         try:
             lesson_request = LessonRequest.objects.get(id=pk)
@@ -201,12 +211,32 @@ class LessonRequestItemListView(views.APIView):
             return Response({'detail': 'There is not lesson request with provider id'},
                             status=status.HTTP_400_BAD_REQUEST)
         if not isinstance(request.user, AnonymousUser):
+            LessonRequestFeedItem.objects.filter(instructor__user=request.user, request=lesson_request, seen=False)\
+                .update(seen=True)
             serializer = sers.LessonRequestListItemSerializer(lesson_request, context={'user': request.user})
         else:
             serializer = sers.LessonRequestListItemSerializer(lesson_request)
         return Response(serializer.data)
 
 
+class LessonRequestFeedView(views.APIView):
+    """Return lesson requests offered to an instructor, best ranked first"""
+    permission_classes = (IsAuthenticated, AccessForInstructor)
+
+    def get(self, request):
+        qs = LessonRequest.objects.filter(feed_items__instructor=request.user.instructor)\
+            .exclude(status=LESSON_REQUEST_CLOSED)\
+            .annotate(feed_distance=F('feed_items__distance'), feed_seen=F('feed_items__seen'),
+                      feed_rank=F('feed_items__rank'))\
+            .select_related('instrument', 'user__parent', 'user__student')\
+            .prefetch_related('students', 'applications')\
+            .order_by('-feed_rank', '-id')
+        paginator = PageNumberPagination()
+        result_page = paginator.paginate_queryset(qs, request)
+        ser = sers.LessonRequestFeedSerializer(result_page, many=True, context={'user': request.user})
+        return paginator.get_paginated_response(ser.data)
+
+
 class ApplicationView(views.APIView):
     """Create or retrieve applications for lesson request"""
     permission_classes = (IsAuthenticated, AccessForInstructor)
@@ -231,7 +261,8 @@ class ApplicationView(views.APIView):
             return Response(result, status=status.HTTP_400_BAD_REQUEST)
 
     def get(self, request):
-        ser = sers.ApplicationListSerializer(Application.objects.filter(instructor=request.user.instructor), many=True)
+        ser = sers.ApplicationListSerializer(Application.objects.filter(instructor=request.user.instructor)
+                                            .select_related('request__user'), many=True)
         return Response(ser.data)
 
 
@@ -239,6 +270,11 @@ class LessonBookingRegisterView(views.APIView):
     """Register a booking for a lesson (or group of lessons) with an instructor"""
     permission_classes = (AllowAny, )
 
+    @staticmethod
+    def get_response_data(booking, payment):
+        return {'message': 'Lesson(s) booking registered, payment is being processed.', 'booking_id': booking.id,
+                'paymentStatus': payment.status, 'paymentKey': str(payment.handle)}
+
     def post(self, request):
         if isinstance(request.user, AnonymousUser):
             try:
@@ -272,50 +308,55 @@ class LessonBookingRegisterView(views.APIView):
             # create/get booking instance
             lesson_qty = PACKAGES[package_name].get('lesson_qty')
             amount = booking_values_data['total']
-            booking = LessonBooking.objects.filter(user_id=serializer.validated_data['userId'],
-                                                   tied_student=tied_student,
-                                                   status=LessonBooking.REQUESTED).first()
-            if booking:
-                booking.quantity = lesson_qty
-                booking.save()
-            else:
-                booking = LessonBooking.objects.create(user_id=serializer.validated_data['userId'],
-                                                       tied_student=tied_student,
-                                                       quantity=lesson_qty,
-                                                       total_amount=amount,
-                                                       instructor=last_lesson.instructor,
-                                                       rate=last_lesson.rate,
-                                                       status=LessonBooking.REQUESTED)
-            # make payment
-            pym_status, pym_obj = Payment.make_and_register(user, booking.total_amount,
-                                                            f'Lesson booking with package {package_name.capitalize()}',
-                                                            serializer.validated_data['paymentMethodCode'])
-            if pym_status == 'error':
-                return Response({'detail': pym_obj}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-            # set status and info for booking and payment instances
+            payment_method = serializer.validated_data['paymentMethodCode']
+            request_key = request.META.get('HTTP_IDEMPOTENCY_KEY')
+            if request_key:
+                # a retried request obtains booking and payment registered by first request
+                payment = Payment.objects.filter(user=user, idempotency_key=f'booking-{user.id}-{request_key}')\
+                    .first()
+                booking = payment and LessonBooking.objects.filter(payment=payment).first()
+                if booking:
+                    return Response(self.get_response_data(booking, payment))
             with transaction.atomic():
+                booking = LessonBooking.objects.select_for_update()\
+                    .filter(user_id=serializer.validated_data['userId'], tied_student=tied_student,
+                            status=LessonBooking.REQUESTED).first()
+                if booking and booking.payment and booking.payment.status in (PY_PENDING, PY_REGISTERED, PY_APPLIED):
+                    # booking is being charged (or it's charged), a new payment is not registered for it
+                    return Response(self.get_response_data(booking, booking.payment), status=status.HTTP_409_CONFLICT)
+                if booking:
+                    booking.quantity = lesson_qty
+                else:
+                    booking = LessonBooking.objects.create(user_id=serializer.validated_data['userId'],
+                                                           tied_student=tied_student,
+                                                           quantity=lesson_qty,
+                                                           total_amount=amount,
+                                                           instructor=last_lesson.instructor,
+                                                           rate=last_lesson.rate,
+                                                           status=LessonBooking.REQUESTED)
+                # register payment as pending; it's charged by a worker, and booking is set as paid after that
+                if request_key:
+                    idempotency_key = f'booking-{user.id}-{request_key}'
+                else:
+                    # key depends on booking only, so a retry with another payment method or package can't charge
+                    # twice; a failed payment is not retried with same key (Stripe would return the same error)
+                    base_key = f'lesson-booking-{booking.id}'
+                    attempts = Payment.objects.filter(idempotency_key__startswith=f'{base_key}-',
+                                                      status__in=[PY_FAILED, PY_CANCELLED]).count()
+                    idempotency_key = f'{base_key}-{attempts}'
+                payment = Payment.register_pending(user, booking.total_amount,
+                                                   f'Lesson booking with package {package_name.capitalize()}',
+                                                   payment_method, idempotency_key)
                 for k, v in booking_values_data.items():
                     booking_values_data[k] = str(v)
                 booking.details = booking_values_data
-                booking.payment = pym_obj
+                booking.payment = payment
                 booking.description = 'Package {}'.format(package_name.capitalize())
-                booking.status = LessonBooking.PAID
                 booking.save()
-                if booking.request:
-                    booking.request.status = LESSON_REQUEST_CLOSED
-                    booking.request.save()
-                if pym_obj:
-                    pym_obj.status = PY_APPLIED
-                    pym_obj.save()
-                if booking.lessons.count() == 0:
-                    booking.create_lessons(last_lesson)
-                add_to_email_list(user, [], ['goal_trial_to_purchase'])
-                # update data for applicable benefits
-                UserBenefits.update_applicable_benefits(user)
-
-            task_log = TaskLog.objects.create(task_name='send_booking_invoice', args={'booking_id': booking.id})
-            send_booking_invoice.delay(booking.id, task_log.id)
-            return Response({'message': 'Lesson(s) booked successfully.', 'booking_id': booking.id})
+                if payment.status == PY_PENDING:
+                    task_log = TaskLog.objects.create(task_name='capture_payment', args={'payment_id': payment.id})
+                    transaction.on_commit(lambda: capture_payment.delay(payment.id, task_log.id))
+            return Response(self.get_response_data(booking, payment))
         else:
             result = build_error_dict(serializer.errors)
             return Response(result, status=status.HTTP_400_BAD_REQUEST)
@@ -341,49 +382,19 @@ class AmountsForBookingView(views.APIView):
                             status=status.HTTP_500_INTERNAL_SERVER_ERROR)
         if package not in [PACKAGE_ARTIST, PACKAGE_MAESTRO, PACKAGE_TRIAL, PACKAGE_VIRTUOSO]:
             return Response({'detail': 'Wrong package value'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-        data = get_booking_data_v2(request.user, package, last_lesson)
+        # quotes of all packages are included, so package can be switched without more requests
+        quotes = get_booking_quotes(request.user, last_lesson.rate)
+        data = dict(quotes[package], packages=quotes)
         account = get_account(request.user)
-        if not account.stripe_customer_id:
-            # try to get from Stripe
-            try:
-                resp_stripe = stripe.Customer.list()
-            except Exception:
-                resp_stripe = {'data': []}
-            cus_id = ''
-            for cus in resp_stripe['data']:
-                if cus.get('email', '') == account.user.email:
-                    cus_id = cus.get('id', '')
-                    break
-            if cus_id:
-                account.stripe_customer_id = cus_id
-                account.save()
-        if account.stripe_customer_id:
-            try:
-                stripe_resp = stripe.PaymentMethod.list(customer=account.stripe_customer_id, type='card')
-            except Exception as e:
-                stripe_resp = {'data': []}
-                send_admin_email('Could not get payment methods',
-                                 f"Request to Stripe for payment methods of customer {account.stripe_customer_id} ({request.user.email})"
-                                 f" generates an error: {str(e)}")
-            pm_ser = GetPaymentMethodSerializer(data=stripe_resp['data'], many=True)
-            if pm_ser.is_valid():
-                data['paymentMethods'] = pm_ser.data
-            else:
-                send_admin_email('Error parsing method payment data',
-                                 f"The following errors were obtained: {pm_ser.errors}"
-                                 f" when following data {stripe_resp['data']} was used in GetPaymentMethodSerializer")
-                data['paymentMethods'] = []
-        else:
-            try:
-                stripe_customer = stripe.Customer.create(email=request.user.email, name=account.display_name)
-            except Exception as e:
-                return Response({'detail': f'Error creating Customer in Stripe:\n {str(e)}'},
-                                status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-            account.stripe_customer_id = stripe_customer.get('id')
-            account.save()
-            data['paymentMethods'] = []
+        # customer and payment methods are taken from local mirror, so only the intent is requested to Stripe
+        try:
+            customer = get_or_create_customer(request.user, account)
+        except Exception as e:
+            return Response({'detail': f'Error creating Customer in Stripe:\n {str(e)}'},
+                            status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        data['paymentMethods'] = get_payment_methods_data(customer)
         try:
-            intent = stripe.SetupIntent.create(customer=account.stripe_customer_id)
+            intent = stripe.SetupIntent.create(customer=customer.customer_id)
         except Exception as e:
             return Response({'detail': f'Error creating Intent in Stripe:\n {str(e)}'},
                             status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -465,15 +476,14 @@ class DataForBookingView(views.APIView):
         data = get_booking_data_v2(user, package, last_lesson)
         account = get_account(user)
         try:
-            stripe_customer = stripe.Customer.create(email=user.email, name=account.display_name)
+            customer = get_or_create_customer(user, account)
         except Exception as e:
             return Response({'detail': f'Error creating Customer in Stripe:\n {str(e)}'},
                             status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-        account.stripe_customer_id = stripe_customer.get('id')
-        account.save()
+        # view doesn't require authentication, so stored payment methods are not exposed
         data['paymentMethods'] = []
         try:
-            intent = stripe.SetupIntent.create(customer=account.stripe_customer_id)
+            intent = stripe.SetupIntent.create(customer=customer.customer_id)
         except Exception as e:
             return Response({'detail': f'Error creating Intent in Stripe:\n {str(e)}'},
                             status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -681,12 +691,7 @@ class AcceptLessonRequestView(views.APIView):
 
 
 def get_matching_instructors(request, params):
-    if request.skill_level == SKILL_LEVEL_BEGINNER:
-        req_levels = [SKILL_LEVEL_BEGINNER, SKILL_LEVEL_INTERMEDIATE, SKILL_LEVEL_ADVANCED]
-    elif request.skill_level == SKILL_LEVEL_INTERMEDIATE:
-        req_levels = [SKILL_LEVEL_INTERMEDIATE, SKILL_LEVEL_ADVANCED]
-    else:
-        req_levels = [SKILL_LEVEL_ADVANCED]
+    req_levels = get_skill_levels_to_teach(request.skill_level)
     instructors_instrument = InstructorInstruments.objects.filter(instrument_id=request.instrument_id,
                                                                   skill_level__in=req_levels) \
         .values_list('instructor_id', flat=True)
@@ -697,6 +702,7 @@ def get_matching_instructors(request, params):
                                             )
     instructor_list = []
     max_rating = 0.0
+    penalties = get_overbooking_penalties([instructor.id for instructor in instructors])
     for instructor in instructors:
         if hasattr(instructor, 'availability'):
             field_names = get_availability_field_names_from_availability_json(request.trial_availability_schedule)
@@ -716,7 +722,8 @@ def get_matching_instructors(request, params):
             login_points = ((100 - elapsed.days) / 100) * 10
             if login_points < -7:
                 login_points = -7
-            instructor_list.append({'id': instructor.id, 'rating': rating, 'points': gender_points + login_points})
+            instructor_list.append({'id': instructor.id, 'rating': rating,
+                                    'points': gender_points + login_points - penalties.get(instructor.id, 0)})
     if max_rating == 0.0:
         max_rating = 1.0
     return sorted(instructor_list, key=lambda data: data.get('points') + ((data.get('rating') / max_rating) * 10),
@@ -752,6 +759,7 @@ def get_best_instructors(instrument_name=None):
 class BestInstructorsView(views.APIView):
     permission_classes = (AllowAny, )
 
+    @cache_response(['instructors'])
     def get(self, request):
         if request.query_params.get('instrument'):
             instructors = get_best_instructors(instrument_name=request.query_params.get('instrument'))
@@ -851,3 +859,59 @@ class AssignInstructorView(views.APIView):
         else:
             result = build_error_dict(ser.errors)
             return Response(result, status=status.HTTP_400_BAD_REQUEST)
+
+
+def get_calendar_lessons(user):
+    """Return lessons to include in calendar feed of user; for an instructor, lessons taught by them,
+    otherwise lessons booked by user"""
+    lessons = Lesson.objects.filter(scheduled_datetime__isnull=False,
+                                    scheduled_datetime__gte=timezone.now() - timezone.timedelta(days=CALENDAR_PAST_DAYS))
+    if user.is_instructor():
+        return lessons.filter(instructor=user.instructor)
+    else:
+        return lessons.filter(booking__user=user)
+
+
+def calendar_feed_watermark(request, token):
+    """Return watermark of lessons in calendar feed"""
+    user = get_user_from_calendar_token(token)
+    if not user:
+        return None
+    result = get_calendar_lessons(user).aggregate(last=Max('updated'), qty=Count('id'),
+                                                  last_booking=Max('booking__updated_at'))
+    last = result['last'] and max(result['last'], result['last_booking'])
+    return last, [last and last.isoformat(), result['qty']]
+
+
+class CalendarFeedView(views.APIView):
+    """Read-only iCalendar feed of user's lessons, authenticated by token in url"""
+    authentication_classes = ()
+    permission_classes = (AllowAny, )
+
+    @conditional_get(calendar_feed_watermark, user_dependent=False)
+    def get(self, request, token):
+        user = get_user_from_calendar_token(token)
+        if not user:
+            raise Http404
+        is_instructor = user.is_instructor()
+        lessons = get_calendar_lessons(user)\
+            .select_related('instructor', 'booking__user', 'booking__tied_student', 'booking__request__instrument',
+                            'booking__application__request__instrument')\
+            .order_by('scheduled_datetime')
+        response = StreamingHttpResponse(generate_calendar_feed(lessons.iterator(), is_instructor, 'Nabi Music lessons'),
+                                         content_type='text/calendar; charset=utf-8')
+        response['Content-Disposition'] = 'inline; filename="lessons.ics"'
+        return response
+
+
+class CalendarFeedUrlView(views.APIView):
+    """Return url of calendar feed of logged user; POST revokes previous url and returns a new one"""
+
+    def get(self, request):
+        url = '{}/v1/lessons/calendar/{}.ics'.format(settings.HOSTNAME_PROTOCOL, get_calendar_token(request.user))
+        return Response({'url': url})
+
+    def post(self, request):
+        User.objects.filter(id=request.user.id).update(calendar_token_version=F('calendar_token_version') + 1)
+        request.user.refresh_from_db(fields=['calendar_token_version'])
+        return self.get(request)
@@ -70,9 +70,27 @@ STATIC_URL = f'https://{AWS_S3_CUSTOM_DOMAIN}/{STATIC_LOCATION}/'
 STATICFILES_STORAGE = 'storages.backends.s3boto3.S3Boto3Storage'
 
 MEDIA_LOCATION = 'media'
-MEDIA_URL = f'https://{AWS_S3_CUSTOM_DOMAIN}/{MEDIA_LOCATION}/'
+# domain of a CDN serving media files, bucket domain by default
+MEDIA_CUSTOM_DOMAIN = os.environ.get('MEDIA_CUSTOM_DOMAIN', AWS_S3_CUSTOM_DOMAIN)
+MEDIA_URL = f'https://{MEDIA_CUSTOM_DOMAIN}/{MEDIA_LOCATION}/'
+# when bucket is private, signed urls are used (cached by object name until a while before they expire)
+MEDIA_SIGNED_URLS = os.environ.get('MEDIA_SIGNED_URLS', 'False') == 'True'
+MEDIA_SIGNED_URL_EXPIRE = int(os.environ.get('MEDIA_SIGNED_URL_EXPIRE', 7 * 24 * 3600))
 DEFAULT_FILE_STORAGE = 'core.storage_backends.MediaStorage'
 
+# cached responses (and data cached by models) are invalidated by tags from any process, so cache is shared
+CACHES = {
+    'default': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': os.environ['CACHE_LOCATION'],
+        'TIMEOUT': int(os.environ.get('CACHE_TIMEOUT', 300)),
+        'KEY_PREFIX': 'nabi',
+    }
+}
+
+# webhooks keep local copy of Stripe customers and payment methods updated, so they must be verified here
+STRIPE_WEBHOOK_SECRET = os.environ['STRIPE_WEBHOOK_SECRET']
+
 
 def omit_invalid_hostname(event, hint):
     """Don't log django.DisallowedHost errors in Sentry"""
@@ -104,6 +122,10 @@ CELERY_BEAT_SCHEDULE = {
         'task': 'lesson.tasks.execute_scheduled_task',
         'schedule': crontab(minute='*/5'),
     },
+    'reconcile-pending-payments': {
+        'task': 'payments.tasks.reconcile_pending_payments',
+        'schedule': crontab(minute='*/30'),
+    },
 }
 
 
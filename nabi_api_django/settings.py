@@ -36,7 +36,7 @@ INSTALLED_APPS = [
     'notices',
     'references.apps.ReferencesConfig',
     'background_checks.apps.BackgroundChecksConfig',
-    'schedule',
+    'schedule.apps.ScheduleConfig',
 
     'drf_yasg',
     'corsheaders',
@@ -49,6 +49,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'accounts.middleware.AccountLoaderMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -152,6 +153,44 @@ REST_FRAMEWORK = {
 # # # Celery configuration # # #
 CELERY_BROKER_URL = os.environ['BROKER_URL']
 BROKER_POOL_LIMIT = 1
+# when True, complete field of instructors is updated by a celery task, after transaction commit
+INSTRUCTOR_COMPLETE_ASYNC = os.environ.get('INSTRUCTOR_COMPLETE_ASYNC', 'False') == 'True'
+
+
+# # # Cache configuration # # #
+CACHE_BACKENDS = {
+    'locmem': ('django.core.cache.backends.locmem.LocMemCache', 'nabi-api'),
+    'file': ('django.core.cache.backends.filebased.FileBasedCache', '/var/tmp/nabi_api_cache'),
+    'redis': ('django_redis.cache.RedisCache', 'redis://localhost:6379/1'),
+}
+# cached responses are invalidated by tags, so deployed environments (several processes) must use a shared cache
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'locmem')
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKENDS[CACHE_BACKEND][0],
+        'LOCATION': os.environ.get('CACHE_LOCATION', CACHE_BACKENDS[CACHE_BACKEND][1]),
+        'TIMEOUT': int(os.environ.get('CACHE_TIMEOUT', 300)),
+        'KEY_PREFIX': 'nabi',
+    }
+}
+# timeout (in seconds) for cached responses of views
+CACHE_VIEW_TIMEOUT = int(os.environ.get('CACHE_VIEW_TIMEOUT', 900))
+CACHE_VIEW_SHORT_TIMEOUT = int(os.environ.get('CACHE_VIEW_SHORT_TIMEOUT', 60))
+
+
+# # # Schedule configuration # # #
+# when True, schedules of instructors are read from stored ranges instead of JSON data (both are written)
+AVAILABILITY_READ_RANGES = os.environ.get('AVAILABILITY_READ_RANGES', 'False') == 'True'
+
+
+# # # Notifications configuration # # #
+# minimum time (in minutes) between alerts of new lesson requests sent to an instructor
+REQUEST_ALERT_INTERVAL = int(os.environ.get('REQUEST_ALERT_INTERVAL', 60))
+
+
+# # # Payments configuration # # #
+# time (in minutes) after which a payment still pending is settled with its intent in Stripe
+PAYMENT_PENDING_TIMEOUT = int(os.environ.get('PAYMENT_PENDING_TIMEOUT', 60))
 
 
 # # # Third-party services # # #
@@ -164,6 +203,7 @@ TWILIO_FROM_NUMBER = os.environ['TWILIO_FROM_NUMBER']
 
 STRIPE_PUBLIC_KEY = os.environ['STRIPE_PUBLIC_KEY']
 STRIPE_SECRET_KEY = os.environ['STRIPE_SECRET_KEY']
+STRIPE_WEBHOOK_SECRET = os.environ.get('STRIPE_WEBHOOK_SECRET', '')
 
 ACCURATE_CLIENT_ID = os.environ['ACCURATE_CLIENT_ID']
 ACCURATE_CLIENT_SECRET = os.environ['ACCURATE_CLIENT_SECRET']
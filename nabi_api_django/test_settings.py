@@ -0,0 +1,10 @@
+from .settings import *
+
+# tests use in-process cache always, cleared by each test
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKENDS['locmem'][0],
+        'LOCATION': CACHE_BACKENDS['locmem'][1],
+        'KEY_PREFIX': 'nabi',
+    }
+}
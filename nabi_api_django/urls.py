@@ -26,6 +26,7 @@ urlpatterns = [
     path('v1/', include('notices.urls')),
     path('v1/', include('lesson.urls')),
     path('v1/', include('schedule.urls')),
+    path('v1/', include('payments.urls')),
     path('admin/', admin.site.urls),
     path('api-auth/', include('rest_framework.urls')),
     path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui')
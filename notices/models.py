@@ -1,6 +1,13 @@
 from django.db import models
+from django.db.models import Count, Max, Min, Q
 from django.utils import timezone
 
+from core.cache import get_tag_versions
+
+# max time (in seconds) to keep in memory the active offer
+ACTIVE_OFFER_MAX_AGE = 3600
+_active_offer = {}
+
 
 class Offer(models.Model):
     name = models.CharField(max_length=100)
@@ -12,7 +19,24 @@ class Offer(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    @classmethod
+    def get_watermark(cls):
+        """Return (last modification, quantity) of offers, changed when an offer is saved or deleted"""
+        result = cls.objects.aggregate(last=Max('updated_at'), qty=Count('id'))
+        return result['last'], result['qty']
+
     @classmethod
     def get_last_active_offer(cls):
+        """Return offer to display now. Result is kept in memory until next show_at/hide_at boundary, or until
+        an offer is saved or deleted ('offers' cache tag, shared among processes by the cache backend)"""
         today = timezone.now()
-        return cls.objects.filter(show_at__lte=today).exclude(hide_at__lte=today).last()
+        version = get_tag_versions(['offers'])[0]
+        if _active_offer and _active_offer['version'] == version and today < _active_offer['expires_at']:
+            return _active_offer['offer']
+        offer = cls.objects.filter(show_at__lte=today).exclude(hide_at__lte=today).last()
+        boundaries = cls.objects.aggregate(next_show=Min('show_at', filter=Q(show_at__gt=today)),
+                                           next_hide=Min('hide_at', filter=Q(hide_at__gt=today)))
+        expires_at = min([today + timezone.timedelta(seconds=ACTIVE_OFFER_MAX_AGE)]
+                         + [value for value in boundaries.values() if value is not None])
+        _active_offer.update(offer=offer, version=version, expires_at=expires_at)
+        return offer
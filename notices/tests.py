@@ -1,3 +1,62 @@
-from django.test import TestCase
+from django.core.cache import cache
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
 
-# Create your tests here.
+from core.cache import invalidate_cache_tags
+
+from . import models
+from .models import Offer
+
+
+class ActiveOfferTest(TestCase):
+    """Tests for in memory cache of active offer"""
+
+    def setUp(self):
+        cache.clear()
+        models._active_offer.clear()
+        self.now = timezone.now()
+
+    def test_cached_offer(self):
+        offer = Offer.objects.create(name='Offer', content='Content', show_at=self.now - timezone.timedelta(days=1))
+        self.assertEqual(Offer.get_last_active_offer(), offer)
+        with self.assertNumQueries(0):
+            self.assertEqual(Offer.get_last_active_offer(), offer)
+
+    def test_invalidated_by_other_process(self):
+        """Changes made in another process (without signals in this one) are noticed by shared tag version"""
+        offer = Offer.objects.create(name='Offer', content='Content', show_at=self.now - timezone.timedelta(days=1))
+        self.assertEqual(Offer.get_last_active_offer(), offer)
+        Offer.objects.filter(id=offer.id).update(hide_at=self.now)
+        invalidate_cache_tags('offers')
+        self.assertIsNone(Offer.get_last_active_offer())
+
+    def test_expires_at_boundary(self):
+        show_at = self.now + timezone.timedelta(minutes=10)
+        Offer.objects.create(name='Offer', content='Content', show_at=show_at)
+        self.assertIsNone(Offer.get_last_active_offer())
+        self.assertEqual(models._active_offer['expires_at'], show_at)
+
+
+class ActiveOfferInvalidationTest(TransactionTestCase):
+    """Tests for invalidation of active offer kept in memory, when offers are saved (after commit)"""
+
+    def setUp(self):
+        cache.clear()
+        models._active_offer.clear()
+        self.now = timezone.now()
+
+    def test_invalidated_on_save(self):
+        Offer.objects.create(name='Offer', content='Content', show_at=self.now - timezone.timedelta(days=2))
+        Offer.get_last_active_offer()
+        offer = Offer.objects.create(name='Offer 2', content='Content', show_at=self.now - timezone.timedelta(days=1))
+        self.assertEqual(Offer.get_last_active_offer(), offer)
+
+    def test_not_invalidated_before_commit(self):
+        offer = Offer.objects.create(name='Offer', content='Content', show_at=self.now - timezone.timedelta(days=2))
+        Offer.get_last_active_offer()
+        with transaction.atomic():
+            Offer.objects.create(name='Offer 2', content='Content', show_at=self.now - timezone.timedelta(days=1))
+            # a request served meanwhile (in another connection) would cache data read before commit
+            self.assertEqual(Offer.get_last_active_offer(), offer)
+        self.assertNotEqual(Offer.get_last_active_offer(), offer)
@@ -1,15 +1,37 @@
+from django.conf import settings
+
 from rest_framework import status, views
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 
+from core.cache import cache_response
+from core.utils import conditional_get
+
 from .models import Offer
 from .serializers import OfferDetailSerializer
 
 
+def active_offer_watermark(request):
+    """Return watermark (last modification, values for ETag) of offer to be displayed today.
+    Active offer changes as time goes by, then only ETag is used."""
+    offer = Offer.get_last_active_offer()
+    if offer is None:
+        return None, ['']
+    return None, [offer.id, offer.updated_at.isoformat()]
+
+
+def offers_watermark(request):
+    """Return watermark (last modification, values for ETag) of all offers"""
+    last, qty = Offer.get_watermark()
+    return last, [last and last.isoformat(), qty]
+
+
 class AvailableOfferListView(views.APIView):
     """Get a list of available offers (which should be displayed today)"""
     permission_classes = (AllowAny, )
 
+    @conditional_get(active_offer_watermark, user_dependent=False)
+    @cache_response(['offers'], timeout=settings.CACHE_VIEW_SHORT_TIMEOUT)
     def get(self, request):
         serializer = OfferDetailSerializer(Offer.get_last_active_offer())
         return Response(serializer.data, status=status.HTTP_200_OK)
@@ -19,6 +41,8 @@ class OfferListView(views.APIView):
     """Get a list of all offers"""
     permission_classes = (AllowAny,)
 
+    @conditional_get(offers_watermark, user_dependent=False)
+    @cache_response(['offers'])
     def get(self, request):
         serializer = OfferDetailSerializer(Offer.objects.order_by('show_at'), many=True)
         return Response(serializer.data, status=status.HTTP_200_OK)
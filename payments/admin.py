@@ -2,14 +2,15 @@ from django.contrib import admin
 from django.db.models import Q
 
 from core.models import User
-from payments.models import Payment
+from payments.models import Payment, StripeCustomer, StripePaymentMethod
 
 
 class PaymentAdmin(admin.ModelAdmin):
-    fields = ('user', 'amount', 'description', 'stripe_payment_method', 'operation_id', 'payment_date', 'status')
+    fields = ('user', 'amount', 'description', 'stripe_payment_method', 'operation_id', 'payment_date', 'status',
+              'idempotency_key', 'error_message')
     list_display = ('pk', 'get_user_email', 'amount', 'status', 'payment_date')
     list_filter = ('status',)
-    readonly_fields = ('payment_date',)
+    readonly_fields = ('payment_date', 'idempotency_key')
 
     def get_user_email(self, instance):
         return instance.user.email
@@ -24,4 +25,21 @@ class PaymentAdmin(admin.ModelAdmin):
         return super().formfield_for_foreignkey(db_field, request, **kwargs)
 
 
+class StripePaymentMethodInline(admin.TabularInline):
+    model = StripePaymentMethod
+    fields = ('method_id', 'brand', 'last4', 'exp_month', 'exp_year', 'updated_at')
+    readonly_fields = ('updated_at',)
+    extra = 0
+
+
+class StripeCustomerAdmin(admin.ModelAdmin):
+    fields = ('user', 'email', 'customer_id', 'created_at', 'updated_at')
+    list_display = ('pk', 'email', 'customer_id', 'updated_at')
+    search_fields = ('email', 'customer_id')
+    raw_id_fields = ('user',)
+    readonly_fields = ('created_at', 'updated_at')
+    inlines = (StripePaymentMethodInline,)
+
+
 admin.site.register(Payment, PaymentAdmin)
+admin.site.register(StripeCustomer, StripeCustomerAdmin)
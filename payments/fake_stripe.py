@@ -0,0 +1,139 @@
+"""In-memory stand-in of Stripe API, for tests. Used as context manager (or with start/stop), it replaces
+resources of stripe package used in project, keeping customers and payment methods in memory;
+requests made are registered in calls attribute, as tuples (resource, operation)."""
+import itertools
+from unittest import mock
+
+import stripe
+from stripe.stripe_object import StripeObject
+
+
+class FakeStripe:
+
+    def __init__(self):
+        self.customers = {}
+        self.payment_methods = {}
+        self.declined_methods = set()
+        self.payment_intents = {}
+        self.lose_responses = False   # when True, intents are created but requests fail (as a lost connection)
+        self.idempotent_results = {}
+        self.calls = []
+        self._ids = itertools.count(1)
+        self._patchers = []
+
+    def new_id(self, prefix):
+        return f'{prefix}_fake{next(self._ids)}'
+
+    @staticmethod
+    def to_object(values):
+        return StripeObject.construct_from(values, 'sk_test_fake')
+
+    def register(self, resource, operation):
+        self.calls.append((resource, operation))
+
+    def add_payment_method(self, customer_id, brand='visa', last4='4242', exp_month=12, exp_year=2030,
+                           declined=False):
+        """Register a card payment method attached to customer (charges to it are declined if declined is True);
+        return its data"""
+        method_id = self.new_id('pm')
+        if declined:
+            self.declined_methods.add(method_id)
+        self.payment_methods[method_id] = {'id': method_id, 'object': 'payment_method', 'customer': customer_id,
+                                           'type': 'card', 'card': {'brand': brand, 'last4': last4,
+                                                                    'exp_month': exp_month, 'exp_year': exp_year}}
+        return self.payment_methods[method_id]
+
+    def customer_create(self, email=None, name=None, **kwargs):
+        self.register('Customer', 'create')
+        customer_id = self.new_id('cus')
+        self.customers[customer_id] = {'id': customer_id, 'object': 'customer', 'email': email, 'name': name}
+        return self.to_object(self.customers[customer_id])
+
+    def customer_list(self, **kwargs):
+        self.register('Customer', 'list')
+        return self.to_object({'object': 'list', 'data': list(self.customers.values()), 'has_more': False})
+
+    def payment_method_list(self, customer=None, type='card', **kwargs):
+        self.register('PaymentMethod', 'list')
+        return self.to_object({'object': 'list', 'has_more': False,
+                               'data': [item for item in self.payment_methods.values()
+                                        if item['customer'] == customer and item['type'] == type]})
+
+    def payment_method_retrieve(self, method_id, **kwargs):
+        self.register('PaymentMethod', 'retrieve')
+        if method_id not in self.payment_methods:
+            raise stripe.error.InvalidRequestError(f'No such payment_method: {method_id}', 'id')
+        return self.to_object(self.payment_methods[method_id])
+
+    def setup_intent_create(self, customer=None, **kwargs):
+        self.register('SetupIntent', 'create')
+        intent_id = self.new_id('seti')
+        return self.to_object({'id': intent_id, 'object': 'setup_intent', 'customer': customer,
+                               'client_secret': f'{intent_id}_secret'})
+
+    def payment_intent_create(self, amount=None, customer=None, payment_method=None, idempotency_key=None,
+                              **kwargs):
+        self.register('PaymentIntent', 'create')
+        # as in Stripe, a repeated request (same idempotency key) obtains result of first one
+        if idempotency_key in self.idempotent_results:
+            result = self.idempotent_results[idempotency_key]
+        elif payment_method not in self.payment_methods:
+            result = stripe.error.InvalidRequestError(f'No such payment_method: {payment_method}', 'payment_method')
+        elif payment_method in self.declined_methods:
+            result = stripe.error.CardError('Your card was declined.', 'payment_method', 'card_declined')
+        else:
+            result = self.to_object({'id': self.new_id('pi'), 'object': 'payment_intent', 'amount': amount,
+                                     'customer': customer, 'payment_method': payment_method,
+                                     'metadata': kwargs.get('metadata', {}), 'status': 'succeeded'})
+            self.payment_intents[result['id']] = result
+        if idempotency_key:
+            self.idempotent_results[idempotency_key] = result
+        if self.lose_responses:
+            raise stripe.error.APIConnectionError('Connection to Stripe was lost.')
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def payment_intent_retrieve(self, intent_id, **kwargs):
+        self.register('PaymentIntent', 'retrieve')
+        if intent_id not in self.payment_intents:
+            raise stripe.error.InvalidRequestError(f'No such payment_intent: {intent_id}', 'id')
+        return self.payment_intents[intent_id]
+
+    def payment_intent_list(self, customer=None, **kwargs):
+        self.register('PaymentIntent', 'list')
+        return self.to_object({'object': 'list', 'has_more': False,
+                               'data': [item for item in self.payment_intents.values()
+                                        if item['customer'] == customer]})
+
+    def start(self):
+        replacements = [(stripe.Customer, 'create', self.customer_create),
+                        (stripe.Customer, 'list', self.customer_list),
+                        (stripe.PaymentMethod, 'list', self.payment_method_list),
+                        (stripe.PaymentMethod, 'retrieve', self.payment_method_retrieve),
+                        (stripe.SetupIntent, 'create', self.setup_intent_create),
+                        (stripe.PaymentIntent, 'create', self.payment_intent_create),
+                        (stripe.PaymentIntent, 'retrieve', self.payment_intent_retrieve),
+                        (stripe.PaymentIntent, 'list', self.payment_intent_list)]
+        for resource, operation, replacement in replacements:
+            patcher = mock.patch.object(resource, operation, side_effect=replacement)
+            patcher.start()
+            self._patchers.append(patcher)
+        return self
+
+    def stop(self):
+        for patcher in reversed(self._patchers):
+            patcher.stop()
+        self._patchers = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    @staticmethod
+    def event(event_type, data):
+        """Return an event, as provided by stripe.Webhook.construct_event"""
+        return stripe.Event.construct_from({'id': 'evt_fake', 'object': 'event', 'type': event_type,
+                                            'data': {'object': data}}, 'sk_test_fake')
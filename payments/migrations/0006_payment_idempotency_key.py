@@ -0,0 +1,27 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0005_stripecustomer_stripepaymentmethod'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='idempotency_key',
+            field=models.CharField(blank=True, max_length=300, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='error_message',
+            field=models.CharField(blank=True, default='', max_length=300),
+            preserve_default=False,
+        ),
+        migrations.AlterField(
+            model_name='payment',
+            name='status',
+            field=models.CharField(choices=[('pending', 'pending'), ('registered', 'registered'), ('processed', 'processed'), ('applied', 'applied'), ('cancelled', 'cancelled'), ('failed', 'failed')], default='registered', max_length=100),
+        ),
+    ]
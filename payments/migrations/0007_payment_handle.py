@@ -0,0 +1,30 @@
+import uuid
+
+from django.db import migrations, models
+
+
+def fill_handles(apps, schema_editor):
+    Payment = apps.get_model('payments', 'Payment')
+    for payment_id in Payment.objects.values_list('id', flat=True):
+        Payment.objects.filter(id=payment_id).update(handle=uuid.uuid4())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0006_payment_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='handle',
+            field=models.UUIDField(editable=False, null=True),
+        ),
+        migrations.RunPython(fill_handles, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='payment',
+            name='handle',
+            field=models.UUIDField(default=uuid.uuid4, editable=False, unique=True),
+        ),
+    ]
@@ -1,11 +1,14 @@
 import stripe
+import uuid
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db import models
+from django.db import models, transaction
 
 from accounts.utils import get_stripe_customer_id
-from core.constants import PY_REGISTERED, PY_STATUSES
+from core.constants import PY_CANCELLED, PY_FAILED, PY_PENDING, PY_REGISTERED, PY_STATUSES
+
+from .signals import payment_captured
 
 User = get_user_model()
 stripe.api_key = settings.STRIPE_SECRET_KEY
@@ -18,37 +21,115 @@ class Payment(models.Model):
     stripe_payment_method = models.CharField(max_length=200)   # payment method id
     operation_id = models.CharField(max_length=300)
     status = models.CharField(max_length=100, choices=PY_STATUSES, default=PY_REGISTERED)
+    idempotency_key = models.CharField(max_length=300, unique=True, blank=True, null=True)
+    handle = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)   # to query status by clients
+    error_message = models.CharField(max_length=300, blank=True)
     payment_date = models.DateTimeField(auto_now_add=True)
 
     @classmethod
-    def make_and_register(cls, user, amount, description, stripe_payment_method):
-        """Return status(result of operation) and created payment instance or message (when error)"""
-        # verify if there is a registered payment, not used before
-        payment = cls.objects.filter(user=user, amount=amount, status=PY_REGISTERED).first()
-        if not payment:
-            # make payment and register it
-            st_customer_id = get_stripe_customer_id(user)
-            try:
-                st_payment = stripe.PaymentIntent.create(amount=int(round(amount * 100, 0)),
-                                                         currency='usd',
-                                                         customer=st_customer_id,
-                                                         payment_method=stripe_payment_method,
-                                                         off_session=True,
-                                                         confirm=True)
-            except (stripe.error.InvalidRequestError, stripe.error.StripeError) as error:
-                status = 'error'
-                payment = error.user_message
-            except Exception as ex:
-                status = 'error'
-                payment = str(ex)
-            else:
-                # register the charge made
-                payment = cls.objects.create(user=user, amount=amount,
-                                             stripe_payment_method=stripe_payment_method,
-                                             description=description,
-                                             operation_id=st_payment.get('id')
-                                             )
-                status = 'success'
+    def register_pending(cls, user, amount, description, stripe_payment_method, idempotency_key):
+        """Return payment registered with idempotency_key, creating it as pending if it doesn't exist,
+        so retries of an operation obtain the same payment (and can't be charged twice)"""
+        payment, _ = cls.objects.get_or_create(idempotency_key=idempotency_key,
+                                               defaults={'user': user, 'amount': amount, 'description': description,
+                                                         'stripe_payment_method': stripe_payment_method,
+                                                         'status': PY_PENDING})
+        return payment
+
+    def capture(self):
+        """Charge pending payment in Stripe, creating and confirming a PaymentIntent with payment's idempotency key
+        (repeated requests return the same intent, instead of charging again).
+        Return status: 'success', 'pending' (result will be informed by webhook) or 'error'.
+        Other errors (communication with Stripe, concurrent request with same key) are raised,
+        so operation can be retried."""
+        if self.status != PY_PENDING:
+            return 'error' if self.status in (PY_FAILED, PY_CANCELLED) else 'success'
+        try:
+            st_payment = stripe.PaymentIntent.create(amount=int(round(self.amount * 100, 0)),
+                                                     currency='usd',
+                                                     customer=get_stripe_customer_id(self.user),
+                                                     payment_method=self.stripe_payment_method,
+                                                     off_session=True,
+                                                     confirm=True,
+                                                     metadata={'payment_id': self.id},
+                                                     idempotency_key=self.idempotency_key)
+        except (stripe.error.CardError, stripe.error.InvalidRequestError) as error:
+            self.set_failed(error.user_message or str(error))
+            return 'error'
+        if st_payment.get('status') == 'succeeded':
+            self.set_captured(st_payment.get('id'))
+            return 'success'
+        Payment.objects.filter(id=self.id, status=PY_PENDING).update(operation_id=st_payment.get('id'))
+        return 'pending'
+
+    def reconcile(self):
+        """Settle a pending payment whose charge was not confirmed (retries of capture were exhausted, or an event
+        was lost), with its PaymentIntent in Stripe: obtained by operation id, or by payment id in metadata of
+        customer's intents. A payment without intent (or with an unsuccessful one) is registered as failed; if intent
+        is still processing, payment is kept as pending. Return status of payment.
+        Errors in communication with Stripe are raised."""
+        if self.status != PY_PENDING:
+            return self.status
+        intent = None
+        if self.operation_id:
+            intent = stripe.PaymentIntent.retrieve(self.operation_id)
         else:
-            status = 'success'
-        return status, payment
+            customer_id = get_stripe_customer_id(self.user)
+            if customer_id:
+                intents = stripe.PaymentIntent.list(customer=customer_id, limit=100,
+                                                    created={'gte': int(self.payment_date.timestamp()) - 60})
+                intent = next((item for item in intents.get('data') or []
+                               if str((item.get('metadata') or {}).get('payment_id')) == str(self.id)), None)
+        if intent and intent.get('status') == 'succeeded':
+            self.set_captured(intent.get('id'))
+        elif intent and intent.get('status') == 'processing':
+            pass   # result will be informed by webhook
+        else:
+            error = intent and (intent.get('last_payment_error') or {}).get('message')
+            self.set_failed(error or 'Payment could not be processed, please try again')
+        return self.status
+
+    def set_captured(self, operation_id):
+        """Register pending payment as charged, sending payment_captured signal (post-payment stage).
+        Status is changed by a conditional update, so a payment is captured once, even when confirmed by
+        worker and webhook simultaneously. Return True if payment was captured by this call."""
+        with transaction.atomic():
+            captured = Payment.objects.filter(id=self.id, status=PY_PENDING)\
+                .update(status=PY_REGISTERED, operation_id=operation_id, error_message='')
+            self.refresh_from_db()
+            if captured:
+                payment_captured.send(sender=Payment, payment=self)
+        return bool(captured)
+
+    def set_failed(self, error_message):
+        """Register pending payment as failed"""
+        Payment.objects.filter(id=self.id, status=PY_PENDING).update(status=PY_FAILED,
+                                                                     error_message=error_message[:300])
+        self.refresh_from_db()
+
+
+class StripeCustomer(models.Model):
+    """Local copy of a Stripe customer, kept updated by webhooks"""
+    user = models.OneToOneField(User, blank=True, null=True, on_delete=models.SET_NULL, related_name='stripe_customer')
+    email = models.EmailField(db_index=True)
+    customer_id = models.CharField(max_length=200, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.customer_id} ({self.email})'
+
+
+class StripePaymentMethod(models.Model):
+    """Local copy of a card payment method attached to a Stripe customer, kept updated by webhooks"""
+    customer = models.ForeignKey(StripeCustomer, on_delete=models.CASCADE, related_name='payment_methods')
+    method_id = models.CharField(max_length=200, unique=True)
+    brand = models.CharField(max_length=50, blank=True)
+    last4 = models.CharField(max_length=4, blank=True)
+    exp_month = models.PositiveSmallIntegerField(blank=True, null=True)
+    exp_year = models.PositiveSmallIntegerField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.brand} {self.last4} ({self.method_id})'
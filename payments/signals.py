@@ -0,0 +1,4 @@
+from django.dispatch import Signal
+
+# sent when a payment is charged in Stripe, once per payment, inside a transaction; receivers apply the payment
+payment_captured = Signal(providing_args=['payment'])
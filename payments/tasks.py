@@ -0,0 +1,55 @@
+import stripe
+
+from django.conf import settings
+from django.utils import timezone
+
+from core.constants import PY_PENDING
+from core.models import TaskLog
+from core.utils import send_admin_email
+from nabi_api_django.celery_config import app
+
+from .models import Payment
+
+
+@app.task(bind=True, max_retries=5, default_retry_delay=60)
+def capture_payment(self, payment_id, task_log_id):
+    """Charge a pending payment in Stripe. Errors in communication with Stripe are retried,
+    with same idempotency key, so payment can't be charged twice"""
+    try:
+        payment = Payment.objects.get(id=payment_id)
+    except Payment.DoesNotExist:
+        send_admin_email(
+            'Error executing capture_payment task',
+            f'Executing task capture_payment (params: payment_id {payment_id}, task_log_id {task_log_id}) '
+            f'Payment DoesNotExist error is raised'
+        )
+        return None
+    try:
+        payment.capture()
+    except stripe.error.StripeError as error:
+        if self.request.retries < self.max_retries:
+            raise self.retry(exc=error)
+        # payment is not kept as pending (booking would be locked); if Stripe is not reachable yet,
+        # payment is settled by reconcile_pending_payments
+        try:
+            payment.reconcile()
+        except stripe.error.StripeError:
+            send_admin_email('Error executing capture_payment task',
+                             f'Payment {payment_id} could not be captured nor reconciled: {error}')
+            return None
+    TaskLog.objects.filter(id=task_log_id).delete()
+
+
+@app.task
+def reconcile_pending_payments():
+    """Settle payments pending for more than PAYMENT_PENDING_TIMEOUT minutes, with their intents in Stripe"""
+    threshold = timezone.now() - timezone.timedelta(minutes=settings.PAYMENT_PENDING_TIMEOUT)
+    for payment in Payment.objects.filter(status=PY_PENDING, payment_date__lt=threshold).select_related('user'):
+        try:
+            payment_status = payment.reconcile()
+        except stripe.error.StripeError as error:
+            send_admin_email('Error executing reconcile_pending_payments task',
+                             f'Payment {payment.id} could not be reconciled: {error}')
+            continue
+        if payment_status != PY_PENDING:
+            TaskLog.objects.filter(task_name='capture_payment', args__payment_id=payment.id).delete()
@@ -1,3 +1,283 @@
-from django.test import TestCase
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from accounts.models import get_account
+from accounts.tests.base_test_class import BaseTest
+from core.cache import get_tag_versions
+from core.constants import PY_APPLIED, PY_FAILED, PY_PENDING, PY_REGISTERED
+from core.models import TaskLog
+from lesson.models import Lesson, LessonBooking
+
+from .fake_stripe import FakeStripe
+from .models import Payment, StripeCustomer, StripePaymentMethod
+from .tasks import capture_payment, reconcile_pending_payments
+from .utils import get_or_create_customer, get_payment_methods_data, handle_stripe_event
+
+User = get_user_model()
+
+
+class StripeMirrorTest(TestCase):
+    """Tests for local mirror of Stripe customers and payment methods"""
+    fixtures = ['01_core_users.json', '02_accounts_instructors.json', '03_accounts_parents.json',
+                '04_accounts_students.json']
+
+    def setUp(self):
+        self.fake_stripe = FakeStripe().start()
+        self.addCleanup(self.fake_stripe.stop)
+        self.user = User.objects.get(email='luisstudent@yopmail.com')
+        self.account = get_account(self.user)
+
+    def test_customer_created_once(self):
+        """Customer is created in Stripe in first request only"""
+        customer = get_or_create_customer(self.user, self.account)
+        self.assertEqual(self.fake_stripe.calls, [('Customer', 'create')])
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.stripe_customer_id, customer.customer_id)
+        self.assertEqual(get_or_create_customer(self.user, self.account), customer)
+        self.assertEqual(len(self.fake_stripe.calls), 1)
+
+    def test_adopt_existing_customer(self):
+        """A customer id registered in account is adopted, fetching its payment methods once"""
+        self.account.stripe_customer_id = 'cus_existing'
+        self.account.save()
+        pm = self.fake_stripe.add_payment_method('cus_existing', exp_month=3, exp_year=2031)
+        customer = get_or_create_customer(self.user, self.account)
+        self.assertEqual(customer.customer_id, 'cus_existing')
+        self.assertEqual(self.fake_stripe.calls, [('PaymentMethod', 'list')])
+        self.assertEqual(get_payment_methods_data(customer),
+                         [{'code': pm['id'], 'brand': 'visa', 'last4Digits': '4242', 'expirationDate': '03/2031'}])
+        get_or_create_customer(self.user, self.account)
+        self.assertEqual(len(self.fake_stripe.calls), 1)
+
+    def test_customer_found_by_email(self):
+        """A customer received by webhook (without user) is linked to user with its email"""
+        handle_stripe_event(FakeStripe.event('customer.created', {'id': 'cus_webhook', 'email': self.user.email}))
+        customer = get_or_create_customer(self.user, self.account)
+        self.assertEqual(customer.customer_id, 'cus_webhook')
+        self.assertEqual(customer.user, self.user)
+        self.assertEqual(self.fake_stripe.calls, [])
+
+    def test_account_customer_before_email(self):
+        """Customer registered in account is used, instead of another customer with same email"""
+        self.account.stripe_customer_id = 'cus_existing'
+        self.account.save()
+        pm = self.fake_stripe.add_payment_method('cus_existing')
+        handle_stripe_event(FakeStripe.event('customer.created', {'id': 'cus_webhook', 'email': self.user.email}))
+        customer = get_or_create_customer(self.user, self.account)
+        self.assertEqual(customer.customer_id, 'cus_existing')
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.stripe_customer_id, 'cus_existing')
+        self.assertEqual([item['code'] for item in get_payment_methods_data(customer)], [pm['id']])
+        self.assertIsNone(StripeCustomer.objects.get(customer_id='cus_webhook').user)
+
+    def test_payment_method_events(self):
+        """Payment methods are stored when attached or updated, and removed when detached"""
+        customer = get_or_create_customer(self.user, self.account)
+        pm = self.fake_stripe.add_payment_method(customer.customer_id)
+        self.assertTrue(handle_stripe_event(FakeStripe.event('payment_method.attached', pm)))
+        pm['card']['exp_year'] = 2032
+        self.assertTrue(handle_stripe_event(FakeStripe.event('payment_method.automatically_updated', pm)))
+        self.assertEqual(StripePaymentMethod.objects.get(method_id=pm['id']).exp_year, 2032)
+        self.assertTrue(handle_stripe_event(FakeStripe.event('payment_method.detached', dict(pm, customer=None))))
+        self.assertFalse(customer.payment_methods.exists())
+
+    def test_unknown_customer_events(self):
+        """Payment methods of customers not registered are ignored; deleted customers are removed"""
+        pm = self.fake_stripe.add_payment_method('cus_unknown')
+        self.assertFalse(handle_stripe_event(FakeStripe.event('payment_method.attached', pm)))
+        self.assertFalse(StripePaymentMethod.objects.exists())
+        customer = get_or_create_customer(self.user, self.account)
+        handle_stripe_event(FakeStripe.event('customer.deleted', {'id': customer.customer_id}))
+        self.assertFalse(StripeCustomer.objects.exists())
+
+
+class PaymentCaptureTest(TestCase):
+    """Tests for capture of pending payments, and post-payment stage of bookings"""
+    fixtures = ['01_core_users.json', '02_accounts_instructors.json', '03_accounts_parents.json',
+                '04_accounts_students.json']
+
+    def setUp(self):
+        self.fake_stripe = FakeStripe().start()
+        self.addCleanup(self.fake_stripe.stop)
+        self.user = User.objects.get(email='luisstudent@yopmail.com')
+        self.customer = get_or_create_customer(self.user, get_account(self.user))
+        self.pm = self.fake_stripe.add_payment_method(self.customer.customer_id)
+
+    def register_payment(self, payment_method, key='booking-test'):
+        return Payment.register_pending(self.user, 70, 'Lesson booking', payment_method['id'], key)
+
+    def test_retries_charge_once(self):
+        """Retries of a payment obtain the same instance, and a captured payment is not charged again"""
+        payment = self.register_payment(self.pm)
+        self.assertEqual(payment.status, PY_PENDING)
+        self.assertEqual(self.register_payment(self.pm), payment)
+        self.assertEqual(payment.capture(), 'success')
+        self.assertEqual(payment.status, PY_REGISTERED)
+        self.assertEqual(payment.capture(), 'success')
+        self.assertEqual(self.fake_stripe.calls.count(('PaymentIntent', 'create')), 1)
+
+    def test_declined_payment(self):
+        payment = self.register_payment(self.fake_stripe.add_payment_method(self.customer.customer_id,
+                                                                            declined=True))
+        self.assertEqual(payment.capture(), 'error')
+        self.assertEqual(payment.status, PY_FAILED)
+        self.assertTrue(payment.error_message)
+
+    def test_confirmed_by_webhook(self):
+        """A payment is captured once, when confirmed by worker and webhook"""
+        payment = self.register_payment(self.pm)
+        intent = {'id': 'pi_webhook', 'status': 'succeeded', 'metadata': {'payment_id': str(payment.id)}}
+        self.assertTrue(handle_stripe_event(FakeStripe.event('payment_intent.succeeded', intent)))
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, PY_REGISTERED)
+        self.assertFalse(payment.set_captured('pi_webhook'))
+        self.assertFalse(handle_stripe_event(FakeStripe.event('payment_intent.succeeded', intent)))
+
+    def test_retries_exhausted(self):
+        """When Stripe can't be reached in any retry, payment is settled with its intent, so it's not kept pending"""
+        payment = self.register_payment(self.pm)
+        task_log = TaskLog.objects.create(task_name='capture_payment', args={'payment_id': payment.id})
+        self.fake_stripe.lose_responses = True
+        with mock.patch.object(capture_payment, 'max_retries', 0):
+            capture_payment(payment.id, task_log.id)
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, PY_REGISTERED)
+        self.assertEqual(payment.operation_id, list(self.fake_stripe.payment_intents)[0])
+        self.assertFalse(TaskLog.objects.filter(id=task_log.id).exists())
+
+    def test_stale_payment_without_intent(self):
+        """A payment pending for long time, and not charged in Stripe, is registered as failed"""
+        payment = self.register_payment(self.pm)
+        task_log = TaskLog.objects.create(task_name='capture_payment', args={'payment_id': payment.id})
+        reconcile_pending_payments()
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, PY_PENDING)
+        Payment.objects.filter(id=payment.id).update(payment_date=timezone.now() - timezone.timedelta(days=1))
+        reconcile_pending_payments()
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, PY_FAILED)
+        self.assertFalse(TaskLog.objects.filter(id=task_log.id).exists())
+
+    def test_booking_paid(self):
+        """Captured payment is applied to its booking, creating lessons"""
+        trial = LessonBooking.create_trial_lesson(self.user)
+        trial.instructor_id = 1
+        trial.scheduled_datetime = timezone.now() - timezone.timedelta(days=2)
+        trial.scheduled_timezone = 'US/Eastern'
+        trial.save()
+        payment = self.register_payment(self.pm)
+        booking = LessonBooking.objects.create(user=self.user, quantity=4, total_amount=70, instructor_id=1,
+                                               rate=30, payment=payment, status=LessonBooking.REQUESTED)
+        self.assertEqual(payment.capture(), 'success')
+        booking.refresh_from_db()
+        payment.refresh_from_db()
+        self.assertEqual(booking.status, LessonBooking.PAID)
+        self.assertEqual(payment.status, PY_APPLIED)
+        lessons = list(booking.lessons.order_by('scheduled_datetime'))
+        self.assertEqual(len(lessons), 4)
+        self.assertEqual(lessons[1].scheduled_datetime - lessons[0].scheduled_datetime, timezone.timedelta(days=7))
+        self.assertTrue(all(lesson.status == Lesson.SCHEDULED and lesson.instructor_id == 1 for lesson in lessons))
+        self.assertFalse(booking.apply_payment(payment))
+        self.assertEqual(booking.lessons.count(), 4)
+
+
+class BookingLessonsCacheTest(TransactionTestCase):
+    """Tests for cached responses, when lessons of a booking are created (commit is needed)"""
+    fixtures = ['01_core_users.json', '02_accounts_instructors.json', '03_accounts_parents.json',
+                '04_accounts_students.json']
+
+    def test_instructors_tag_invalidated(self):
+        user = User.objects.get(email='luisstudent@yopmail.com')
+        trial = LessonBooking.create_trial_lesson(user)
+        trial.scheduled_datetime = timezone.now() - timezone.timedelta(days=2)
+        trial.scheduled_timezone = 'US/Eastern'
+        trial.save()
+        booking = LessonBooking.objects.create(user=user, quantity=2, total_amount=70, rate=30,
+                                               status=LessonBooking.REQUESTED)
+        version = get_tag_versions(['instructors'])[0]
+        booking.create_lessons(trial)
+        self.assertNotEqual(get_tag_versions(['instructors'])[0], version)
+
+
+class BookingPaymentTest(BaseTest):
+    """Tests for payments registered when a booking is requested"""
+    fixtures = ['01_core_users.json', '02_accounts_instructors.json', '03_accounts_parents.json',
+                '04_accounts_students.json']
+    login_data = {
+        'email': 'luisstudent@yopmail.com',
+        'password': 'T3st11ng'
+    }
+
+    def setUp(self):
+        super().setUp()
+        self.fake_stripe = FakeStripe().start()
+        self.addCleanup(self.fake_stripe.stop)
+        self.user = User.objects.get(email='luisstudent@yopmail.com')
+        self.customer = get_or_create_customer(self.user, get_account(self.user))
+        trial = LessonBooking.create_trial_lesson(self.user)
+        trial.instructor_id = 1
+        trial.rate = 30
+        trial.save()
+        self.url = '{}/v1/confirm-booking/'.format(settings.HOSTNAME_PROTOCOL)
+
+    def book(self, package, payment_method):
+        return self.client.post(self.url, data={'package': package, 'paymentMethodCode': payment_method['id']},
+                                format='json')
+
+    def test_retry_with_other_payment_method(self):
+        """A retry with another payment method obtains payment being charged, instead of charging twice"""
+        pm = self.fake_stripe.add_payment_method(self.customer.customer_id)
+        response = self.book('artist', pm)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, msg=response.content.decode())
+        self.assertEqual(response.json().get('paymentStatus'), PY_PENDING)
+        other_pm = self.fake_stripe.add_payment_method(self.customer.customer_id, last4='1111')
+        retry = self.book('maestro', other_pm)
+        self.assertEqual(retry.status_code, status.HTTP_409_CONFLICT, msg=retry.content.decode())
+        self.assertEqual(retry.json().get('paymentKey'), response.json().get('paymentKey'))
+        self.assertEqual(Payment.objects.count(), 1)
+        self.assertEqual(LessonBooking.objects.get(id=response.json().get('booking_id')).payment.stripe_payment_method,
+                         pm['id'])
+
+    def test_retry_after_failed_payment(self):
+        """A booking with a failed payment can be paid with another payment method"""
+        declined_pm = self.fake_stripe.add_payment_method(self.customer.customer_id, declined=True)
+        response = self.book('artist', declined_pm)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, msg=response.content.decode())
+        payment = Payment.objects.get()
+        self.assertEqual(payment.capture(), 'error')
+        pm = self.fake_stripe.add_payment_method(self.customer.customer_id)
+        retry = self.book('artist', pm)
+        self.assertEqual(retry.status_code, status.HTTP_200_OK, msg=retry.content.decode())
+        self.assertNotEqual(retry.json().get('paymentKey'), str(payment.handle))
+        self.assertEqual(retry.json().get('booking_id'), response.json().get('booking_id'))
+
+    def test_payment_status(self):
+        """Status of a payment is returned to its owner only, by handle"""
+        pm = self.fake_stripe.add_payment_method(self.customer.customer_id)
+        response = self.book('artist', pm)
+        status_url = '{}/v1/payments/{}/status/'.format(settings.HOSTNAME_PROTOCOL, response.json().get('paymentKey'))
+        response = self.client.get(status_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, msg=response.content.decode())
+        self.assertEqual(response.json().get('status'), PY_PENDING)
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer {}'.format(
+            self.get_token('luisinstruct@yopmail.com', 'T3st11ng')))
+        self.assertEqual(self.client.get(status_url).status_code, status.HTTP_404_NOT_FOUND)
+        self.client.credentials()
+        self.assertEqual(self.client.get(status_url).status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class StripeWebhookTest(APITestCase):
+    """Tests for endpoint receiving Stripe events"""
+
+    def test_invalid_signature(self):
+        response = self.client.post('{}/v1/stripe-webhook/'.format(settings.HOSTNAME_PROTOCOL),
+                                    data='{"type": "customer.created"}', content_type='application/json',
+                                    HTTP_STRIPE_SIGNATURE='t=1,v1=wrong')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,11 @@
+from django.urls import path
+
+from . import views
+
+app_name = 'payments'
+
+
+urlpatterns = [
+    path('payments/<uuid:handle>/status/', views.PaymentStatusView.as_view(), name='payment_status'),
+    path('stripe-webhook/', views.StripeWebhookView.as_view(), name='stripe_webhook'),
+]
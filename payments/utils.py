@@ -0,0 +1,120 @@
+"""Local mirror of Stripe customers and payment methods.
+Customers are looked up locally (by user, then by customer id of account, then by email), and payment methods are read from local table,
+so Stripe is requested only when a customer is not known yet; webhooks keep the mirror updated
+(and confirm payments charged asynchronously)."""
+import stripe
+
+from django.conf import settings
+from django.db import transaction
+
+from core.constants import PY_PENDING
+
+from .models import Payment, StripeCustomer, StripePaymentMethod
+
+stripe.api_key = settings.STRIPE_SECRET_KEY
+
+CUSTOMER_EVENTS = ('customer.created', 'customer.updated')
+PAYMENT_METHOD_EVENTS = ('payment_method.attached', 'payment_method.updated', 'payment_method.automatically_updated')
+
+
+def get_payment_method_fields(stripe_pm):
+    """Return values for StripePaymentMethod fields from a Stripe payment method"""
+    card = stripe_pm.get('card') or {}
+    return {'brand': card.get('brand') or '', 'last4': card.get('last4') or '',
+            'exp_month': card.get('exp_month'), 'exp_year': card.get('exp_year')}
+
+
+def sync_payment_methods(customer):
+    """Replace stored payment methods of customer with the ones registered in Stripe (one request to Stripe)"""
+    stripe_resp = stripe.PaymentMethod.list(customer=customer.customer_id, type='card')
+    with transaction.atomic():
+        customer.payment_methods.all().delete()
+        StripePaymentMethod.objects.bulk_create([
+            StripePaymentMethod(customer=customer, method_id=item.get('id'), **get_payment_method_fields(item))
+            for item in stripe_resp['data']
+        ])
+
+
+def get_or_create_customer(user, account):
+    """Return StripeCustomer of user; it's taken from local mirror when possible. Otherwise, stripe_customer_id of
+    account is adopted (fetching its payment methods), a customer with user's email not linked yet is linked,
+    or a customer is created in Stripe. Stripe customer id is stored in account too. Stripe errors are propagated."""
+    customer = StripeCustomer.objects.filter(user=user).first()
+    if not customer and account.stripe_customer_id:
+        # customer registered in account (with its saved cards) goes before others with same email
+        customer, _ = StripeCustomer.objects.update_or_create(customer_id=account.stripe_customer_id,
+                                                              defaults={'user': user, 'email': user.email})
+        sync_payment_methods(customer)
+    if not customer:
+        customer = StripeCustomer.objects.filter(email=user.email, user__isnull=True).order_by('-id').first()
+        if customer:
+            customer.user = user
+            customer.save()
+        else:
+            stripe_customer = stripe.Customer.create(email=user.email, name=account.display_name)
+            customer = StripeCustomer.objects.create(user=user, email=user.email,
+                                                     customer_id=stripe_customer.get('id'))
+    if account.stripe_customer_id != customer.customer_id:
+        account.stripe_customer_id = customer.customer_id
+        account.save()
+    return customer
+
+
+def get_payment_methods_data(customer):
+    """Return data of stored payment methods of customer, as provided by GetPaymentMethodSerializer"""
+    data = []
+    for item in customer.payment_methods.order_by('id'):
+        pm_data = {'code': item.method_id, 'brand': item.brand, 'last4Digits': item.last4}
+        if item.exp_month and item.exp_year:
+            pm_data['expirationDate'] = f'{item.exp_month:02d}/{item.exp_year}'
+        data.append(pm_data)
+    return data
+
+
+def is_customer_payment_method(method_id, customer_id):
+    """Indicate whether payment method is stored as attached to customer"""
+    return StripePaymentMethod.objects.filter(method_id=method_id, customer__customer_id=customer_id).exists()
+
+
+def get_intent_payment(stripe_intent):
+    """Return pending Payment related to a Stripe PaymentIntent, or None"""
+    payment_id = (stripe_intent.get('metadata') or {}).get('payment_id')
+    condition = {'id': payment_id} if payment_id else {'operation_id': stripe_intent.get('id')}
+    return Payment.objects.filter(status=PY_PENDING, **condition).first()
+
+
+def handle_stripe_event(event):
+    """Update local mirror with data of a Stripe event (customer or payment method ones),
+    or confirm a pending payment (payment intent ones).
+    Return True if event was used, False otherwise"""
+    event_type = event['type']
+    obj = event['data']['object']
+    if event_type in CUSTOMER_EVENTS:
+        customer, created = StripeCustomer.objects.get_or_create(customer_id=obj.get('id'),
+                                                                 defaults={'email': obj.get('email') or ''})
+        if not created and obj.get('email'):
+            customer.email = obj.get('email')
+            customer.save()
+    elif event_type == 'customer.deleted':
+        StripeCustomer.objects.filter(customer_id=obj.get('id')).delete()
+    elif event_type in PAYMENT_METHOD_EVENTS:
+        customer = StripeCustomer.objects.filter(customer_id=obj.get('customer')).first()
+        if not customer:
+            # payment method of a customer not registered in mirror; it's fetched when customer is adopted
+            return False
+        StripePaymentMethod.objects.update_or_create(method_id=obj.get('id'),
+                                                     defaults=dict(customer=customer,
+                                                                   **get_payment_method_fields(obj)))
+    elif event_type == 'payment_method.detached':
+        StripePaymentMethod.objects.filter(method_id=obj.get('id')).delete()
+    elif event_type in ('payment_intent.succeeded', 'payment_intent.payment_failed'):
+        payment = get_intent_payment(obj)
+        if not payment:
+            return False
+        if event_type == 'payment_intent.succeeded':
+            payment.set_captured(obj.get('id'))
+        else:
+            payment.set_failed((obj.get('last_payment_error') or {}).get('message') or 'Payment failed')
+    else:
+        return False
+    return True
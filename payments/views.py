@@ -1,3 +1,36 @@
-from django.shortcuts import render
+import stripe
 
-# Create your views here.
+from django.conf import settings
+
+from rest_framework import status, views
+from rest_framework.permissions import AllowAny
+from rest_framework.response import Response
+
+from .models import Payment
+from .utils import handle_stripe_event
+
+
+class StripeWebhookView(views.APIView):
+    """Receive Stripe events, to keep local mirror of customers and payment methods updated.
+    Events are authenticated by signature, with STRIPE_WEBHOOK_SECRET"""
+    authentication_classes = ()
+    permission_classes = (AllowAny, )
+
+    def post(self, request):
+        try:
+            event = stripe.Webhook.construct_event(request.body, request.META.get('HTTP_STRIPE_SIGNATURE', ''),
+                                                   settings.STRIPE_WEBHOOK_SECRET)
+        except (ValueError, stripe.error.SignatureVerificationError):
+            return Response({'detail': 'Invalid Stripe event'}, status=status.HTTP_400_BAD_REQUEST)
+        handle_stripe_event(event)
+        return Response({'received': True})
+
+
+class PaymentStatusView(views.APIView):
+    """Return status of a payment of logged user, by its handle (returned when a booking is registered)"""
+
+    def get(self, request, handle):
+        payment = Payment.objects.filter(user=request.user, handle=handle).first()
+        if not payment:
+            return Response({'detail': 'There is not payment with provided handle'}, status=status.HTTP_404_NOT_FOUND)
+        return Response({'status': payment.status, 'detail': payment.error_message})
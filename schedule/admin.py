@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from .models import InstructorParticularAvailability, InstructorRegularAvailability
+from .models import InstructorParticularAvailability, InstructorRegularAvailability, InstructorWeekOccupancy
 
 
 class InstructorParticularAvailabilityAdmin(admin.ModelAdmin):
@@ -21,5 +21,22 @@ class InstructorRegularAvailabilityAdmin(admin.ModelAdmin):
         model = InstructorRegularAvailability
 
 
+class InstructorWeekOccupancyAdmin(admin.ModelAdmin):
+    list_display = ('instructor', 'week_start', 'lessons_qty', 'booked_minutes', )
+    list_filter = ('week_start', )
+    list_select_related = ('instructor__user', )
+    fields = ('instructor', 'week_start', 'lessons_qty', 'booked_minutes', 'slot_minutes', 'updated_at')
+    readonly_fields = fields
+    search_fields = ('instructor__user__email', )
+    ordering = ('-week_start', '-booked_minutes')
+
+    class Meta:
+        model = InstructorWeekOccupancy
+
+    def has_add_permission(self, request):
+        return False
+
+
 admin.site.register(InstructorParticularAvailability, InstructorParticularAvailabilityAdmin)
 admin.site.register(InstructorRegularAvailability, InstructorRegularAvailabilityAdmin)
+admin.site.register(InstructorWeekOccupancy, InstructorWeekOccupancyAdmin)
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class ScheduleConfig(AppConfig):
     name = 'schedule'
+
+    def ready(self):
+        from . import signals
@@ -0,0 +1,134 @@
+"""Arithmetic of time intervals within a day.
+Intervals are tuples (begin, end) of minutes from midnight (wall-clock time), with begin < end;
+lists of intervals are kept sorted and merged, so operations between them are linear."""
+import datetime
+
+from django.utils import timezone
+
+from core.constants import LESSON_DURATION_30
+
+MINUTES_PER_DAY = 24 * 60
+DEFAULT_LESSON_DURATION = 30
+
+
+def to_minutes(value):
+    """Return minutes from midnight of a time, provided as string (format HH:MM) or datetime.time"""
+    if isinstance(value, str):
+        hour, minutes = value.split(':')[:2]
+        return int(hour) * 60 + int(minutes)
+    return value.hour * 60 + value.minute
+
+
+def to_time_string(minutes):
+    """Return string (format HH:MM) for minutes from midnight; 1440 is returned as 24:00"""
+    return '{:02d}:{:02d}'.format(*divmod(minutes, 60))
+
+
+def normalize(intervals):
+    """Return intervals sorted and merged (overlapping or contiguous ones), discarding empty ones"""
+    result = []
+    for begin, end in sorted(item for item in intervals if item[0] < item[1]):
+        if result and begin <= result[-1][1]:
+            if end > result[-1][1]:
+                result[-1] = (result[-1][0], end)
+        else:
+            result.append((begin, end))
+    return result
+
+
+def subtract(intervals, others):
+    """Return parts of intervals not covered by others; both lists must be normalized"""
+    result = []
+    index = 0
+    qty_others = len(others)
+    for begin, end in intervals:
+        # skip intervals which end before this one begins
+        while index < qty_others and others[index][1] <= begin:
+            index += 1
+        current = begin
+        pos = index
+        while pos < qty_others and others[pos][0] < end:
+            if others[pos][0] > current:
+                result.append((current, others[pos][0]))
+            current = max(current, others[pos][1])
+            pos += 1
+        if current < end:
+            result.append((current, end))
+    return result
+
+
+def intersect(intervals, others):
+    """Return parts covered by both lists of intervals; both lists must be normalized"""
+    result = []
+    i = j = 0
+    while i < len(intervals) and j < len(others):
+        begin = max(intervals[i][0], others[j][0])
+        end = min(intervals[i][1], others[j][1])
+        if begin < end:
+            result.append((begin, end))
+        if intervals[i][1] < others[j][1]:
+            i += 1
+        else:
+            j += 1
+    return result
+
+
+def fits(intervals, begin, duration):
+    """Indicate whether an interval of duration minutes, starting at begin, is contained in intervals"""
+    return any(item[0] <= begin and begin + duration <= item[1] for item in intervals)
+
+
+def slot_starts(intervals, duration, step=30, max_qty=None):
+    """Return beginnings (multiple of step) of intervals of duration minutes fitting in intervals"""
+    result = []
+    for begin, end in intervals:
+        start = -(-begin // step) * step
+        while start + duration <= end:
+            if max_qty is not None and len(result) >= max_qty:
+                return result
+            result.append(start)
+            start += step
+    return result
+
+
+def get_duration_minutes(lessons_duration):
+    """Return minutes of a lesson duration value (like '45 mins'); 30 when value is not provided"""
+    try:
+        return int((lessons_duration or LESSON_DURATION_30).split()[0])
+    except ValueError:
+        return DEFAULT_LESSON_DURATION
+
+
+def localize_datetime(date, time, time_zone):
+    """Return aware datetime for date and (wall-clock) time in time_zone, with offset valid for that date (DST)"""
+    naive = datetime.datetime.combine(date, time) if isinstance(time, datetime.time) \
+        else datetime.datetime.combine(date, datetime.time(*divmod(to_minutes(time), 60)))
+    return timezone.pytz.timezone(time_zone).localize(naive)
+
+
+def datetime_interval(datetime_value, duration, date, time_zone):
+    """Return interval (wall-clock minutes) of date in time_zone, covered by an event starting at datetime_value
+    and lasting duration minutes. Events crossing midnight are clipped; None is returned if date is not covered.
+    When clocks are set back during the event, wall-clock time repeats, so end is the latest wall-clock time reached
+    (as if offset didn't change); when clocks are set forward, it's the wall-clock time at end of event."""
+    tz = timezone.pytz.timezone(time_zone)
+    local_begin = datetime_value.astimezone(tz)
+    local_end = tz.normalize((datetime_value + datetime.timedelta(minutes=duration)).astimezone(tz))
+    wall_end = max(local_end.replace(tzinfo=None),
+                   local_begin.replace(tzinfo=None) + datetime.timedelta(minutes=duration))
+    begin = (local_begin.date() - date).days * MINUTES_PER_DAY + local_begin.hour * 60 + local_begin.minute
+    end = (wall_end.date() - date).days * MINUTES_PER_DAY + wall_end.hour * 60 + wall_end.minute
+    begin, end = max(begin, 0), min(end, MINUTES_PER_DAY)
+    if begin >= end:
+        return None
+    return begin, end
+
+
+def schedule_to_intervals(schedule):
+    """Return normalized intervals from a schedule (list of dicts with beginTime and endTime keys)"""
+    return normalize([(to_minutes(item.get('beginTime')), to_minutes(item.get('endTime'))) for item in schedule or []])
+
+
+def intervals_to_schedule(intervals):
+    """Return a list of dicts with beginTime and endTime keys, from intervals"""
+    return [{'beginTime': to_time_string(begin), 'endTime': to_time_string(end)} for begin, end in intervals]
@@ -0,0 +1,23 @@
+from django.core.management import BaseCommand
+from django.db.models.functions import TruncWeek
+from django.utils import timezone
+
+from lesson.models import Lesson
+from schedule.utils import update_week_occupancy
+
+
+class Command(BaseCommand):
+    help = 'Compute week occupancy of instructors, from their lessons'
+
+    def handle(self, *args, **options):
+        self.stdout.write('Start process ...')
+        self.stdout.flush()
+        weeks = Lesson.objects.filter(instructor__isnull=False, scheduled_datetime__isnull=False)\
+            .annotate(week=TruncWeek('scheduled_datetime')).values_list('instructor_id', 'week').distinct()
+        for instructor_id, week in weeks:
+            # weeks are truncated in server's time zone, so middle of week is used to get same week in instructor's one
+            update_week_occupancy(instructor_id, week + timezone.timedelta(days=3))
+            self.stdout.write(' . ')
+            self.stdout.flush()
+        self.stdout.write('Process complete ...')
+        self.stdout.flush()
@@ -0,0 +1,55 @@
+import django.contrib.postgres.fields.ranges
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import BtreeGistExtension
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0050_auto_20201008_1210'),
+        ('schedule', '0002_auto_20201118_1207'),
+    ]
+
+    operations = [
+        BtreeGistExtension(),
+        migrations.CreateModel(
+            name='RegularAvailabilityRange',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('week_day', models.IntegerField(choices=[(0, 'monday'), (1, 'tuesday'), (2, 'wednesday'), (3, 'thursday'), (4, 'friday'), (5, 'saturday'), (6, 'sunday')])),
+                ('minutes', django.contrib.postgres.fields.ranges.IntegerRangeField()),
+                ('availability', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ranges', to='schedule.InstructorRegularAvailability')),
+                ('instructor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='regular_availability_ranges', to='accounts.Instructor')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ParticularAvailabilityRange',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('minutes', django.contrib.postgres.fields.ranges.IntegerRangeField()),
+                ('availability', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ranges', to='schedule.InstructorParticularAvailability')),
+                ('instructor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='particular_availability_ranges', to='accounts.Instructor')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='regularavailabilityrange',
+            index=django.contrib.postgres.indexes.GistIndex(fields=['week_day', 'minutes'], name='schedule_re_week_da_5b1f7e_gist'),
+        ),
+        migrations.AddIndex(
+            model_name='particularavailabilityrange',
+            index=django.contrib.postgres.indexes.GistIndex(fields=['date', 'minutes'], name='schedule_pa_date_8c0e2d_gist'),
+        ),
+        migrations.RunSQL(
+            'ALTER TABLE schedule_regularavailabilityrange ADD CONSTRAINT schedule_regular_range_no_overlap '
+            'EXCLUDE USING gist (availability_id WITH =, minutes WITH &&)',
+            'ALTER TABLE schedule_regularavailabilityrange DROP CONSTRAINT schedule_regular_range_no_overlap',
+        ),
+        migrations.RunSQL(
+            'ALTER TABLE schedule_particularavailabilityrange ADD CONSTRAINT schedule_particular_range_no_overlap '
+            'EXCLUDE USING gist (availability_id WITH =, minutes WITH &&)',
+            'ALTER TABLE schedule_particularavailabilityrange DROP CONSTRAINT schedule_particular_range_no_overlap',
+        ),
+    ]
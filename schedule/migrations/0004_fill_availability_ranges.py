@@ -0,0 +1,58 @@
+from django.db import migrations
+from psycopg2.extras import NumericRange
+
+
+def get_intervals(schedule):
+    """Return sorted and merged intervals (minutes from midnight) from a JSON schedule, ignoring invalid items"""
+    intervals = []
+    for item in schedule or []:
+        try:
+            begin_hour, begin_minutes = item['beginTime'].split(':')[:2]
+            end_hour, end_minutes = item['endTime'].split(':')[:2]
+            intervals.append((int(begin_hour) * 60 + int(begin_minutes), int(end_hour) * 60 + int(end_minutes)))
+        except (AttributeError, KeyError, TypeError, ValueError):
+            continue
+    result = []
+    for begin, end in sorted(item for item in intervals if item[0] < item[1]):
+        if result and begin <= result[-1][1]:
+            result[-1] = (result[-1][0], max(end, result[-1][1]))
+        else:
+            result.append((begin, end))
+    return result
+
+
+def fill_ranges(apps, schema_editor):
+    InstructorRegularAvailability = apps.get_model('schedule', 'InstructorRegularAvailability')
+    InstructorParticularAvailability = apps.get_model('schedule', 'InstructorParticularAvailability')
+    RegularAvailabilityRange = apps.get_model('schedule', 'RegularAvailabilityRange')
+    ParticularAvailabilityRange = apps.get_model('schedule', 'ParticularAvailabilityRange')
+    RegularAvailabilityRange.objects.bulk_create(
+        [RegularAvailabilityRange(availability_id=item.id, instructor_id=item.instructor_id, week_day=item.week_day,
+                                  minutes=NumericRange(begin, end))
+         for item in InstructorRegularAvailability.objects.iterator()
+         for begin, end in get_intervals(item.schedule)],
+        batch_size=1000
+    )
+    ParticularAvailabilityRange.objects.bulk_create(
+        [ParticularAvailabilityRange(availability_id=item.id, instructor_id=item.instructor_id, date=item.date,
+                                     minutes=NumericRange(begin, end))
+         for item in InstructorParticularAvailability.objects.iterator()
+         for begin, end in get_intervals(item.schedule)],
+        batch_size=1000
+    )
+
+
+def remove_ranges(apps, schema_editor):
+    apps.get_model('schedule', 'RegularAvailabilityRange').objects.all().delete()
+    apps.get_model('schedule', 'ParticularAvailabilityRange').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schedule', '0003_availability_ranges'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_ranges, remove_ranges),
+    ]
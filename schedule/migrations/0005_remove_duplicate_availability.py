@@ -0,0 +1,26 @@
+from django.db import migrations
+from django.db.models import Min
+
+
+def remove_duplicates(apps, schema_editor):
+    """Keep first registered availability item for each instructor and date (or week day), which is the one in use"""
+    for model_name, key_field in (('InstructorParticularAvailability', 'date'),
+                                  ('InstructorRegularAvailability', 'week_day')):
+        model = apps.get_model('schedule', model_name)
+        first_ids = model.objects.values('instructor_id', key_field).annotate(first_id=Min('id'))\
+            .values_list('first_id', flat=True)
+        model.objects.exclude(id__in=list(first_ids)).delete()
+
+
+class Migration(migrations.Migration):
+    """Duplicates are removed before unique constraints are added, in a separate migration (transaction):
+    deletion leaves pending trigger events (deferred foreign keys), and tables can't be altered then"""
+
+    dependencies = [
+        ('accounts', '0050_auto_20201008_1210'),
+        ('schedule', '0004_fill_availability_ranges'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schedule', '0005_remove_duplicate_availability'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='instructorparticularavailability',
+            unique_together={('instructor', 'date')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='instructorregularavailability',
+            unique_together={('instructor', 'week_day')},
+        ),
+    ]
@@ -0,0 +1,30 @@
+import django.contrib.postgres.fields
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0050_auto_20201008_1210'),
+        ('schedule', '0005_unique_availability'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InstructorWeekOccupancy',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('week_start', models.DateField()),
+                ('lessons_qty', models.IntegerField(default=0)),
+                ('booked_minutes', models.IntegerField(default=0)),
+                ('slot_minutes', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), default=list, size=35)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('instructor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='week_occupancies', to='accounts.Instructor')),
+            ],
+            options={
+                'verbose_name_plural': 'Instructor Week Occupancies',
+                'unique_together': {('instructor', 'week_start')},
+            },
+        ),
+    ]
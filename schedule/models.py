@@ -1,8 +1,15 @@
-from django.contrib.postgres.fields import JSONField
-from django.db import models
+from django.conf import settings
+from django.contrib.postgres.fields import ArrayField, IntegerRangeField, JSONField
+from django.contrib.postgres.indexes import GistIndex
+from django.db import connection, models, transaction
+from django.db.models import Q
+from django.utils import timezone
+from psycopg2.extras import Json, NumericRange
 
 from core.utils import DayChoices
 
+from .intervals import MINUTES_PER_DAY, intervals_to_schedule, normalize, schedule_to_intervals, to_minutes
+
 
 class InstructorRegularAvailability(models.Model):
     instructor = models.ForeignKey('accounts.Instructor', on_delete=models.CASCADE, related_name='regular_availability')
@@ -10,8 +17,23 @@ class InstructorRegularAvailability(models.Model):
     schedule = JSONField()
 
     class Meta:
+        unique_together = ('instructor', 'week_day')
         verbose_name_plural = 'Instructor Regular Availabilities'
 
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            self.update_ranges()
+
+    def update_ranges(self):
+        """Replace stored ranges of availability with the ones in schedule"""
+        self.ranges.all().delete()
+        RegularAvailabilityRange.objects.bulk_create([
+            RegularAvailabilityRange(availability=self, instructor_id=self.instructor_id, week_day=self.week_day,
+                                     minutes=NumericRange(begin, end))
+            for begin, end in schedule_to_intervals(self.schedule)
+        ])
+
 
 class InstructorParticularAvailability(models.Model):
     instructor = models.ForeignKey('accounts.Instructor', on_delete=models.CASCADE,
@@ -20,17 +42,219 @@ class InstructorParticularAvailability(models.Model):
     schedule = JSONField()
 
     class Meta:
+        unique_together = ('instructor', 'date')
         verbose_name_plural = 'Instructor Particular Availabilities'
 
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            self.update_ranges()
+
+    def update_ranges(self):
+        """Replace stored ranges of availability with the ones in schedule"""
+        self.ranges.all().delete()
+        ParticularAvailabilityRange.objects.bulk_create([
+            ParticularAvailabilityRange(availability=self, instructor_id=self.instructor_id, date=self.date,
+                                        minutes=NumericRange(begin, end))
+            for begin, end in schedule_to_intervals(self.schedule)
+        ])
+
+
+class RegularAvailabilityRange(models.Model):
+    """Interval of a regular availability, as a range of minutes from midnight [begin, end).
+    Ranges of same availability can't overlap (exclusion constraint, created in migration)"""
+    availability = models.ForeignKey(InstructorRegularAvailability, on_delete=models.CASCADE, related_name='ranges')
+    instructor = models.ForeignKey('accounts.Instructor', on_delete=models.CASCADE,
+                                   related_name='regular_availability_ranges')
+    week_day = models.IntegerField(choices=DayChoices.choices)
+    minutes = IntegerRangeField()
+
+    class Meta:
+        indexes = [GistIndex(fields=['week_day', 'minutes'], name='schedule_re_week_da_5b1f7e_gist')]
+
+
+class ParticularAvailabilityRange(models.Model):
+    """Interval of a particular availability, as a range of minutes from midnight [begin, end).
+    Ranges of same availability can't overlap (exclusion constraint, created in migration)"""
+    availability = models.ForeignKey(InstructorParticularAvailability, on_delete=models.CASCADE,
+                                     related_name='ranges')
+    instructor = models.ForeignKey('accounts.Instructor', on_delete=models.CASCADE,
+                                   related_name='particular_availability_ranges')
+    date = models.DateField()
+    minutes = IntegerRangeField()
+
+    class Meta:
+        indexes = [GistIndex(fields=['date', 'minutes'], name='schedule_pa_date_8c0e2d_gist')]
+
+
+class InstructorWeekOccupancy(models.Model):
+    """Lessons of an instructor in a week (starting on monday, in instructor's time zone), updated on every change
+    of instructor's lessons. slot_minutes are booked minutes in each timeframe used in Availability model,
+    for each day: 7 days by 5 timeframes (early-morning, late-morning, early-afternoon, late-afternoon, evening)"""
+    instructor = models.ForeignKey('accounts.Instructor', on_delete=models.CASCADE, related_name='week_occupancies')
+    week_start = models.DateField()
+    lessons_qty = models.IntegerField(default=0)
+    booked_minutes = models.IntegerField(default=0)
+    slot_minutes = ArrayField(models.IntegerField(), size=35, default=list)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('instructor', 'week_start')
+        verbose_name_plural = 'Instructor Week Occupancies'
+
+
+def _upsert_availability(model, range_model, key_field, instructor_id, keys, schedule):
+    """Set schedule of instructor for several keys (dates or week days), inserting or updating availability items
+    in a single statement (INSERT ... ON CONFLICT); stored ranges are replaced with two more statements.
+    Return a dict {key: availability_id}"""
+    if not keys:
+        return {}
+    keys = sorted(set(keys))
+    sql = 'INSERT INTO {table} (instructor_id, {key}, schedule) VALUES {values} ' \
+          'ON CONFLICT (instructor_id, {key}) DO UPDATE SET schedule = EXCLUDED.schedule ' \
+          'RETURNING id, {key}'.format(table=model._meta.db_table, key=key_field,
+                                       values=', '.join(['(%s, %s, %s)'] * len(keys)))
+    params = []
+    for key in keys:
+        params += [instructor_id, key, Json(schedule)]
+    intervals = schedule_to_intervals(schedule)
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            ids = {key: availability_id for availability_id, key in cursor.fetchall()}
+        range_model.objects.filter(availability_id__in=ids.values()).delete()
+        range_model.objects.bulk_create([
+            range_model(availability_id=availability_id, instructor_id=instructor_id, minutes=NumericRange(begin, end),
+                        **{key_field: key})
+            for key, availability_id in ids.items() for begin, end in intervals
+        ])
+    return ids
+
+
+def set_particular_availability(instructor_id, dates, schedule):
+    """Set schedule of instructor in several dates; return a dict {date: availability_id}"""
+    return _upsert_availability(InstructorParticularAvailability, ParticularAvailabilityRange, 'date',
+                                instructor_id, dates, schedule)
+
+
+def set_regular_availability(instructor_id, week_days, schedule):
+    """Set schedule of instructor in several week days; return a dict {week_day: availability_id}"""
+    return _upsert_availability(InstructorRegularAvailability, RegularAvailabilityRange, 'week_day',
+                                instructor_id, week_days, schedule)
+
+
+def get_ranges_schedule(availability):
+    """Return schedule of an availability, built from its stored ranges (prefetched preferably)"""
+    return intervals_to_schedule(sorted((item.minutes.lower, item.minutes.upper) for item in availability.ranges.all()))
+
 
 def get_instructor_schedule(instructor, date):
     """Get schedule data for an instructor in a specific date"""
-    if instructor.particular_availability.filter(date=date).exists():
-        ins_ava = instructor.particular_availability.filter(date=date).first()
+    return get_instructor_schedules(instructor, [date])[date]
+
+
+def get_instructor_schedules(instructor, dates):
+    """Get schedule data for an instructor in several dates, as a dict {date: schedule}; two queries at most
+    (four when schedules are read from stored ranges)"""
+    if settings.AVAILABILITY_READ_RANGES:
+        def get_schedule(availability):
+            return get_ranges_schedule(availability)
+        particular_qs = instructor.particular_availability.prefetch_related('ranges')
+        regular_qs = instructor.regular_availability.prefetch_related('ranges')
     else:
-        week_day = date.weekday()
-        ins_ava = instructor.regular_availability.filter(week_day=week_day).first()
-    if ins_ava:
-        return ins_ava.schedule
+        def get_schedule(availability):
+            return availability.schedule
+        particular_qs = instructor.particular_availability.all()
+        regular_qs = instructor.regular_availability.all()
+    # ordered by descending id, so first registered item prevails, as in get_instructor_schedule
+    particular = {item.date: get_schedule(item) for item in particular_qs.filter(date__in=dates).order_by('-id')}
+    regular = {}
+    if any(date not in particular for date in dates):
+        regular = {item.week_day: get_schedule(item) for item in regular_qs.order_by('-id')}
+    return {date: particular[date] if date in particular else regular.get(date.weekday(), {}) for date in dates}
+
+
+def get_instructors_intervals(instructor_ids, dates):
+    """Get available intervals (minutes from midnight) of several instructors in several dates,
+    as a dict {instructor_id: {date: intervals}}; two queries (four when read from stored ranges)"""
+    particular_qs = InstructorParticularAvailability.objects.filter(instructor_id__in=instructor_ids, date__in=dates)
+    regular_qs = InstructorRegularAvailability.objects.filter(instructor_id__in=instructor_ids,
+                                                              week_day__in={date.weekday() for date in dates})
+    if settings.AVAILABILITY_READ_RANGES:
+        def get_intervals(availability):
+            return normalize((item.minutes.lower, item.minutes.upper) for item in availability.ranges.all())
+        particular_qs = particular_qs.prefetch_related('ranges')
+        regular_qs = regular_qs.prefetch_related('ranges')
     else:
-        return {}
+        def get_intervals(availability):
+            return schedule_to_intervals(availability.schedule)
+    # ordered by descending id, so first registered item prevails, as in get_instructor_schedules
+    particular = {(item.instructor_id, item.date): get_intervals(item) for item in particular_qs.order_by('-id')}
+    regular = {(item.instructor_id, item.week_day): get_intervals(item) for item in regular_qs.order_by('-id')}
+    result = {}
+    for instructor_id in instructor_ids:
+        result[instructor_id] = {}
+        for date in dates:
+            if (instructor_id, date) in particular:
+                result[instructor_id][date] = particular[(instructor_id, date)]
+            else:
+                result[instructor_id][date] = regular.get((instructor_id, date.weekday()), [])
+    return result
+
+
+def available_in_date_condition(date, begin, end, lookup='contains'):
+    """Return condition (Q object) for instructors whose availability in date covers [begin, end) minutes interval
+    (or overlaps it, with 'overlap' lookup). Availability registered for date (particular) prevails over the
+    registered for its week day (regular)."""
+    condition = {f'minutes__{lookup}': NumericRange(begin, end)}
+    return (Q(id__in=ParticularAvailabilityRange.objects.filter(date=date, **condition).values('instructor_id'))
+            | (~Q(id__in=InstructorParticularAvailability.objects.filter(date=date).values('instructor_id'))
+               & Q(id__in=RegularAvailabilityRange.objects.filter(week_day=date.weekday(), **condition)
+                   .values('instructor_id'))))
+
+
+def split_by_dates(start_datetime, end_datetime, tz):
+    """Return list of (date, begin, end) for the period from start_datetime to end_datetime in time zone tz,
+    split by dates (begin and end are minutes from midnight)"""
+    local_start = start_datetime.astimezone(tz)
+    local_end = end_datetime.astimezone(tz)
+    parts = []
+    this_date = local_start.date()
+    begin = to_minutes(local_start.time())
+    while this_date <= local_end.date():
+        end = to_minutes(local_end.time()) if this_date == local_end.date() else MINUTES_PER_DAY
+        if begin < end:
+            parts.append((this_date, begin, end))
+        this_date += timezone.timedelta(days=1)
+        begin = 0
+    return parts
+
+
+def get_available_instructors(queryset, start_datetime, end_datetime, default_time_zone='US/Eastern'):
+    """Filter instructors of queryset whose availability covers the period from start_datetime to end_datetime
+    (aware datetimes). Availability is expressed in instructor's time zone, so a condition is built for each
+    time zone present in queryset; instructors without time zone are evaluated in default_time_zone."""
+    conditions = Q(id__in=[])
+    for time_zone in queryset.order_by().values_list('timezone', flat=True).distinct():
+        tz = timezone.pytz.timezone(time_zone or default_time_zone)
+        # a period crossing midnight requires availability in both dates
+        tz_condition = Q(timezone=time_zone)
+        for date, begin, end in split_by_dates(start_datetime, end_datetime, tz):
+            tz_condition &= available_in_date_condition(date, begin, end)
+        conditions |= tz_condition
+    return queryset.filter(conditions)
+
+
+def get_instructors_available_in(queryset, periods, default_time_zone='US/Eastern'):
+    """Filter instructors of queryset whose availability overlaps any of periods (list of (start, end) aware
+    datetimes). It's required to have an open slot in periods, so candidates are discarded in database before
+    their slots are computed. Time zones are handled as in get_available_instructors."""
+    conditions = Q(id__in=[])
+    for time_zone in queryset.order_by().values_list('timezone', flat=True).distinct():
+        tz = timezone.pytz.timezone(time_zone or default_time_zone)
+        tz_condition = Q(id__in=[])
+        for start_datetime, end_datetime in periods:
+            for date, begin, end in split_by_dates(start_datetime, end_datetime, tz):
+                tz_condition |= available_in_date_condition(date, begin, end, lookup='overlap')
+        conditions |= Q(timezone=time_zone) & tz_condition
+    return queryset.filter(conditions)
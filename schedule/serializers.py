@@ -1,12 +1,22 @@
+from django.utils import timezone
+
 from rest_framework import serializers
 
+from core.constants import (LESSON_DURATION_30, LESSON_DURATION_CHOICES, SKILL_LEVEL_BEGINNER,
+                            SKILL_LEVEL_CHOICES)
 from core.utils import DayChoices
 
+from .intervals import MINUTES_PER_DAY, normalize, to_minutes
+
+MAX_RANGE_DAYS = 366
+
 
 class InstructorAvailabilitySerializer(serializers.Serializer):
     dates = serializers.ListField(child=serializers.DateField(format='%Y-%m-%d'), required=False)
     weekDays = serializers.ListField(child=serializers.ChoiceField(choices=list(DayChoices.labels.keys())), required=False)
     intervals = serializers.ListField(child=serializers.DictField())
+    fromDate = serializers.DateField(format='%Y-%m-%d', required=False)
+    toDate = serializers.DateField(format='%Y-%m-%d', required=False)
 
     def validate_intervals(self, value_list):
         for item in value_list:
@@ -23,4 +33,75 @@ class InstructorAvailabilitySerializer(serializers.Serializer):
     def validate(self, attrs):
         if not attrs.get('dates') and not attrs.get('weekDays'):
             raise serializers.ValidationError('dates or weekDays value must be provided')
+        if attrs.get('fromDate') or attrs.get('toDate'):
+            # range mode: intervals are applied to dates of provided week days, from fromDate to toDate
+            if not attrs.get('fromDate') or not attrs.get('toDate') or not attrs.get('weekDays'):
+                raise serializers.ValidationError('fromDate, toDate and weekDays values must be provided together')
+            if attrs['toDate'] < attrs['fromDate']:
+                raise serializers.ValidationError('toDate value cannot be previous to fromDate value')
+            qty_days = (attrs['toDate'] - attrs['fromDate']).days + 1
+            if qty_days > MAX_RANGE_DAYS:
+                raise serializers.ValidationError(f'Range of dates cannot be longer than {MAX_RANGE_DAYS} days')
+            week_days = [getattr(DayChoices, item) for item in attrs['weekDays']]
+            attrs['dates'] = [attrs['fromDate'] + timezone.timedelta(days=day) for day in range(qty_days)
+                              if (attrs['fromDate'] + timezone.timedelta(days=day)).weekday() in week_days]
+            if not attrs['dates']:
+                raise serializers.ValidationError('There are not dates with provided weekDays in that range')
+        return attrs
+
+
+class FreeSlotsQueryParamsSerializer(serializers.Serializer):
+    """Serializer to be used with GET parameters in free slots search endpoint"""
+    instrument = serializers.CharField(max_length=250)
+    skill_level = serializers.ChoiceField(choices=SKILL_LEVEL_CHOICES, default=SKILL_LEVEL_BEGINNER)
+    lessons_duration = serializers.ChoiceField(choices=LESSON_DURATION_CHOICES, default=LESSON_DURATION_30)
+    timezone = serializers.CharField(max_length=50, default='US/Eastern')
+    start_date = serializers.DateField(format='%Y-%m-%d', required=False)
+    days = serializers.IntegerField(min_value=1, max_value=28, default=7)
+    windows = serializers.CharField(max_length=500, default='00:00-24:00')
+    week_days = serializers.CharField(max_length=200, required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=50, default=10)
+
+    def to_internal_value(self, data):
+        new_data = data.copy()
+        keys = dict.fromkeys(data, 1)
+        if keys.get('skillLevel'):
+            new_data['skill_level'] = new_data.pop('skillLevel')
+        if keys.get('lessonDuration'):
+            new_data['lessons_duration'] = new_data.pop('lessonDuration')
+        if keys.get('startDate'):
+            new_data['start_date'] = new_data.pop('startDate')
+        if keys.get('weekDays'):
+            new_data['week_days'] = new_data.pop('weekDays')
+        return super().to_internal_value(new_data)
+
+    def validate_timezone(self, value):
+        if value not in timezone.pytz.all_timezones:
+            raise serializers.ValidationError('{} is not a valid timezone value'.format(value))
+        return value
+
+    def validate_windows(self, value):
+        """Return a list of intervals (minutes from midnight), from a string like 16:00-18:00,19:00-20:00"""
+        intervals = []
+        for item in value.split(','):
+            try:
+                begin, end = [to_minutes(time_str) for time_str in item.split('-')]
+            except ValueError:
+                raise serializers.ValidationError('windows value should have format HH:MM-HH:MM,HH:MM-HH:MM')
+            if begin < 0 or end > MINUTES_PER_DAY or begin >= end:
+                raise serializers.ValidationError('{} is not a valid window'.format(item))
+            intervals.append((begin, end))
+        return normalize(intervals)
+
+    def validate_week_days(self, value):
+        week_days = []
+        for item in value.split(','):
+            if item not in DayChoices.labels.keys():
+                raise serializers.ValidationError('{} is not a valid weekDays value'.format(item))
+            week_days.append(getattr(DayChoices, item))
+        return week_days
+
+    def validate(self, attrs):
+        week_days = attrs.pop('week_days', list(DayChoices.values.keys()))
+        attrs['windows'] = {week_day: attrs['windows'] for week_day in week_days}
         return attrs
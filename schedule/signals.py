@@ -0,0 +1,38 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from lesson.models import Lesson
+
+from .utils import update_week_occupancy
+
+
+def update_occupancies_on_commit(items):
+    """Update occupancy of weeks including items (instructor_id, datetime), after transaction commit"""
+    items = {item for item in items if item[0] and item[1]}
+    if items:
+        transaction.on_commit(lambda: [update_week_occupancy(*item) for item in items])
+
+
+@receiver(post_init, sender=Lesson)
+def remember_lesson_schedule(sender, instance, **kwargs):
+    # values are taken from __dict__, to avoid queries for deferred fields
+    instance._occupancy_item = (instance.__dict__.get('instructor_id'), instance.__dict__.get('scheduled_datetime'))
+
+
+@receiver(post_save, sender=Lesson)
+def update_lesson_occupancy(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_occupancy_item', (None, None))
+    # scheduled_datetime could be assigned as string, so stored value is read
+    current = tuple(Lesson.objects.filter(id=instance.id).values_list('instructor_id', 'scheduled_datetime').first()
+                    or (None, None))
+    if previous != current:
+        update_occupancies_on_commit([previous, current])
+    instance._occupancy_item = current
+
+
+@receiver(post_delete, sender=Lesson)
+def remove_lesson_occupancy(sender, instance, **kwargs):
+    update_occupancies_on_commit([(instance.instructor_id, instance.scheduled_datetime)])
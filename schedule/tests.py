@@ -1,3 +1,239 @@
-from django.test import TestCase
+import datetime
 
-# Create your tests here.
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from accounts.models import Instructor
+from lesson.models import Lesson
+
+from .intervals import datetime_interval, intersect, localize_datetime, normalize, subtract
+from .models import (InstructorParticularAvailability, InstructorRegularAvailability, InstructorWeekOccupancy,
+                     ParticularAvailabilityRange,
+                     get_available_instructors, get_instructor_schedule, get_instructor_schedules,
+                     get_instructors_available_in,
+                     set_particular_availability, set_regular_availability)
+from .serializers import InstructorAvailabilitySerializer
+from .utils import (OVERBOOKED_WEEK_MINUTES, compose_schedule_data, get_free_slots, get_overbooking_penalties,
+                    update_week_occupancy)
+
+
+class InstructorSchedulesTest(TestCase):
+    fixtures = ['01_core_users.json', '02_accounts_instructors.json']
+
+    def setUp(self):
+        self.instructor = Instructor.objects.first()
+        self.monday = datetime.date(2020, 11, 2)
+        InstructorRegularAvailability.objects.create(instructor=self.instructor, week_day=0,
+                                                     schedule=[{'beginTime': '08:00', 'endTime': '10:00'}])
+        InstructorParticularAvailability.objects.create(instructor=self.instructor,
+                                                        date=self.monday + datetime.timedelta(days=7),
+                                                        schedule=[{'beginTime': '14:00', 'endTime': '16:00'}])
+
+    def test_same_as_single_date(self):
+        dates = [self.monday + datetime.timedelta(days=day) for day in range(14)]
+        with self.assertNumQueries(2):
+            schedules = get_instructor_schedules(self.instructor, dates)
+        for date in dates:
+            self.assertEqual(schedules[date], get_instructor_schedule(self.instructor, date))
+        self.assertEqual(schedules[self.monday], [{'beginTime': '08:00', 'endTime': '10:00'}])
+        self.assertEqual(schedules[self.monday + datetime.timedelta(days=7)],
+                         [{'beginTime': '14:00', 'endTime': '16:00'}])
+        self.assertEqual(schedules[self.monday + datetime.timedelta(days=1)], {})
+
+
+class AvailabilityRangesTest(TestCase):
+    fixtures = ['01_core_users.json', '02_accounts_instructors.json']
+
+    def setUp(self):
+        self.instructor = Instructor.objects.first()
+        self.monday = datetime.date(2020, 11, 2)
+        self.regular = InstructorRegularAvailability.objects.create(
+            instructor=self.instructor, week_day=0,
+            schedule=[{'beginTime': '10:00', 'endTime': '12:00'}, {'beginTime': '08:00', 'endTime': '10:00'}]
+        )
+        InstructorParticularAvailability.objects.create(instructor=self.instructor,
+                                                        date=self.monday + datetime.timedelta(days=7),
+                                                        schedule=[])
+
+    def test_ranges_stored(self):
+        self.assertEqual([(item.minutes.lower, item.minutes.upper) for item in self.regular.ranges.all()],
+                         [(480, 720)])
+        self.regular.schedule = [{'beginTime': '09:00', 'endTime': '09:30'}]
+        self.regular.save()
+        self.assertEqual([(item.minutes.lower, item.minutes.upper) for item in self.regular.ranges.all()],
+                         [(540, 570)])
+
+    @override_settings(AVAILABILITY_READ_RANGES=True)
+    def test_read_from_ranges(self):
+        dates = [self.monday + datetime.timedelta(days=day) for day in range(14)]
+        with self.assertNumQueries(4):
+            schedules = get_instructor_schedules(self.instructor, dates)
+        self.assertEqual(schedules[self.monday], [{'beginTime': '08:00', 'endTime': '12:00'}])
+        self.assertEqual(schedules[self.monday + datetime.timedelta(days=7)], [])
+        self.assertEqual(schedules[self.monday + datetime.timedelta(days=1)], {})
+
+    def test_available_instructors(self):
+        start = localize_datetime(self.monday, datetime.time(9, 0), 'US/Eastern')
+        available = get_available_instructors(Instructor.objects.all(), start, start + datetime.timedelta(hours=1))
+        self.assertEqual(list(available), [self.instructor])
+        # availability registered for a date prevails over regular one
+        next_start = start + datetime.timedelta(days=7)
+        available = get_available_instructors(Instructor.objects.all(), next_start,
+                                              next_start + datetime.timedelta(hours=1))
+        self.assertEqual(list(available), [])
+        # in other time zone, same period is out of availability
+        self.instructor.timezone = 'US/Pacific'
+        self.instructor.save()
+        available = get_available_instructors(Instructor.objects.all(), start, start + datetime.timedelta(hours=1))
+        self.assertEqual(list(available), [])
+
+    def test_instructors_available_in(self):
+        """Instructors with availability overlapping any period are kept"""
+        start = localize_datetime(self.monday, datetime.time(11, 30), 'US/Eastern')
+        periods = [(start, start + datetime.timedelta(hours=2))]
+        self.assertEqual(list(get_instructors_available_in(Instructor.objects.all(), periods)), [self.instructor])
+        later = start + datetime.timedelta(minutes=30)
+        next_week = start + datetime.timedelta(days=7)
+        periods = [(later, later + datetime.timedelta(hours=2)), (next_week, next_week + datetime.timedelta(hours=2))]
+        self.assertEqual(list(get_instructors_available_in(Instructor.objects.all(), periods)), [])
+        self.assertEqual(list(get_instructors_available_in(Instructor.objects.all(), [])), [])
+
+
+class AvailabilityUpsertTest(TestCase):
+    fixtures = ['01_core_users.json', '02_accounts_instructors.json']
+
+    def setUp(self):
+        self.instructor = Instructor.objects.first()
+        self.monday = datetime.date(2020, 11, 2)
+
+    def test_upsert(self):
+        dates = [self.monday + datetime.timedelta(days=day) for day in range(3)]
+        ids = set_particular_availability(self.instructor.id, dates, [{'beginTime': '08:00', 'endTime': '10:00'}])
+        self.assertEqual(sorted(ids.keys()), dates)
+        new_ids = set_particular_availability(self.instructor.id, dates[1:],
+                                              [{'beginTime': '14:00', 'endTime': '15:00'},
+                                               {'beginTime': '16:00', 'endTime': '17:00'}])
+        self.assertEqual(new_ids, {date: ids[date] for date in dates[1:]})
+        self.assertEqual(InstructorParticularAvailability.objects.filter(instructor=self.instructor).count(), 3)
+        self.assertEqual(get_instructor_schedule(self.instructor, dates[0]), [{'beginTime': '08:00', 'endTime': '10:00'}])
+        self.assertEqual(get_instructor_schedule(self.instructor, dates[1]),
+                         [{'beginTime': '14:00', 'endTime': '15:00'}, {'beginTime': '16:00', 'endTime': '17:00'}])
+        self.assertEqual(ParticularAvailabilityRange.objects.filter(instructor=self.instructor).count(), 5)
+        set_regular_availability(self.instructor.id, [0, 1], [{'beginTime': '08:00', 'endTime': '10:00'}])
+        set_regular_availability(self.instructor.id, [1], [])
+        self.assertEqual(InstructorRegularAvailability.objects.get(instructor=self.instructor, week_day=1).schedule, [])
+        self.assertEqual(InstructorRegularAvailability.objects.get(instructor=self.instructor, week_day=1).ranges.count(),
+                         0)
+
+    def test_range_mode(self):
+        ser = InstructorAvailabilitySerializer(data={
+            'weekDays': ['tuesday'], 'fromDate': '2020-11-01', 'toDate': '2020-11-30',
+            'intervals': [{'beginTime': '08:00', 'endTime': '10:00', 'available': True}]
+        })
+        self.assertTrue(ser.is_valid())
+        self.assertEqual(ser.validated_data['dates'], [datetime.date(2020, 11, day) for day in (3, 10, 17, 24)])
+
+
+class FreeSlotsTest(TestCase):
+    fixtures = ['01_core_users.json', '02_accounts_instructors.json']
+
+    def setUp(self):
+        self.monday = datetime.date(2030, 1, 7)
+        self.instructors = list(Instructor.objects.order_by('id')[:2])
+        for instructor in self.instructors:
+            InstructorRegularAvailability.objects.create(instructor=instructor, week_day=0,
+                                                         schedule=[{'beginTime': '08:00', 'endTime': '12:00'}])
+        self.instructors[1].timezone = 'US/Pacific'
+        self.instructors[1].save()
+
+    def test_free_slots(self):
+        instructors = [{'id': item.id, 'timezone': item.timezone} for item in self.instructors]
+        with self.assertNumQueries(3):
+            slots = get_free_slots(instructors, self.monday, 7, {0: [(540, 660)]}, 60, 'US/Eastern')
+        self.assertEqual(list(slots.keys()), [self.instructors[0].id])
+        self.assertEqual([item.astimezone(timezone.pytz.timezone('US/Eastern')).strftime('%H:%M')
+                          for item in slots[self.instructors[0].id]], ['09:00', '09:30', '10:00'])
+        # availability of first instructor (US/Eastern) is 05:00-09:00 in US/Pacific
+        slots = get_free_slots(instructors, self.monday, 7, {0: [(540, 720)]}, 60, 'US/Pacific')
+        self.assertEqual(list(slots.keys()), [self.instructors[1].id])
+        self.assertEqual(len(slots[self.instructors[1].id]), 5)
+
+
+class WeekOccupancyTest(TestCase):
+    fixtures = ['01_core_users.json', '02_accounts_instructors.json', '03_accounts_parents.json',
+                '04_accounts_students.json', '05_lesson_instruments.json', '01_lesson_requests.json',
+                '02_applications.json', '01_payments.json', '04_lesson_bookings.json']
+
+    def setUp(self):
+        self.instructor = Instructor.objects.get(id=1)
+        self.monday = datetime.date(2030, 1, 7)
+        # lessons of booking 1 last 45 minutes
+        for date, time in ((self.monday, datetime.time(9, 0)),
+                           (self.monday + datetime.timedelta(days=1), datetime.time(11, 30))):
+            Lesson.objects.create(booking_id=1, instructor=self.instructor, status=Lesson.SCHEDULED,
+                                  scheduled_datetime=localize_datetime(date, time, 'US/Eastern'))
+
+    def test_occupancy(self):
+        occupancy = update_week_occupancy(self.instructor.id, localize_datetime(self.monday + datetime.timedelta(days=3),
+                                                                               datetime.time(12, 0), 'US/Eastern'))
+        self.assertEqual(occupancy.week_start, self.monday)
+        self.assertEqual(occupancy.lessons_qty, 2)
+        self.assertEqual(occupancy.booked_minutes, 90)
+        expected = [0] * 35
+        expected[0], expected[6], expected[7] = 45, 30, 15
+        self.assertEqual(occupancy.slot_minutes, expected)
+
+    def test_penalties(self):
+        today = timezone.now().date()
+        week_start = today - datetime.timedelta(days=today.weekday())
+        InstructorWeekOccupancy.objects.create(instructor=self.instructor, week_start=week_start, lessons_qty=30,
+                                               booked_minutes=OVERBOOKED_WEEK_MINUTES + 120)
+        self.assertEqual(get_overbooking_penalties([self.instructor.id, 2]), {self.instructor.id: 2})
+
+
+class IntervalsTest(SimpleTestCase):
+
+    def test_normalize(self):
+        self.assertEqual(normalize([(600, 660), (480, 540), (530, 570), (570, 580), (700, 700)]),
+                         [(480, 580), (600, 660)])
+
+    def test_subtract(self):
+        self.assertEqual(subtract([(480, 720), (840, 960)], [(450, 500), (600, 645), (700, 900)]),
+                         [(500, 600), (645, 700), (900, 960)])
+        self.assertEqual(subtract([(480, 540)], [(480, 540)]), [])
+
+    def test_intersect(self):
+        self.assertEqual(intersect([(480, 720), (840, 960)], [(450, 500), (600, 900)]),
+                         [(480, 500), (600, 720), (840, 900)])
+
+    def test_cross_midnight(self):
+        begin = localize_datetime(datetime.date(2020, 11, 2), datetime.time(23, 30), 'America/New_York')
+        self.assertEqual(datetime_interval(begin, 60, datetime.date(2020, 11, 2), 'America/New_York'), (1410, 1440))
+        self.assertEqual(datetime_interval(begin, 60, datetime.date(2020, 11, 3), 'America/New_York'), (0, 30))
+        self.assertIsNone(datetime_interval(begin, 60, datetime.date(2020, 11, 4), 'America/New_York'))
+
+    def test_dst(self):
+        # DST ends on 2020-11-01 in New York, so offset differs from the one of previous day
+        begin = localize_datetime(datetime.date(2020, 11, 1), datetime.time(10, 0), 'America/New_York')
+        self.assertEqual(begin.utcoffset(), datetime.timedelta(hours=-5))
+        begin = localize_datetime(datetime.date(2020, 10, 31), datetime.time(10, 0), 'America/New_York')
+        self.assertEqual(begin.utcoffset(), datetime.timedelta(hours=-4))
+        # a lesson lasting 90 minutes from 00:30 (UTC-4) ends at 01:00 (UTC-5), after occupying 01:00 to 02:00 once
+        begin = localize_datetime(datetime.date(2020, 11, 1), datetime.time(0, 30), 'America/New_York')
+        self.assertEqual(datetime_interval(begin, 90, datetime.date(2020, 11, 1), 'America/New_York'), (30, 120))
+        # clocks are set forward from 02:00 to 03:00 on 2020-03-08, a lesson lasting 60 minutes from 01:30 ends at 03:30
+        begin = localize_datetime(datetime.date(2020, 3, 8), datetime.time(1, 30), 'America/New_York')
+        self.assertEqual(datetime_interval(begin, 60, datetime.date(2020, 3, 8), 'America/New_York'), (90, 210))
+
+    def test_compose_schedule_data(self):
+        lessons = [
+            {'id': 1, 'scheduled_datetime': timezone.datetime(2020, 11, 3, 4, 30, tzinfo=timezone.utc), 'duration': 60},
+            {'id': 2, 'scheduled_datetime': timezone.datetime(2020, 11, 3, 14, 0, tzinfo=timezone.utc), 'duration': 45},
+        ]
+        data = compose_schedule_data([{'beginTime': '08:00', 'endTime': '12:00'},
+                                      {'beginTime': '00:00', 'endTime': '01:00'}],
+                                     lessons, 'America/New_York', '2020-11-03')
+        self.assertEqual(data['lessons'], [{'id': 2, 'time': '09:00'}])
+        self.assertEqual(data['available'], [{'beginTime': '00:30', 'endTime': '01:00'},
+                                             {'beginTime': '08:00', 'endTime': '09:00'},
+                                             {'beginTime': '09:45', 'endTime': '12:00'}])
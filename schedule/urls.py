@@ -7,5 +7,6 @@ app_name = 'schedule'
 
 urlpatterns = [
     path('availability/', views.Availability.as_view(), name='availability'),
+    path('free-slots/', views.FreeSlotsView.as_view(), name='free_slots'),
     path('schedule/', views.Schedule.as_view(), name='schedule'),
 ]
@@ -1,75 +1,184 @@
+import datetime
+
 from django.utils import timezone
 
+from accounts.models import Instructor
+from lesson.models import Lesson
 from lesson.utils import get_date_time_from_datetime_timezone
 
+from .intervals import (DEFAULT_LESSON_DURATION, MINUTES_PER_DAY, datetime_interval, get_duration_minutes,
+                        intersect, intervals_to_schedule, localize_datetime, normalize, schedule_to_intervals,
+                        slot_starts, subtract, to_minutes, to_time_string)
+from .models import InstructorWeekOccupancy, get_instructors_intervals
+
+DEFAULT_TIME_ZONE = 'US/Eastern'
+# timeframes of Availability model (minutes from midnight), as in RANGE_HOURS_CONV
+AVAILABILITY_TIMEFRAMES = [(480, 600), (600, 720), (720, 900), (900, 1080), (1080, 1260)]
+# booked minutes in a week from which an instructor is considered overbooked, and max penalty for that
+OVERBOOKED_WEEK_MINUTES = 20 * 60
+MAX_OVERBOOKING_PENALTY = 10
 
-def get_end_time_lesson(begin_time):
-    """Return end_time for a lesson, calculating from begin_time
+
+def get_end_time_lesson(begin_time, duration=DEFAULT_LESSON_DURATION):
+    """Return end_time for a lesson, calculating from begin_time and duration (minutes)
     :type begin_time: string, format HH:MM
     :return : string, format HH:MM"""
-    hour, minutes = begin_time.split(':')
-    dt = timezone.datetime(2020, 1, 1, int(hour), int(minutes), 0) + timezone.timedelta(minutes=30)
-    return dt.strftime('%H:%M')
-
-
-def compose_schedule_data(orig_data, lessons_qs, time_zone, this_date_str):
-    res_data = {'available': []}
-    if orig_data:
-        # first, order received schedule data
-        av_list = sorted(orig_data, key=lambda item: item.get('beginTime'))
-    else:
-        av_list = []
-    res_data['lessons'] = []
-    for item in lessons_qs.all():
-        date_str, time_str = get_date_time_from_datetime_timezone(item.get('scheduled_datetime'), time_zone)
-        if date_str != this_date_str:
+    return to_time_string((to_minutes(begin_time) + duration) % (24 * 60))
+
+
+def compose_schedule_data(orig_data, lessons, time_zone, this_date_str):
+    """Return available intervals and lessons of a date.
+    :param lessons: iterable of dicts with id, scheduled_datetime and (optional) duration keys,
+    ordered by scheduled_datetime. Lessons starting in previous date are used to reduce availability only."""
+    this_date = timezone.datetime.strptime(this_date_str, '%Y-%m-%d').date()
+    res_data = {'lessons': []}
+    busy = []
+    for item in lessons:
+        interval = datetime_interval(item.get('scheduled_datetime'), item.get('duration') or DEFAULT_LESSON_DURATION,
+                                     this_date, time_zone)
+        if interval is None:
             continue
-        else:
+        busy.append(interval)
+        date_str, time_str = get_date_time_from_datetime_timezone(item.get('scheduled_datetime'), time_zone)
+        if date_str == this_date_str:
             res_data['lessons'].append({'id': item.get('id'), 'time': time_str})
-    lesson_ind = 0
-    qty_lesson = len(res_data['lessons'])
-    for item in av_list:
-        begin_time = item.get('beginTime')
-        end_time = item.get('endTime')
-        if lesson_ind < qty_lesson:
-            lesson_begin_time = res_data['lessons'][lesson_ind].get('time')
-            lesson_end_time = get_end_time_lesson(lesson_begin_time)
-        else:
-            res_data['available'].append({'beginTime': begin_time, 'endTime': end_time})
-            continue
+    res_data['available'] = intervals_to_schedule(subtract(schedule_to_intervals(orig_data), normalize(busy)))
+    return res_data
 
-        # walk on lessons until reach one with some hour coincidence; case 1 in documentation
-        while lesson_ind < qty_lesson and lesson_end_time <= begin_time:
-            lesson_ind += 1
-            if lesson_ind < qty_lesson:
-                lesson_begin_time = res_data['lessons'][lesson_ind].get('time')
-                lesson_end_time = get_end_time_lesson(lesson_begin_time)
-        if lesson_ind == qty_lesson:
-            res_data['available'].append({'beginTime': begin_time, 'endTime': end_time})
-            continue
 
-        # Here, there is some lesson to analyze
-        # cases where lesson ends before availability end; cases 2, 3, 4 in documentation
-        while lesson_ind < qty_lesson and lesson_end_time < end_time:
-            if lesson_begin_time > begin_time:   # case 4 in documentation
-                res_data['available'].append({'beginTime': begin_time, 'endTime': lesson_begin_time})
-            begin_time = lesson_end_time
-            lesson_ind += 1
-            if lesson_ind < qty_lesson:
-                lesson_begin_time = res_data['lessons'][lesson_ind].get('time')
-                lesson_end_time = get_end_time_lesson(lesson_begin_time)
-
-        if lesson_ind < qty_lesson:
-            if lesson_end_time == end_time and lesson_begin_time <= begin_time:   # case 9 in documentation
-                lesson_ind += 1   # get begin, end times of lesson is made at cycle beginning
-            elif lesson_end_time > end_time and lesson_begin_time <= begin_time:   # case 8 in documentation
-                pass
-            elif lesson_begin_time < end_time:   # cases 5, 6 in documentation
-                res_data['available'].append({'beginTime': begin_time, 'endTime': lesson_begin_time})
-                if lesson_end_time == end_time:   # case 5 in documentation
-                    lesson_ind += 1   # get begin, end times of lesson is made at cycle beginning
-            else:   # case 7 in documentation
-                res_data['available'].append({'beginTime': begin_time, 'endTime': end_time})
-        else:
-            res_data['available'].append({'beginTime': begin_time, 'endTime': end_time})
-    return res_data
+def get_lessons_data(queryset):
+    """Return a list of dicts with id, instructor_id, scheduled_datetime and duration (minutes) keys,
+    for lessons of queryset, ordered by scheduled_datetime"""
+    lessons = []
+    for lesson in queryset.values('id', 'instructor_id', 'scheduled_datetime', 'booking__request__lessons_duration',
+                                  'booking__application__request__lessons_duration').order_by('scheduled_datetime'):
+        request_duration = lesson.pop('booking__request__lessons_duration')
+        application_duration = lesson.pop('booking__application__request__lessons_duration')
+        lesson['duration'] = get_duration_minutes(request_duration or application_duration)
+        lessons.append(lesson)
+    return lessons
+
+
+def get_requested_intervals(start_date, qty_days, windows, time_zone):
+    """Return (origin, intervals): origin is midnight of start_date in time_zone, and intervals are requested
+    windows in qty_days from start_date, as minutes from origin (normalized, past times excluded).
+    :param windows: dict {week_day: intervals}, as in get_free_slots"""
+    origin = localize_datetime(start_date, datetime.time(0), time_zone)
+
+    def to_absolute(date, minutes):
+        days, minutes = divmod(minutes, MINUTES_PER_DAY)
+        value = localize_datetime(date + timezone.timedelta(days=days), datetime.time(*divmod(minutes, 60)),
+                                  time_zone) - origin
+        return int(value.total_seconds()) // 60
+
+    requested = []
+    for day in range(qty_days):
+        this_date = start_date + timezone.timedelta(days=day)
+        requested += [(to_absolute(this_date, begin), to_absolute(this_date, end))
+                      for begin, end in windows.get(this_date.weekday(), [])]
+    # past times can't be offered
+    now_minutes = max(-(-int((timezone.now() - origin).total_seconds()) // 60), 0)
+    end_minutes = to_absolute(start_date + timezone.timedelta(days=qty_days), 0)
+    return origin, intersect(normalize(requested), [(now_minutes, end_minutes)])
+
+
+def get_free_slots(instructors, start_date, qty_days, windows, duration, time_zone, step=30, max_slots=10):
+    """Return open slots of several instructors, as a dict {instructor_id: [datetime, ...]}; instructors without
+    open slots are not included. Data is loaded in bulk for all instructors (three queries).
+    :param instructors: iterable of dicts with id and timezone keys
+    :param windows: dict {week_day: intervals}, requested intervals (minutes from midnight, in time_zone)
+    by week day; week days not in windows are not requested.
+    Times are handled as minutes from midnight of start_date in time_zone, so availability of instructors
+    in different time zones can be compared with windows."""
+    origin, requested = get_requested_intervals(start_date, qty_days, windows, time_zone)
+    memo = {}
+
+    def to_absolute(tz_name, date, minutes):
+        key = (tz_name, date, minutes)
+        if key not in memo:
+            days, minutes = divmod(minutes, MINUTES_PER_DAY)
+            value = localize_datetime(date + timezone.timedelta(days=days), datetime.time(*divmod(minutes, 60)),
+                                      tz_name) - origin
+            memo[key] = int(value.total_seconds()) // 60
+        return memo[key]
+
+    instructors = list(instructors)
+    if not requested or not instructors:
+        return {}
+
+    instructor_ids = [item['id'] for item in instructors]
+    # one more day is taken at each side, since dates in instructor's timezone could differ
+    dates = [start_date + timezone.timedelta(days=day) for day in range(-1, qty_days + 1)]
+    availability = get_instructors_intervals(instructor_ids, dates)
+    busy = {}
+    for lesson in get_lessons_data(Lesson.objects.filter(
+            instructor_id__in=instructor_ids,
+            scheduled_datetime__range=(origin - timezone.timedelta(days=1),
+                                       origin + timezone.timedelta(minutes=requested[-1][1])))):
+        begin = int((lesson['scheduled_datetime'] - origin).total_seconds()) // 60
+        busy.setdefault(lesson['instructor_id'], []).append((begin, begin + lesson['duration']))
+
+    result = {}
+    for instructor in instructors:
+        tz_name = instructor['timezone'] or DEFAULT_TIME_ZONE
+        available = normalize([(to_absolute(tz_name, date, begin), to_absolute(tz_name, date, end))
+                               for date, intervals in availability[instructor['id']].items()
+                               for begin, end in intervals])
+        free = intersect(subtract(available, normalize(busy.get(instructor['id'], []))), requested)
+        starts = slot_starts(free, duration, step=step, max_qty=max_slots)
+        if starts:
+            result[instructor['id']] = [origin + timezone.timedelta(minutes=start) for start in starts]
+    return result
+
+
+def get_week_start(date):
+    """Return date of monday in the week of provided date"""
+    return date - timezone.timedelta(days=date.weekday())
+
+
+def update_week_occupancy(instructor_id, datetime_value):
+    """Compute occupancy of instructor in the week including datetime_value (in instructor's time zone)"""
+    instructor = Instructor.objects.filter(id=instructor_id).values('timezone').first()
+    if not instructor:
+        return None
+    time_zone = instructor['timezone'] or DEFAULT_TIME_ZONE
+    week_start = get_week_start(datetime_value.astimezone(timezone.pytz.timezone(time_zone)).date())
+    week_begin = localize_datetime(week_start, datetime.time(0), time_zone)
+    week_end = localize_datetime(week_start + timezone.timedelta(days=7), datetime.time(0), time_zone)
+    lessons_qty = booked_minutes = 0
+    slot_minutes = [0] * (7 * len(AVAILABILITY_TIMEFRAMES))
+    # lessons starting in previous day could end in this week
+    for lesson in get_lessons_data(Lesson.objects.filter(
+            instructor_id=instructor_id,
+            scheduled_datetime__gte=week_begin - timezone.timedelta(days=1),
+            scheduled_datetime__lt=week_end)):
+        if lesson['scheduled_datetime'] >= week_begin:
+            lessons_qty += 1
+        for day in range(7):
+            interval = datetime_interval(lesson['scheduled_datetime'], lesson['duration'],
+                                         week_start + timezone.timedelta(days=day), time_zone)
+            if interval is None:
+                continue
+            booked_minutes += interval[1] - interval[0]
+            for index, (begin, end) in enumerate(AVAILABILITY_TIMEFRAMES):
+                slot_minutes[day * len(AVAILABILITY_TIMEFRAMES) + index] += \
+                    max(min(interval[1], end) - max(interval[0], begin), 0)
+    occupancy, _ = InstructorWeekOccupancy.objects.update_or_create(
+        instructor_id=instructor_id, week_start=week_start,
+        defaults={'lessons_qty': lessons_qty, 'booked_minutes': booked_minutes, 'slot_minutes': slot_minutes}
+    )
+    return occupancy
+
+
+def get_overbooking_penalties(instructor_ids):
+    """Return points to subtract in ranking of overbooked instructors, as a dict {instructor_id: points},
+    from occupancy of current and next week"""
+    week_start = get_week_start(timezone.now().date())
+    penalties = {}
+    for item in InstructorWeekOccupancy.objects.filter(
+            instructor_id__in=instructor_ids,
+            week_start__in=[week_start, week_start + timezone.timedelta(days=7)],
+            booked_minutes__gt=OVERBOOKED_WEEK_MINUTES).values('instructor_id', 'booked_minutes'):
+        points = min((item['booked_minutes'] - OVERBOOKED_WEEK_MINUTES) / 60, MAX_OVERBOOKING_PENALTY)
+        penalties[item['instructor_id']] = max(penalties.get(item['instructor_id'], 0), points)
+    return penalties
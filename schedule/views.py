@@ -1,16 +1,21 @@
-from django.db.models import Q
+from django.db.models import Avg, Count
 from django.utils import timezone
 
 from rest_framework import status, views
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 
+from accounts.models import Instructor, InstructorInstruments
 from core.permissions import AccessForInstructor
 from core.utils import build_error_dict, DayChoices
+from lesson.utils import get_date_time_from_datetime_timezone, get_skill_levels_to_teach
 
-from .models import InstructorParticularAvailability, InstructorRegularAvailability, get_instructor_schedule
-from .serializers import InstructorAvailabilitySerializer
-from .utils import compose_schedule_data
+from .intervals import get_duration_minutes
+from .models import (get_instructor_schedules, get_instructors_available_in, set_particular_availability,
+                     set_regular_availability)
+from .serializers import FreeSlotsQueryParamsSerializer, InstructorAvailabilitySerializer
+from .utils import (compose_schedule_data, get_free_slots, get_lessons_data, get_overbooking_penalties,
+                    get_requested_intervals)
 
 
 class Availability(views.APIView):
@@ -20,27 +25,12 @@ class Availability(views.APIView):
         ser = InstructorAvailabilitySerializer(data=request.data)
         if ser.is_valid():
             if ser.validated_data.get('dates'):
-                for item in ser.validated_data['dates']:
-                    if InstructorParticularAvailability.objects.filter(instructor=request.user.instructor,
-                                                                       date=item).exists():
-                        InstructorParticularAvailability.objects.filter(instructor=request.user.instructor,
-                                                                        date=item)\
-                            .update(schedule=ser.validated_data['intervals'])
-                    else:
-                        InstructorParticularAvailability.objects.create(instructor=request.user.instructor,
-                                                                        date=item,
-                                                                        schedule=ser.validated_data['intervals'])
+                set_particular_availability(request.user.instructor.id, ser.validated_data['dates'],
+                                            ser.validated_data['intervals'])
             else:
-                for item in ser.validated_data['weekDays']:
-                    if InstructorRegularAvailability.objects.filter(instructor=request.user.instructor,
-                                                                    week_day=getattr(DayChoices, item)).exists():
-                        InstructorRegularAvailability.objects.filter(instructor=request.user.instructor,
-                                                                     week_day=getattr(DayChoices, item))\
-                            .update(schedule=ser.validated_data['intervals'])
-                    else:
-                        InstructorRegularAvailability.objects.create(instructor=request.user.instructor,
-                                                                     week_day=getattr(DayChoices, item),
-                                                                     schedule=ser.validated_data['intervals'])
+                set_regular_availability(request.user.instructor.id,
+                                         [getattr(DayChoices, item) for item in ser.validated_data['weekDays']],
+                                         ser.validated_data['intervals'])
             return Response({'message': 'Availability registered successfully'})
         else:
             result = build_error_dict(ser.errors)
@@ -58,20 +48,81 @@ class Schedule(views.APIView):
             except ValueError:
                 pass
         today = timezone.datetime.now()
-        this_date = today - timezone.timedelta(days=(today.weekday() + 1)) \
-            + timezone.timedelta(days=days_to_add)
-        end_date = this_date + timezone.timedelta(days=13)
+        first_date = (today - timezone.timedelta(days=(today.weekday() + 1))
+                      + timezone.timedelta(days=days_to_add)).date()
+        dates = [first_date + timezone.timedelta(days=day) for day in range(14)]
+        instructor = request.user.instructor
+        time_zone = instructor.timezone or instructor.get_timezone_from_location_zipcode()
+        schedules = get_instructor_schedules(instructor, dates)
+        # lessons of whole period, grouped by date in instructor's timezone;
+        # one more day is taken at each side, since dates in timezone could differ from stored ones
+        lessons_by_date = {}
+        for lesson in get_lessons_data(instructor.lessons.filter(
+                scheduled_datetime__date__range=(dates[0] - timezone.timedelta(days=1),
+                                                 dates[-1] + timezone.timedelta(days=1)))):
+            date_str, _ = get_date_time_from_datetime_timezone(lesson['scheduled_datetime'], time_zone)
+            lessons_by_date.setdefault(date_str, []).append(lesson)
         data = []
-        while this_date <= end_date:
-            next_date = this_date + timezone.timedelta(days=1)
-            pre_data = {'date': this_date.strftime('%Y-%m-%d'), 'available': [], 'lessons': []}
-            schedule = get_instructor_schedule(request.user.instructor, this_date.date())
-            lessons_qs = request.user.instructor.lessons\
-                .filter(Q(scheduled_datetime__date=this_date.date()) | Q(scheduled_datetime__date=next_date.date()))\
-                .values('id', 'scheduled_datetime').order_by('scheduled_datetime')
-            time_zone = request.user.instructor.timezone or request.user.instructor.get_timezone_from_location_zipcode()
-            sch_data = compose_schedule_data(schedule, lessons_qs, time_zone, this_date.strftime('%Y-%m-%d'))
+        for this_date in dates:
+            date_str = this_date.strftime('%Y-%m-%d')
+            pre_data = {'date': date_str, 'available': [], 'lessons': []}
+            # lessons of previous date could end in this date
+            previous_date_str = (this_date - timezone.timedelta(days=1)).strftime('%Y-%m-%d')
+            sch_data = compose_schedule_data(schedules[this_date],
+                                             lessons_by_date.get(previous_date_str, []) + lessons_by_date.get(date_str, []),
+                                             time_zone, date_str)
             pre_data.update(sch_data)
             data.append(pre_data)
-            this_date = this_date + timezone.timedelta(days=1)
         return Response(data)
+
+
+class FreeSlotsView(views.APIView):
+    """Search instructors with open slots, for an instrument and skill level, in requested time windows"""
+    permission_classes = (AllowAny, )
+
+    def get(self, request):
+        query_ser = FreeSlotsQueryParamsSerializer(data=request.query_params.dict())
+        if not query_ser.is_valid():
+            result = build_error_dict(query_ser.errors)
+            return Response(result, status=status.HTTP_400_BAD_REQUEST)
+        params = query_ser.validated_data
+        time_zone = params['timezone']
+        start_date = params.get('start_date') or timezone.now().astimezone(timezone.pytz.timezone(time_zone)).date()
+        candidates = Instructor.objects.filter(
+            id__in=InstructorInstruments.objects.filter(instrument__name=params['instrument'],
+                                                        skill_level__in=get_skill_levels_to_teach(params['skill_level']))
+                .values('instructor_id'),
+            complete=True,
+            screened=True,
+        )
+        # instructors without availability in requested windows are discarded in database
+        origin, requested = get_requested_intervals(start_date, params['days'], params['windows'], time_zone)
+        candidates = get_instructors_available_in(candidates, [(origin + timezone.timedelta(minutes=begin),
+                                                                origin + timezone.timedelta(minutes=end))
+                                                               for begin, end in requested])
+        instructors = list(candidates.annotate(rating=Avg('reviews__rating'), reviews_qty=Count('reviews'))
+                           .values('id', 'display_name', 'timezone', 'rating', 'reviews_qty', 'user__date_joined'))
+        slots = get_free_slots(instructors, start_date, params['days'], params['windows'],
+                               get_duration_minutes(params['lessons_duration']), time_zone)
+        max_rating = max([item['rating'] or 0.0 for item in instructors if item['id'] in slots] + [1.0])
+        penalties = get_overbooking_penalties(list(slots.keys()))
+        now = timezone.now()
+        ranked = []
+        for instructor in instructors:
+            if instructor['id'] not in slots:
+                continue
+            # same points as in instructors matching (including overbooking penalty), plus one for each open slot
+            login_points = max(((100 - (now - instructor['user__date_joined']).days) / 100) * 10, -7)
+            rating = instructor['rating'] or 0.0
+            points = login_points + (rating / max_rating) * 10 + len(slots[instructor['id']]) \
+                - penalties.get(instructor['id'], 0)
+            ranked.append((points, {
+                'id': instructor['id'],
+                'displayName': instructor['display_name'],
+                'reviews': {'rating': f'{rating:.1f}', 'quantity': instructor['reviews_qty']}
+                if instructor['reviews_qty'] else {},
+                'slots': [dict(zip(('date', 'time'), get_date_time_from_datetime_timezone(item, time_zone)))
+                          for item in slots[instructor['id']]],
+            }))
+        ranked.sort(key=lambda item: item[0], reverse=True)
+        return Response([item[1] for item in ranked[:params['limit']]])